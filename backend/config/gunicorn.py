@@ -0,0 +1,15 @@
+"""
+Gunicorn server hooks, loaded with `--config python:config.gunicorn`.
+
+Workers are recycled every `--max-requests`; refreshing a stale network
+snapshot in the master before each fork lets the replacement worker start
+from current data instead of rebuilding it privately (core/snapshot.py).
+"""
+
+from typing import Any
+
+
+def pre_fork(server: Any, worker: Any) -> None:
+    from core.snapshot import preload
+
+    preload()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # ============================================================================
@@ -31,6 +32,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.profiling.RequestProfilerMiddleware",
+    "core.middleware.QueryBudgetMiddleware",
     "django_prometheus.middleware.PrometheusAfterMiddleware",
 ]
 
@@ -101,6 +104,132 @@ TIME_ZONE = "America/New_York"
 USE_I18N = True
 USE_TZ = True
 
+# ============================================================================
+# PROVIDER HTTP CACHE (Duffel / Amadeus / FRS-Express)
+# ============================================================================
+# live | cache | record | replay -- see core/provider_http.py
+PROVIDER_HTTP_MODE = os.getenv("PROVIDER_HTTP_MODE", "live")
+PROVIDER_HTTP_CACHE_DIR = Path(
+    os.getenv("PROVIDER_HTTP_CACHE_DIR", BASE_DIR / "provider_cache")
+)
+PROVIDER_HTTP_TTL = int(os.getenv("PROVIDER_HTTP_TTL", 6 * 60 * 60))  # 6 Hours
+
+# ============================================================================
+# LOCAL CACHE LAYER -- see core/cache.py
+# ============================================================================
+# Per-process LRU in front of the shared cache: memory bound, max entry age,
+# and how often the shared invalidation generation is checked.
+CACHE_LOCAL_MAX_BYTES = int(os.getenv("CACHE_LOCAL_MAX_BYTES", 16 * 1024 * 1024))
+CACHE_LOCAL_TTL = int(os.getenv("CACHE_LOCAL_TTL", 30))
+CACHE_GENERATION_CHECK_SECONDS = float(os.getenv("CACHE_GENERATION_CHECK_SECONDS", 1))
+# Shared-cache value encoding: orjson | json | pickle, zlib-compressed above
+# CACHE_COMPRESS_MIN_BYTES.
+CACHE_CODEC = os.getenv("CACHE_CODEC", "orjson")
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 2048))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", 6))
+
+# ============================================================================
+# SEARCH DEMAND -- see core/demand.py
+# ============================================================================
+# Searches are counted in-process and written out at most this often (s).
+DEMAND_FLUSH_SECONDS = float(os.getenv("DEMAND_FLUSH_SECONDS", 30))
+
+# ============================================================================
+# SCHEDULE PROJECTION -- see core/projection.py
+# ============================================================================
+# How far ahead weekly flight patterns are projected, and how long a route's
+# pattern is trusted after a provider last confirmed it.
+SCHEDULE_PROJECTION_HORIZON_DAYS = int(os.getenv("SCHEDULE_PROJECTION_HORIZON_DAYS", 42))
+SCHEDULE_PROJECTION_VALIDITY_DAYS = int(os.getenv("SCHEDULE_PROJECTION_VALIDITY_DAYS", 28))
+
+# ============================================================================
+# PROVIDER BUDGETS -- see core/planning.py
+# ============================================================================
+# Duffel calls per day across every run, on-demand fetch worker included;
+# empty or 0: unlimited.
+DUFFEL_DAILY_BUDGET = int(os.getenv("DUFFEL_DAILY_BUDGET", 100) or 0) or None
+
+# ============================================================================
+# NETWORK TOPOLOGY REGISTRY -- see core/topology.py
+# ============================================================================
+# Discovered O/D edges are re-probed after this many days, or once the rolling
+# sweep has come back empty this many times in a row.
+NETWORK_TOPOLOGY_TTL_DAYS = int(os.getenv("NETWORK_TOPOLOGY_TTL_DAYS", 7))
+NETWORK_EMPTY_STREAK_LIMIT = int(os.getenv("NETWORK_EMPTY_STREAK_LIMIT", 6))
+
+# ============================================================================
+# INGEST RUN METRICS -- see core/runstats.py
+# ============================================================================
+# Peak memory of ingest runs via tracemalloc (slows allocation-heavy code; off
+# by default, turn it on to diagnose a run).
+INGEST_TRACE_MEMORY = os.getenv("INGEST_TRACE_MEMORY", "0") == "1"
+# Directory for the node exporter textfile collector; empty disables the export.
+INGEST_METRICS_TEXTFILE_DIR = os.getenv("INGEST_METRICS_TEXTFILE_DIR", "")
+
+# ============================================================================
+# SEARCH ENGINE -- see core/search.py
+# ============================================================================
+# python: pair itinerary legs in-process | sql: pair them in one CTE query |
+# materialized: read them from the ValidConnection table.
+SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "python")
+# Lifetime of the per-group, per-day candidate leg sets (core/legs.py).
+SEARCH_LEG_CACHE_SECONDS = int(os.getenv("SEARCH_LEG_CACHE_SECONDS", 300))
+
+# ============================================================================
+# NETWORK SNAPSHOT -- see core/snapshot.py
+# ============================================================================
+# Serve search legs from an in-process snapshot preloaded in the gunicorn
+# master (on in production) instead of the leg cache.
+NETWORK_SNAPSHOT = os.getenv("NETWORK_SNAPSHOT", "0") == "1"
+# Upcoming days of departures held in the snapshot.
+NETWORK_SNAPSHOT_DAYS = int(os.getenv("NETWORK_SNAPSHOT_DAYS", 30))
+# How often a worker checks for a newer published snapshot version (s).
+NETWORK_SNAPSHOT_CHECK_SECONDS = float(os.getenv("NETWORK_SNAPSHOT_CHECK_SECONDS", 5))
+# The gunicorn master's copy is refreshed before forking a worker once it is
+# this old, even without ingest changes, e.g. after admin edits (s).
+NETWORK_SNAPSHOT_MAX_AGE = int(os.getenv("NETWORK_SNAPSHOT_MAX_AGE", 15 * 60))
+# Memory-mapped snapshot file written by ingest (core/snapfile.py); empty: off.
+NETWORK_SNAPSHOT_FILE = os.getenv("NETWORK_SNAPSHOT_FILE", "")
+# Long-running ingesters rewrite the file after this many change sets, or
+# once the oldest unwritten one is this old (s), whichever comes first.
+NETWORK_SNAPSHOT_FILE_BATCH = int(os.getenv("NETWORK_SNAPSHOT_FILE_BATCH", 20))
+NETWORK_SNAPSHOT_FILE_MAX_DELAY = float(os.getenv("NETWORK_SNAPSHOT_FILE_MAX_DELAY", 300))
+
+# ============================================================================
+# QUERY BUDGETS -- see core/middleware.py
+# ============================================================================
+# off | warn (log over-budget and N+1 requests) | raise (fail them; tests).
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off")
+# Identical statements per request from which a query shape counts as N+1.
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 5))
+
+# ============================================================================
+# ON-DEMAND REQUEST PROFILING -- see core/profiling.py
+# ============================================================================
+# Requests opt in with a signed X-Profile-Token header (`manage.py
+# profile_token`) or, for staff, ?_profile=1. Profiles land on the logs volume.
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", BASE_DIR / "logs" / "profiles"))
+# Share of opted-in requests actually profiled; 0 disables profiling.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 1.0))
+PROFILE_TOKEN_MAX_AGE = int(os.getenv("PROFILE_TOKEN_MAX_AGE", 3600))
+# Oldest profiles are deleted beyond these caps.
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 200))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", 100 * 1024 * 1024))
+
+# ============================================================================
+# FARE HISTORY -- see core/fares.py
+# ============================================================================
+# Observations younger than this keep full resolution; `downsample_fares`
+# reduces older ones to the latest per flight and observation day.
+FARE_HISTORY_FULL_DAYS = int(os.getenv("FARE_HISTORY_FULL_DAYS", 14))
+
+# ============================================================================
+# DEPARTURE TABLE PARTITIONS (PostgreSQL) -- see core/partitions.py
+# ============================================================================
+# Daily partitions are created this many days ahead; it should cover the
+# scraped windows and the schedule projection horizon.
+PARTITION_DAYS_AHEAD = int(os.getenv("PARTITION_DAYS_AHEAD", 60))
+
 # ============================================================================
 # DEFAULT PRIMARY KEY FIELD TYPE
 # ============================================================================
@@ -16,6 +16,7 @@ ALLOWED_HOSTS = os.getenv(
 # ============================================================================
 INSTALLED_APPS += ["corsheaders"]
 MIDDLEWARE.insert(2, "corsheaders.middleware.CorsMiddleware")
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "warn")
 
 # ============================================================================
 # CORS SETTINGS FOR DEVELOPMENT
@@ -30,6 +30,15 @@ CACHES = {
     }
 }
 
+# Preloaded by the gunicorn master, shared copy-on-write by the workers.
+NETWORK_SNAPSHOT = os.getenv("NETWORK_SNAPSHOT", "1") == "1"
+# Written by the init container and at the end of ingest runs onto the
+# snapshots volume; only the mapped engine reads it, so it is off otherwise.
+NETWORK_SNAPSHOT_FILE = os.getenv(
+    "NETWORK_SNAPSHOT_FILE",
+    str(BASE_DIR / "snapshots" / "network.pfsnap") if SEARCH_ENGINE == "mapped" else "",
+)
+
 # ============================================================================
 # SESSION CONFIGURATION
 # ============================================================================
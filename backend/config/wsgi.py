@@ -5,3 +5,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
 
 application = get_wsgi_application()
+
+# With `gunicorn --preload` this runs once in the master: the forked workers
+# share the snapshot's pages (see core/snapshot.py).
+from core.snapshot import preload  # noqa: E402
+
+preload()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Location, Carrier, Route
+from .models import Location, Carrier, IngestRun, IngestTask, NetworkEdge, Route
 
 
 @admin.register(Location)
@@ -19,3 +19,34 @@ class CarrierAdmin(admin.ModelAdmin):
 class RouteAdmin(admin.ModelAdmin):
     list_display = ("carrier", "origin", "destination", "is_active")
     autocomplete_fields = ["origin", "destination", "carrier"]
+
+
+@admin.register(NetworkEdge)
+class NetworkEdgeAdmin(admin.ModelAdmin):
+    list_display = (
+        "provider",
+        "origin",
+        "destination",
+        "is_active",
+        "last_confirmed_at",
+        "last_probed_at",
+        "empty_streak",
+    )
+    list_filter = ("provider", "is_active")
+    search_fields = ("origin", "destination")
+
+
+class IngestTaskInline(admin.TabularInline):
+    model = IngestTask
+    fields = ("origin", "destination", "date", "status", "api_calls", "changes", "duration_ms")
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(IngestRun)
+class IngestRunAdmin(admin.ModelAdmin):
+    list_display = ("command", "started_at", "finished_at", "budget", "api_calls", "duration")
+    list_filter = ("command",)
+    readonly_fields = ("metrics",)
+    inlines = [IngestTaskInline]
@@ -0,0 +1,274 @@
+"""
+Two-tier response cache: a process-local LRU in front of `django.core.cache`.
+
+Every hit on the shared cache (Redis in production) costs a network round
+trip and an unpickle of the whole payload. `TieredCache` keeps recently used
+values in a per-process LRU, bounded both by entry age (`CACHE_LOCAL_TTL`)
+and by the approximate in-memory size of what it holds
+(`CACHE_LOCAL_MAX_BYTES`, charged as the uncompressed JSON or pickled size), so hot keys are served without touching Redis.
+
+Coherence across gunicorn workers goes through a generation counter stored
+in the shared cache: every invalidation (`delete`/`delete_many`) bumps it and
+logs the keys it dropped under the new generation. Each process compares its
+generation at most once per `CACHE_GENERATION_CHECK_SECONDS` and drops only
+the logged keys it missed, so an ingest job does not turn unrelated entries
+(location lists, other groups' legs) cold. When a log entry is gone or the
+process fell too far behind, its whole local layer is dropped instead. A
+worker may therefore serve a value for at most that long after another
+worker invalidated it.
+
+Values come back shared, not copied: callers must treat them as read-only.
+
+What goes to the shared cache is encoded by `CacheCodec` (`CACHE_CODEC`):
+compact JSON (orjson when installed) instead of a pickled dict, zlib
+compressed once it exceeds `CACHE_COMPRESS_MIN_BYTES`. Search responses
+repeat the same location and carrier strings many times over, so they
+compress well. Values JSON cannot represent are stored as before.
+"""
+
+import json
+import logging
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+from .metrics import CODEC_BYTES, COMPRESSION_RATIO
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "prop_cache_generation"
+# Keys dropped by each invalidation, under the generation it bumped to.
+INVALIDATION_KEY = "prop_cache_invalidated_{}"
+# A process further behind than this drops its local layer instead of
+# replaying the log.
+MAX_REPLAYED_INVALIDATIONS = 100
+_MISSING = object()
+
+# Prefixes of encoded values; anything else was stored as-is.
+RAW_JSON = b"\x00J"
+ZLIB_JSON = b"\x00Z"
+
+
+class CacheCodec:
+    """Encodes values for the shared cache: `json`/`orjson` plus zlib, or `pickle` (as-is)."""
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        compress_min_bytes: Optional[int] = None,
+        level: Optional[int] = None,
+    ) -> None:
+        self.name = name or getattr(settings, "CACHE_CODEC", "orjson")
+        self.compress_min_bytes = (
+            compress_min_bytes
+            if compress_min_bytes is not None
+            else getattr(settings, "CACHE_COMPRESS_MIN_BYTES", 2048)
+        )
+        self.level = level if level is not None else getattr(settings, "CACHE_COMPRESS_LEVEL", 6)
+
+    def dumps(self, value: Any) -> bytes:
+        if self.name == "orjson" and orjson is not None:
+            return orjson.dumps(value)
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    def encode(self, value: Any) -> Any:
+        return self.encode_sized(value)[0]
+
+    def decode(self, stored: Any) -> Any:
+        return self.decode_sized(stored)[0]
+
+    def encode_sized(self, value: Any) -> tuple[Any, Optional[int]]:
+        """The stored form and the uncompressed JSON size (None when stored as-is)."""
+        if self.name == "pickle":
+            return value, None
+        try:
+            raw = self.dumps(value)
+        except TypeError:
+            return value, None
+        stored = RAW_JSON + raw
+        if len(raw) >= self.compress_min_bytes:
+            packed = zlib.compress(raw, self.level)
+            if len(packed) < len(raw):
+                stored = ZLIB_JSON + packed
+        CODEC_BYTES.labels("raw").inc(len(raw))
+        CODEC_BYTES.labels("stored").inc(len(stored))
+        COMPRESSION_RATIO.observe(len(raw) / len(stored))
+        return stored, len(raw)
+
+    def decode_sized(self, stored: Any) -> tuple[Any, Optional[int]]:
+        """The value and its uncompressed JSON size (None when stored as-is)."""
+        if not isinstance(stored, bytes):
+            return stored, None
+        prefix, body = stored[:2], stored[2:]
+        if prefix == ZLIB_JSON:
+            body = zlib.decompress(body)
+        elif prefix != RAW_JSON:
+            return stored, None
+        return (orjson.loads(body) if orjson is not None else json.loads(body)), len(body)
+
+
+class LocalLRU:
+    """Size- and age-bounded LRU; sizes are the uncompressed JSON (or pickled) size of each value."""
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple[float, int, Any]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return _MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(
+        self, key: str, value: Any, timeout: Optional[float] = None, size: Optional[int] = None
+    ) -> None:
+        if size is None:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        ttl = self.ttl if timeout is None else min(timeout, self.ttl)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + ttl, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _drop(self, key: str) -> None:
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def stats(self) -> str:
+        return (
+            f"local cache: {len(self.entries)} keys, {self.bytes / 1024:.0f} KiB, "
+            f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions"
+        )
+
+
+class TieredCache:
+    """The subset of the Django cache API the views use, with a local LRU in front."""
+
+    def __init__(self, backend: Any = None, codec: Optional[CacheCodec] = None) -> None:
+        self.backend = backend or shared_cache
+        self.codec = codec or CacheCodec()
+        self.local = LocalLRU(
+            getattr(settings, "CACHE_LOCAL_MAX_BYTES", 16 * 1024 * 1024),
+            getattr(settings, "CACHE_LOCAL_TTL", 30),
+        )
+        self.check_interval = getattr(settings, "CACHE_GENERATION_CHECK_SECONDS", 1.0)
+        self.generation: Any = None
+        self.checked_at = float("-inf")
+
+    def _sync(self) -> None:
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        self._catch_up(self.backend.get(GENERATION_KEY, 0))
+
+    def _catch_up(self, generation: int) -> None:
+        """Drops the keys other processes invalidated up to `generation`."""
+        if self.generation is not None and generation != self.generation:
+            missed = range(self.generation + 1, generation + 1)
+            logged: dict[str, Any] = {}
+            if 0 < len(missed) <= MAX_REPLAYED_INVALIDATIONS:
+                logged = self.backend.get_many([INVALIDATION_KEY.format(n) for n in missed])
+            if missed and len(logged) == len(missed):
+                for keys in logged.values():
+                    for key in keys:
+                        self.local.delete(key)
+            else:
+                # Behind, restarted or a log entry expired: start over.
+                logger.debug(f"Cache generation {self.generation} -> {generation}: local layer dropped")
+                self.local.clear()
+        self.generation = generation
+
+    def _bump(self, keys: list[str]) -> None:
+        self.backend.add(GENERATION_KEY, 0, timeout=None)
+        try:
+            generation = self.backend.incr(GENERATION_KEY)
+        except ValueError:
+            # Evicted between add() and incr(): restart the counter.
+            generation = 1
+            self.backend.set(GENERATION_KEY, generation, timeout=None)
+        # Kept well past the local TTL: a process that has not checked for
+        # longer holds nothing that could still be stale.
+        self.backend.set(INVALIDATION_KEY.format(generation), keys, timeout=max(self.local.ttl * 4, 60))
+        # Our own keys are already gone; catch up on everyone else's.
+        self._catch_up(generation - 1)
+        self.generation = generation
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self._sync()
+        value = self.local.get(key)
+        if value is not _MISSING:
+            return value
+        stored = self.backend.get(key, _MISSING)
+        if stored is _MISSING:
+            return default
+        # Charged at its uncompressed size: that is what the decoded value
+        # weighs in memory, not the zlib stream it came from.
+        value, size = self.codec.decode_sized(stored)
+        self.local.set(key, value, size=size)
+        return value
+
+    def set(self, key: str, value: Any, timeout: Optional[float] = None) -> None:
+        stored, size = self.codec.encode_sized(value)
+        self.backend.set(key, stored, timeout)
+        self.local.set(key, value, timeout, size=size)
+
+    def delete(self, key: str) -> None:
+        self.delete_many([key])
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        if not keys:
+            return
+        self.backend.delete_many(keys)
+        for key in keys:
+            self.local.delete(key)
+        self._bump(keys)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self.local.clear()
+
+
+cache = TieredCache()
@@ -0,0 +1,112 @@
+"""
+Maintenance of the `ValidConnection` table.
+
+Which two-leg connections are valid depends only on the departures loaded at
+ingest, so rather than pairing legs on every search cache miss the ingesters
+call `refresh_connections()` with the dates their change set touched. The
+refresh recomputes the connections whose first leg departs on an affected
+day or the day before (an overnight connection reaches one day ahead) and
+swaps them in inside one transaction, so searches never see a half-built day.
+
+The pairing rules are the search engines' own (`core/search.py`): a bookable
+flight into a hub, then a flight or ferry out of the same alias group to a
+different group, within the MIN_CONNECT_*/MAX_CONNECT gaps.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Iterable, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FlightInstance, Sailing, ValidConnection
+from .search import BOOKABLE_FLIGHTS, MAX_CONNECT, MIN_CONNECT_FERRY, MIN_CONNECT_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+GROUP_RELATIONS = ("route__origin__parent", "route__destination__parent")
+
+
+def build_connections(days: set[date]) -> list[ValidConnection]:
+    """Every valid connection whose first leg departs on one of `days`."""
+    if not days:
+        return []
+    leg2_days = days | {d + timedelta(days=1) for d in days}
+
+    leg1_flights = FlightInstance.objects.filter(
+        BOOKABLE_FLIGHTS,
+        date__in=days,
+        route__is_active=True,
+        route__arrival_time__isnull=False,
+    ).select_related(*GROUP_RELATIONS)
+
+    # Leg-2 candidates by (origin group, date): (leg, departure, destination group).
+    departures: dict[tuple[str, date], list[tuple[Any, Any, str]]] = defaultdict(list)
+    for f in FlightInstance.objects.filter(
+        BOOKABLE_FLIGHTS,
+        date__in=leg2_days,
+        route__is_active=True,
+        route__departure_time__isnull=False,
+    ).select_related(*GROUP_RELATIONS):
+        departures[(f.route.origin.group_code, f.date)].append(
+            (f, f.route.departure_time, f.route.destination.group_code)
+        )
+    for s in Sailing.objects.filter(date__in=leg2_days, route__is_active=True).select_related(
+        *GROUP_RELATIONS
+    ):
+        departures[(s.route.origin.group_code, s.date)].append(
+            (s, s.departure_time, s.route.destination.group_code)
+        )
+
+    rows = []
+    for l1 in leg1_flights:
+        hub = l1.route.destination.group_code
+        arrives = datetime.combine(l1.date, l1.route.arrival_time)
+        for day in (l1.date, l1.date + timedelta(days=1)):
+            for leg2, departs, dest_group in departures.get((hub, day), ()):
+                if dest_group == hub:
+                    continue
+                is_ferry = isinstance(leg2, Sailing)
+                gap = (datetime.combine(day, departs) - arrives).total_seconds()
+                if (MIN_CONNECT_FERRY if is_ferry else MIN_CONNECT_FLIGHT) <= gap <= MAX_CONNECT:
+                    rows.append(
+                        ValidConnection(
+                            leg1=l1,
+                            leg2_flight=None if is_ferry else leg2,
+                            leg2_sailing=leg2 if is_ferry else None,
+                            date=l1.date,
+                            gap_seconds=int(gap),
+                            origin_group=l1.route.origin.group_code,
+                            destination_group=dest_group,
+                        )
+                    )
+    return rows
+
+
+def refresh_connections(dates: Optional[Iterable[date]] = None) -> int:
+    """
+    Rebuilds the connections affected by changes on `dates` (all upcoming
+    days when None) and drops past ones. Returns the number of rows written.
+    """
+    today = timezone.localdate()
+    if dates is None:
+        days = set(
+            FlightInstance.objects.filter(date__gte=today).values_list("date", flat=True).distinct()
+        )
+        stale = ValidConnection.objects.all()
+    else:
+        # A changed leg 2 on day D invalidates leg-1 departures on D - 1.
+        days = {d for day in dates for d in (day, day - timedelta(days=1)) if d >= today}
+        stale = ValidConnection.objects.filter(date__in=days)
+    if not days and dates is not None:
+        return 0
+
+    rows = build_connections(days)
+    with transaction.atomic():
+        stale.delete()
+        ValidConnection.objects.filter(date__lt=today).delete()
+        ValidConnection.objects.bulk_create(rows, batch_size=1000)
+    logger.info(f"Refreshed valid connections for {len(days)} days: {len(rows)} rows")
+    return len(rows)
@@ -0,0 +1,59 @@
+"""
+Buffered search-demand counting.
+
+Every search used to upsert its `SearchDemand` row before answering, so each
+request -- cache hits included -- paid a database write. `count()` instead
+adds the search to a per-process counter, and `flush()` writes the counters
+out as one increment per pair at most every `DEMAND_FLUSH_SECONDS` (and when
+the process exits, e.g. on a gunicorn worker recycle). The scheduler ranks
+pairs over days of demand, so a few seconds of lag do not matter.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import SearchDemand
+
+logger = logging.getLogger(__name__)
+
+_pending: Counter[tuple[str, str, date]] = Counter()
+_flushed_at = time.monotonic()
+_lock = threading.Lock()
+
+
+def count(origin: str, destination: str) -> None:
+    """Counts one search of a resolved origin/destination pair."""
+    with _lock:
+        _pending[origin[:5], destination[:5], timezone.localdate()] += 1
+        due = time.monotonic() - _flushed_at >= getattr(settings, "DEMAND_FLUSH_SECONDS", 30)
+    if due:
+        flush()
+
+
+def flush() -> int:
+    """Writes the buffered counters; returns how many pairs were written."""
+    global _flushed_at
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _flushed_at = time.monotonic()
+    for (origin, destination, day), searches in pending.items():
+        SearchDemand.record(origin, destination, searches, day)
+    return len(pending)
+
+
+def _flush_at_exit() -> None:
+    try:
+        flush()
+    except Exception as e:
+        logger.error(f"Could not flush search demand: {e}")
+
+
+atexit.register(_flush_at_exit)
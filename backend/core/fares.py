@@ -0,0 +1,151 @@
+"""
+Append-only fare history.
+
+Reconciliation keeps one FlightInstance per (route, date) and overwrites its
+price in place, so on its own it forgets every earlier fare. The ingest
+pipeline therefore also hands each provider answer to `record_observations()`,
+which appends a `FareObservation` only for flights whose price, currency or
+seat count differs from their latest observation. An unchanged fare costs no
+write at all.
+
+History is kept at full resolution for `FARE_HISTORY_FULL_DAYS`; after that
+`downsample()` keeps only the latest observation per flight and observation
+day, so the newest row of each flight, which the next change is compared
+with, always survives. The `downsample_fares` command runs it after the
+scheduled Duffel fetch. The readers answer the two questions the history exists for: how a
+flight's fare moved (`price_trend`) and the cheapest fare seen per travel day
+(`cheapest_per_day`).
+"""
+
+import logging
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Iterable, Optional
+
+from django.conf import settings
+from django.db.models import F, Min, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import FareObservation, FlightInstance
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+def _fare(row: Any) -> tuple[Optional[Decimal], str, Optional[int]]:
+    """The columns whose change produces a new observation."""
+    price = row.price_amount
+    return (
+        Decimal(str(price)) if price is not None else None,
+        row.currency,
+        row.available_seats,
+    )
+
+
+def record_observations(
+    flights: Iterable[FlightInstance], now: Optional[datetime] = None
+) -> int:
+    """Appends an observation for each priced flight whose fare changed; returns how many."""
+    flights = [f for f in flights if not f.is_projected]
+    if not flights:
+        return 0
+    now = now or timezone.now()
+
+    # Only the newest observation of each (route, date) leaves the database.
+    newest = FareObservation.objects.filter(
+        route_id=OuterRef("route_id"), date=OuterRef("date")
+    ).order_by("-observed_at", "-pk")
+    latest = {
+        (obs.route_id, obs.date): obs
+        for obs in FareObservation.objects.filter(
+            route_id__in={f.route_id for f in flights},
+            date__in={f.date for f in flights},
+            pk=Subquery(newest.values("pk")[:1]),
+        )
+    }
+
+    fresh = [
+        FareObservation(
+            route_id=f.route_id,
+            date=f.date,
+            observed_at=now,
+            price_amount=f.price_amount,
+            currency=f.currency,
+            available_seats=f.available_seats,
+        )
+        for f in flights
+        if (previous := latest.get((f.route_id, f.date))) is None
+        or _fare(previous) != _fare(f)
+    ]
+    FareObservation.objects.bulk_create(fresh)
+    return len(fresh)
+
+
+def downsample(older_than: Optional[datetime] = None) -> int:
+    """
+    Keeps one observation (the latest) per flight and observation day for
+    observations older than `older_than`; returns how many rows were deleted.
+    """
+    if older_than is None:
+        older_than = timezone.now() - timedelta(
+            days=getattr(settings, "FARE_HISTORY_FULL_DAYS", 14)
+        )
+    old = FareObservation.objects.filter(observed_at__lt=older_than)
+
+    keep: dict[tuple[int, date, date], int] = {}
+    drop: list[int] = []
+    for pk, route_id, day, observed_at in old.order_by("observed_at", "pk").values_list(
+        "pk", "route_id", "date", "observed_at"
+    ).iterator(chunk_size=2000):
+        bucket = (route_id, day, timezone.localtime(observed_at).date())
+        if bucket in keep:
+            drop.append(keep[bucket])
+        keep[bucket] = pk
+
+    deleted = 0
+    for i in range(0, len(drop), 500):
+        count, _ = FareObservation.objects.filter(pk__in=drop[i : i + 500]).delete()
+        deleted += count
+    if deleted:
+        logger.info(f"Downsampled fare history: {deleted} observations removed")
+    return deleted
+
+
+def price_trend(
+    origins: Iterable[str], destinations: Iterable[str], day: date
+) -> list[dict[str, Any]]:
+    """Every stored observation of the flights between the codes on `day`, oldest first."""
+    return list(
+        FareObservation.objects.filter(
+            route__origin__code__in=origins,
+            route__destination__code__in=destinations,
+            date=day,
+        )
+        .order_by("observed_at")
+        .values(
+            "observed_at",
+            "price_amount",
+            "currency",
+            "available_seats",
+            flight_number=F("route__flight_number"),
+        )
+    )
+
+
+def cheapest_per_day(
+    origins: Iterable[str], destinations: Iterable[str], start: date, end: date
+) -> dict[date, Decimal]:
+    """The lowest stored fare between the codes for each travel day in [start, end]."""
+    rows = (
+        FareObservation.objects.filter(
+            route__origin__code__in=origins,
+            route__destination__code__in=destinations,
+            date__range=(start, end),
+            price_amount__isnull=False,
+        )
+        .values("date")
+        .annotate(cheapest=Min("price_amount"))
+        .order_by("date")
+    )
+    # Some backends (SQLite) drop the decimal places in MIN().
+    return {row["date"]: Decimal(row["cheapest"]).quantize(CENT) for row in rows}
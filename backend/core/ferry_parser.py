@@ -0,0 +1,161 @@
+"""
+HTML parsing for the FRS-Express booking pages.
+
+Every page is parsed exactly once into a small `ParsedPage` tuple and the
+BeautifulSoup tree is dropped straight away, so the scraper only keeps plain
+strings and dates around while it walks the week probes. Regexes and the
+month lookup table are compiled once at import time instead of inside the
+per-date loops.
+"""
+
+import re
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+
+from bs4 import BeautifulSoup
+
+# lxml is C-backed and several times faster than the pure-Python html.parser.
+PARSER = "lxml"
+
+FRENCH_MONTHS = {
+    "jan": 1,
+    "fév": 2,
+    "fev": 2,
+    "mar": 3,
+    "avr": 4,
+    "mai": 5,
+    "juin": 6,
+    "juil": 7,
+    "aoû": 8,
+    "aou": 8,
+    "sep": 9,
+    "oct": 10,
+    "nov": 11,
+    "déc": 12,
+    "dec": 12,
+}
+# Longest prefixes first so "juil" wins over "jui..." style partial matches.
+_MONTH_PREFIXES = tuple(sorted(FRENCH_MONTHS.items(), key=lambda kv: len(kv[0]), reverse=True))
+
+DATE_DEPART_RE = re.compile("DATE DEPART")
+TRIP_DURATION_RE = re.compile("Durée du voyage")
+DURATION_RE = re.compile(r"(\d+)h(\d+)")
+_DATE_NOISE_RE = re.compile(r"date depart|[.:]")
+
+DEFAULT_DURATION = 120
+MAX_PARENT_DEPTH = 8
+
+
+class ParsedSailing(NamedTuple):
+    departure_time: str
+    arrival_time: str
+    duration_minutes: int
+
+
+class ParsedPage(NamedTuple):
+    # The day the page was rendered for (its "DATE DEPART" header).
+    header_date: Optional[date]
+    # (day, "à partir de" price) for every bookable day in the week strip.
+    week_prices: list[tuple[date, str]]
+    sailings: list[ParsedSailing]
+
+
+def make_soup(content: bytes | str, parser: str = PARSER) -> BeautifulSoup:
+    return BeautifulSoup(content, parser)
+
+
+def parse_french_date(date_str: Optional[str]) -> Optional[date]:
+    if not date_str:
+        return None
+    try:
+        parts = _DATE_NOISE_RE.sub("", date_str.lower()).split()
+        day, month_idx = next(
+            ((int(p), i + 1) for i, p in enumerate(parts) if p.isdigit()),
+            (None, -1),
+        )
+        if not day or month_idx >= len(parts):
+            return None
+
+        month_str = parts[month_idx]
+        month = next((m for k, m in _MONTH_PREFIXES if month_str.startswith(k)), 1)
+        today = datetime.now().date()
+        year = today.year + 1 if month < today.month - 2 else today.year
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_week_prices(soup: BeautifulSoup) -> list[tuple[date, str]]:
+    valid_dates: list[tuple[date, str]] = []
+    for btn in soup.find_all("button"):
+        if "à partir de" not in btn.get_text():
+            continue
+        p_tags = btn.find_all("p", limit=3)
+        if len(p_tags) < 3:
+            continue
+        parsed_date = parse_french_date(p_tags[0].get_text(strip=True))
+        price_text = p_tags[2].get_text(strip=True)
+        if parsed_date and any(c.isdigit() for c in price_text):
+            valid_dates.append((parsed_date, price_text))
+    return valid_dates
+
+
+def parse_daily_schedule(soup: BeautifulSoup) -> list[ParsedSailing]:
+    """
+    Parses the daily ferry schedule from the BeautifulSoup DOM.
+
+    The target website's HTML is heavily nested and lacks semantic class names
+    for departure and arrival times. To reliably find the times associated with a
+    specific trip, we first locate the node containing the text 'Durée du voyage'
+    (Trip Duration). We then traverse up the DOM tree (parent by parent, up to 8 levels deep)
+    until we find a container that holds at least two <time> tags. The first tag is assumed
+    to be the departure time, and the second is the arrival time.
+    """
+    duration_nodes = soup.find_all(string=TRIP_DURATION_RE)
+    if not duration_nodes:
+        return fallback_parse_times(soup)
+
+    sailings = []
+    for dur_node in duration_nodes:
+        container = dur_node.parent
+        times = []
+        depth = 0
+        while depth < MAX_PARENT_DEPTH and container:
+            times = container.find_all("time", limit=2)
+            if len(times) >= 2:
+                break
+            container = container.parent
+            depth += 1
+
+        if len(times) >= 2:
+            duration_mins = DEFAULT_DURATION
+            if match := DURATION_RE.search(dur_node):
+                duration_mins = (int(match.group(1)) * 60) + int(match.group(2))
+            sailings.append(
+                ParsedSailing(
+                    times[0].get_text(strip=True),
+                    times[1].get_text(strip=True),
+                    duration_mins,
+                )
+            )
+    return sailings
+
+
+def fallback_parse_times(soup: BeautifulSoup) -> list[ParsedSailing]:
+    times = [t.get_text(strip=True) for t in soup.find_all("time")]
+    return [
+        ParsedSailing(times[i], times[i + 1], DEFAULT_DURATION)
+        for i in range(0, len(times) - 1, 2)
+    ]
+
+
+def parse_page(content: bytes | str, parser: str = PARSER) -> ParsedPage:
+    soup = make_soup(content, parser)
+    header = soup.find(string=DATE_DEPART_RE)
+    page = ParsedPage(
+        header_date=parse_french_date(header) if header else None,
+        week_prices=parse_week_prices(soup),
+        sailings=parse_daily_schedule(soup),
+    )
+    soup.decompose()
+    return page
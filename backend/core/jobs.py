@@ -0,0 +1,125 @@
+"""
+Lightweight DB-backed job queue for on-demand fetches.
+
+When a search finds nothing, `enqueue_search_miss()` raises deduplicated
+FetchJobs for the requested pair and date. The `run_fetch_worker` command
+claims them with `claim_next()` and runs the regular Duffel / FRS-Express
+fetch logic, so coverage grows toward what users actually search for instead
+of widening the blind sweep.
+"""
+
+import logging
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .constants import DB_TO_SITE_OPTS
+from .models import FetchJob, Location
+
+logger = logging.getLogger(__name__)
+
+# A pair/date fetched this recently is not re-queued; an empty answer is still an
+# answer, and a job that used up its attempts is not retried by the next search.
+COOLDOWN = timedelta(hours=6)
+MAX_ATTEMPTS = 3
+# A job running this long belongs to a worker that died; it is handed out again.
+RUNNING_TIMEOUT = timedelta(minutes=30)
+
+
+def enqueue(kind: str, origin: str, destination: str, day: date) -> bool:
+    """
+    Queues a fetch unless the date is past or beyond the schedule horizon
+    (SCHEDULE_PROJECTION_HORIZON_DAYS), or a job is already open, or finished
+    or failed within COOLDOWN. Returns True when a job for the key is pending
+    or running afterwards.
+    """
+    today = timezone.localdate()
+    if not today <= day <= today + timedelta(days=settings.SCHEDULE_PROJECTION_HORIZON_DAYS):
+        return False
+    key = {"kind": kind, "origin": origin, "destination": destination, "date": day}
+    if FetchJob.objects.filter(
+        status__in=("done", "failed"), updated_at__gte=timezone.now() - COOLDOWN, **key
+    ).exists():
+        return False
+    if FetchJob.objects.filter(status__in=FetchJob.OPEN_STATUSES, **key).exists():
+        return True
+    try:
+        with transaction.atomic():
+            FetchJob.objects.create(**key)
+        logger.info(f"Queued on-demand {kind} fetch {origin}->{destination} on {day}")
+    except IntegrityError:
+        # Another request queued the same job first.
+        pass
+    return True
+
+
+def _airport_code(loc: Location) -> Optional[str]:
+    if loc.location_type == "APT":
+        return loc.code
+    if loc.parent and loc.parent.location_type == "APT":
+        return loc.parent.code
+    return None
+
+
+def _ferry_port(loc: Location) -> Optional[str]:
+    # Only ports the FRS-Express scraper knows how to query.
+    return next((code for code in sorted(loc.resolve_aliases()) if code in DB_TO_SITE_OPTS), None)
+
+
+def enqueue_search_miss(origin_loc: Location, dest_loc: Location, day: date) -> bool:
+    """Queues flight and/or ferry fetches for an empty search; True if any refresh is under way."""
+    refreshing = False
+
+    origin_apt, dest_apt = _airport_code(origin_loc), _airport_code(dest_loc)
+    if origin_apt and dest_apt and origin_apt != dest_apt:
+        refreshing |= enqueue("flight", origin_apt, dest_apt, day)
+
+    origin_port, dest_port = _ferry_port(origin_loc), _ferry_port(dest_loc)
+    if origin_port and dest_port and origin_port != dest_port:
+        refreshing |= enqueue("ferry", origin_port, dest_port, day)
+
+    return refreshing
+
+
+def requeue_stalled() -> int:
+    """Reopens jobs left running by a crashed worker (or fails them after MAX_ATTEMPTS)."""
+    now = timezone.now()
+    stalled = FetchJob.objects.filter(status="running", updated_at__lt=now - RUNNING_TIMEOUT)
+    error = f"Still running after {RUNNING_TIMEOUT}; the worker probably died."
+    failed = stalled.filter(attempts__gte=MAX_ATTEMPTS).update(status="failed", last_error=error, updated_at=now)
+    requeued = stalled.update(status="pending", last_error=error, updated_at=now)
+    if failed or requeued:
+        logger.warning(f"Stalled fetch jobs: {requeued} requeued, {failed} failed")
+    return requeued
+
+
+def claim_next(kinds: Optional[Iterable[str]] = None) -> Optional[FetchJob]:
+    """
+    Atomically moves the oldest pending job (of `kinds`, if given) to running;
+    safe with several workers.
+    """
+    requeue_stalled()
+    pending = FetchJob.objects.filter(status="pending")
+    if kinds is not None:
+        pending = pending.filter(kind__in=kinds)
+    with transaction.atomic():
+        job = pending.select_for_update(skip_locked=True).order_by("created_at").first()
+        if job is None:
+            return None
+        job.status = "running"
+        job.attempts += 1
+        job.save(update_fields=["status", "attempts", "updated_at"])
+    return job
+
+
+def finish(job: FetchJob, error: str = "") -> None:
+    if not error:
+        job.status = "done"
+    else:
+        # Transient provider errors get another go, up to MAX_ATTEMPTS.
+        job.status = "pending" if job.attempts < MAX_ATTEMPTS else "failed"
+    job.last_error = error
+    job.save(update_fields=["status", "last_error", "updated_at"])
@@ -0,0 +1,111 @@
+"""
+Leg-level cache shared by every search that touches the same alias group.
+
+Searches for JFK→DOM, JFK→DMROS and JFK→UVF all start from the same
+"departures from the JFK group over the window" leg set; only the response
+key differs. Leg sets are therefore cached per (direction, alias group,
+date):
+
+- `out`: bookable flights departing the group (direct and leg-1 candidates),
+- `in`: bookable flights and sailings arriving at the group (direct ferries
+  and leg-2 candidates).
+
+A search assembles its window from up to `WINDOW_DAYS + 1` keys per
+direction and fetches only the missing days, in one query per model.
+`reconcile.invalidate_caches` drops the `out` key of a changed row's origin
+group and the `in` key of its destination group for that date; route-level
+edits made outside the ingesters age out after `SEARCH_LEG_CACHE_SECONDS`.
+
+Groups are named by `Location.group_code` through `location_groups()`, a
+code→group map that also canonicalizes the response keys in the views.
+"""
+
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Iterable, Union
+
+from django.conf import settings
+from django.db.models import Q
+
+from .cache import cache
+from .metrics import record_cache
+from .models import FlightInstance, Location, Sailing
+
+# Projected flights carry no seat count but are still offered as departures.
+BOOKABLE_FLIGHTS = Q(available_seats__gt=0) | Q(is_projected=True)
+
+Leg = Union[FlightInstance, Sailing]
+LEG_RELATIONS = ("route", "route__carrier", "route__origin", "route__destination")
+
+LOCATION_GROUPS_KEY = "prop_location_groups"
+
+
+def location_groups() -> dict[str, str]:
+    """Every location code mapped to the code of its alias group."""
+    groups = cache.get(LOCATION_GROUPS_KEY)
+    if groups is None:
+        groups = {
+            code: parent or code
+            for code, parent in Location.objects.values_list("code", "parent__code")
+        }
+        cache.set(LOCATION_GROUPS_KEY, groups, 60 * 60)
+    return groups
+
+
+def group_of(code: str, groups: dict[str, str]) -> str:
+    # Locations added since the map was cached are their own group until it expires.
+    return groups.get(code, code)
+
+
+def leg_key(direction: str, group: str, day: date) -> str:
+    return f"prop_legs_{direction}_{group}_{day:%Y-%m-%d}"
+
+
+def _fetch(direction: str, aliases: list[str], days: list[date]) -> list[Leg]:
+    if direction == "out":
+        return list(
+            FlightInstance.objects.filter(
+                BOOKABLE_FLIGHTS,
+                route__origin__code__in=aliases,
+                date__in=days,
+                route__is_active=True,
+            ).select_related(*LEG_RELATIONS)
+        )
+    flights = FlightInstance.objects.filter(
+        BOOKABLE_FLIGHTS,
+        route__destination__code__in=aliases,
+        date__in=days,
+        route__is_active=True,
+    ).select_related(*LEG_RELATIONS)
+    sailings = Sailing.objects.filter(
+        route__destination__code__in=aliases,
+        date__in=days,
+        route__is_active=True,
+    ).select_related(*LEG_RELATIONS)
+    return [*flights, *sailings]
+
+
+def window_legs(direction: str, aliases: Iterable[str], first: date, last: date) -> list[Leg]:
+    """The `out` or `in` leg set of an alias group from `first` to `last`, in date order."""
+    aliases = list(aliases)
+    group = group_of(aliases[0], location_groups())
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+    by_day: dict[date, list[Leg]] = {}
+    for day in days:
+        legs = cache.get(leg_key(direction, group, day))
+        record_cache(f"legs_{direction}", legs is not None)
+        if legs is not None:
+            by_day[day] = legs
+
+    missing = [day for day in days if day not in by_day]
+    if missing:
+        fetched: dict[date, list[Leg]] = defaultdict(list)
+        for leg in _fetch(direction, aliases, missing):
+            fetched[leg.date].append(leg)
+        ttl = getattr(settings, "SEARCH_LEG_CACHE_SECONDS", 300)
+        for day in missing:
+            by_day[day] = fetched[day]
+            cache.set(leg_key(direction, group, day), by_day[day], ttl)
+
+    return [leg for day in days for leg in by_day[day]]
@@ -0,0 +1,69 @@
+import base64
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ferry_parser import parse_page
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the FRS-Express page parser over saved pages (raw .html files or recorded responses)."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "path",
+            nargs="?",
+            help="Directory of saved pages. Defaults to the recorded FRS responses in PROVIDER_HTTP_CACHE_DIR.",
+        )
+        parser.add_argument("--iterations", type=int, default=5)
+        parser.add_argument(
+            "--parsers",
+            nargs="+",
+            default=["html.parser", "lxml"],
+            help="BeautifulSoup tree builders to compare.",
+        )
+
+    def load_pages(self, root: Path) -> list[bytes]:
+        pages = [p.read_bytes() for p in sorted(root.rglob("*.html"))]
+        # Responses captured with `scrape_ferries --http-mode record`.
+        for p in sorted(root.rglob("*.json")):
+            try:
+                pages.append(base64.b64decode(json.loads(p.read_text())["body"]))
+            except (ValueError, KeyError):
+                continue
+        return pages
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        root = Path(kwargs["path"] or Path(settings.PROVIDER_HTTP_CACHE_DIR) / "frs")
+        if not root.is_dir():
+            raise CommandError(f"No saved pages found at {root}")
+
+        pages = self.load_pages(root)
+        if not pages:
+            raise CommandError(f"No .html pages or recorded responses under {root}")
+
+        iterations = kwargs["iterations"]
+        self.stdout.write(
+            f"⏱️  Parsing {len(pages)} pages x {iterations} iterations "
+            f"({sum(map(len, pages)) / 1024:.0f} KiB per pass)"
+        )
+
+        baseline = None
+        for parser_name in kwargs["parsers"]:
+            sailings = 0
+            start = time.perf_counter()
+            for _ in range(iterations):
+                sailings = sum(len(parse_page(page, parser_name).sailings) for page in pages)
+            elapsed = time.perf_counter() - start
+
+            per_page_ms = elapsed / (len(pages) * iterations) * 1000
+            baseline = baseline or per_page_ms
+            self.stdout.write(
+                f"  {parser_name:<12} {per_page_ms:8.2f} ms/page "
+                f"{len(pages) * iterations / elapsed:8.1f} pages/s "
+                f"x{baseline / per_page_ms:5.2f}  ({sailings} sailings)"
+            )
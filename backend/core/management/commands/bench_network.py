@@ -0,0 +1,212 @@
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.connections import refresh_connections
+from core.partitions import maintain
+from core.runstats import percentile
+from core.search import ENGINES
+from core.synthetic import (
+    NetworkSpec,
+    cache_keys,
+    clear_network,
+    forget_cached,
+    generate_network,
+    parse_spec,
+    query_cache_keys,
+    sample_queries,
+)
+from core.views import RouteViewSet
+
+ENDPOINTS = {
+    "search": ("/api/routes/search/", RouteViewSet.as_view({"get": "search"})),
+    "available_dates": ("/api/routes/available-dates/", RouteViewSet.as_view({"get": "available_dates"})),
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(samples: list[tuple[float, int]]) -> dict[str, Any]:
+    """Latency percentiles (ms) and query counts of (seconds, queries) samples."""
+    latencies = [seconds * 1000 for seconds, _ in samples]
+    queries = [n for _, n in samples]
+    return {
+        "requests": len(samples),
+        "p50_ms": round(percentile(latencies, 50) or 0, 3),
+        "p95_ms": round(percentile(latencies, 95) or 0, 3),
+        "max_ms": round(max(latencies, default=0), 3),
+        "mean_queries": round(sum(queries) / len(queries), 2) if queries else 0,
+        "max_queries": max(queries, default=0),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the search and available-dates endpoints on generated networks of increasing "
+        "scale (cold and warm cache) and writes a JSON report to compare across commits. "
+        "Replaces the synthetic network; only its own cache entries are dropped."
+    )
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--scales",
+            nargs="+",
+            default=["small", "medium"],
+            help="Presets or key=value,... network specs (see generate_network).",
+        )
+        parser.add_argument("--queries", type=int, default=20, help="Random O/D/date queries per scale.")
+        parser.add_argument("--warm-iterations", type=int, default=3, help="Repeats of each query on a warm cache.")
+        parser.add_argument(
+            "--engine",
+            choices=list(ENGINES),
+            default=getattr(settings, "SEARCH_ENGINE", "python"),
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default="bench_report.json", help="Report path ('-' for stdout).")
+        parser.add_argument("--keep", action="store_true", help="Keep the last generated network.")
+
+    def call(self, endpoint: str, params: dict[str, str]) -> tuple[float, int]:
+        path, view = ENDPOINTS[endpoint]
+        request = RequestFactory().get(path, params)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = view(request)
+            response.render()
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError(f"{endpoint} {params} answered {response.status_code}")
+        return elapsed, len(captured)
+
+    def measure(self, endpoint: str, queries: list[dict[str, str]], warm_iterations: int) -> dict[str, Any]:
+        cold, warm, peaks = [], [], []
+        # A cold call starts without the network's legs and the query's responses.
+        network_keys = cache_keys()
+
+        def forget(params: dict[str, str]) -> None:
+            forget_cached(
+                network_keys + query_cache_keys(params["origin"], params["destination"], params.get("date"))
+            )
+
+        for params in queries:
+            forget(params)
+            cold.append(self.call(endpoint, params))
+            for _ in range(warm_iterations):
+                warm.append(self.call(endpoint, params))
+
+        # Traced separately: tracemalloc slows the code it measures.
+        tracemalloc.start()
+        try:
+            for params in queries:
+                forget(params)
+                tracemalloc.reset_peak()
+                self.call(endpoint, params)
+                peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "cold": summarize(cold),
+            "warm": summarize(warm),
+            "peak_memory_kb": {
+                "p50": round(percentile(peaks, 50) or 0, 1),
+                "max": round(max(peaks, default=0), 1),
+            },
+        }
+
+    def bench_scale(self, name: str, spec: NetworkSpec, kwargs: dict[str, Any]) -> dict[str, Any]:
+        start = timezone.localdate() + timedelta(days=1)
+        maintain(start, spec.days)
+        started = time.perf_counter()
+        rows = generate_network(spec, start, kwargs["seed"])
+        generate_seconds = time.perf_counter() - started
+        if kwargs["engine"] == "materialized":
+            refresh_connections([start + timedelta(days=i) for i in range(spec.days)])
+        self.stdout.write(
+            f"🗺️  {name}: {rows['routes']} routes, {rows['flights'] + rows['sailings']} departures "
+            f"generated in {generate_seconds:.1f}s"
+        )
+
+        sampled = sample_queries(spec, start, kwargs["queries"], kwargs["seed"])
+        endpoints = {
+            "search": self.measure(
+                "search",
+                [
+                    {"origin": o, "destination": d, "date": f"{day:%Y-%m-%d}", "engine": kwargs["engine"]}
+                    for o, d, day in sampled
+                ],
+                kwargs["warm_iterations"],
+            ),
+            "available_dates": self.measure(
+                "available_dates",
+                [{"origin": o, "destination": d} for o, d, _ in sampled],
+                kwargs["warm_iterations"],
+            ),
+        }
+        for endpoint, result in endpoints.items():
+            cold, warm = result["cold"], result["warm"]
+            self.stdout.write(
+                f"  {endpoint:<16} cold p50 {cold['p50_ms']:8.2f} ms p95 {cold['p95_ms']:8.2f} ms "
+                f"{cold['mean_queries']:5.1f} q | warm p50 {warm['p50_ms']:7.2f} ms "
+                f"{warm['mean_queries']:4.1f} q | peak {result['peak_memory_kb']['max']:.0f} KiB"
+            )
+        return {
+            "name": name,
+            "spec": spec.as_dict(),
+            "rows": rows,
+            "generate_seconds": round(generate_seconds, 3),
+            "endpoints": endpoints,
+        }
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        try:
+            specs = [(name, parse_spec(name)) for name in kwargs["scales"]]
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"⏱️  {len(specs)} scales x {kwargs['queries']} queries on {connection.vendor} "
+            f"({kwargs['engine']} engine)"
+        )
+        report: dict[str, Any] = {
+            "generated_at": timezone.now().isoformat(),
+            "commit": git_commit(),
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "engine": kwargs["engine"],
+            "queries": kwargs["queries"],
+            "warm_iterations": kwargs["warm_iterations"],
+            "seed": kwargs["seed"],
+            "scales": [],
+        }
+        try:
+            for name, spec in specs:
+                report["scales"].append(self.bench_scale(name, spec, kwargs))
+        finally:
+            if not kwargs["keep"]:
+                clear_network()
+
+        text = json.dumps(report, indent=2)
+        if kwargs["output"] == "-":
+            self.stdout.write(text)
+        else:
+            Path(kwargs["output"]).write_text(text)
+            self.stdout.write(self.style.SUCCESS(f"📄 Report written to {kwargs['output']}"))
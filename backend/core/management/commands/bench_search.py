@@ -0,0 +1,107 @@
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import Location, SearchDemand
+from core.search import ENGINES
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the itinerary search engines against each other on the current database."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--pair",
+            action="append",
+            default=[],
+            help="ORIGIN:DESTINATION to search (repeatable). Defaults to the most searched pairs.",
+        )
+        parser.add_argument("--top", type=int, default=10, help="Demand pairs used when no --pair is given.")
+        parser.add_argument("--date", help="First search date (YYYY-MM-DD). Defaults to tomorrow.")
+        parser.add_argument("--days", type=int, default=7, help="Consecutive search dates per pair.")
+        parser.add_argument("--iterations", type=int, default=3)
+        parser.add_argument(
+            "--engines",
+            nargs="+",
+            default=list(ENGINES),
+            choices=list(ENGINES),
+            help="Engines to compare; the first one is the baseline.",
+        )
+
+    def pairs(self, kwargs: dict[str, Any]) -> list[tuple[str, str]]:
+        if kwargs["pair"]:
+            try:
+                return [tuple(p.upper().split(":", 1)) for p in kwargs["pair"]]  # type: ignore[misc]
+            except ValueError:
+                raise CommandError("--pair takes ORIGIN:DESTINATION")
+        return [
+            (row["origin"], row["destination"])
+            for row in SearchDemand.objects.values("origin", "destination")
+            .annotate(total=Sum("searches"))
+            .order_by("-total")[: kwargs["top"]]
+        ]
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        start = (
+            datetime.strptime(kwargs["date"], "%Y-%m-%d").date()
+            if kwargs["date"]
+            else timezone.localdate() + timedelta(days=1)
+        )
+        dates = [start + timedelta(days=i) for i in range(kwargs["days"])]
+
+        locations = {
+            loc.code: loc
+            for loc in Location.objects.select_related("parent").prefetch_related(
+                "sub_locations", "parent__sub_locations"
+            )
+        }
+        queries = []
+        for origin, dest in self.pairs(kwargs):
+            if origin not in locations or dest not in locations:
+                self.stdout.write(self.style.WARNING(f"⚠️  Skipping unknown pair {origin}:{dest}"))
+                continue
+            origin_aliases = locations[origin].resolve_aliases()
+            dest_aliases = locations[dest].resolve_aliases()
+            queries.extend((origin_aliases, dest_aliases, day) for day in dates)
+        if not queries:
+            raise CommandError("No searchable pairs: pass --pair or record some search demand first.")
+
+        iterations = kwargs["iterations"]
+        self.stdout.write(
+            f"⏱️  {len(queries)} searches x {iterations} iterations on {connection.vendor}"
+        )
+
+        baseline_ms = None
+        baseline_ids = None
+        for name in kwargs["engines"]:
+            engine = ENGINES[name]
+            ids: list[set[str]] = []
+            with CaptureQueriesContext(connection) as captured:
+                begin = time.perf_counter()
+                for _ in range(iterations):
+                    ids = [
+                        {it["id"] for it in engine(o, d, day).search().results}
+                        for o, d, day in queries
+                    ]
+                elapsed = time.perf_counter() - begin
+
+            per_search_ms = elapsed / (len(queries) * iterations) * 1000
+            per_search_sql = len(captured) / (len(queries) * iterations)
+            baseline_ms = baseline_ms or per_search_ms
+            if baseline_ids is None:
+                baseline_ids = ids
+            mismatches = sum(a != b for a, b in zip(ids, baseline_ids))
+            self.stdout.write(
+                f"  {name:<12} {per_search_ms:8.2f} ms/search {per_search_sql:6.1f} queries/search "
+                f"x{baseline_ms / per_search_ms:5.2f}  ({sum(map(len, ids))} itineraries)"
+            )
+            if mismatches:
+                self.stdout.write(
+                    self.style.ERROR(f"  ❌ {name}: {mismatches} searches differ from {kwargs['engines'][0]}")
+                )
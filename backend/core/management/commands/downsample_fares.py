@@ -0,0 +1,26 @@
+from datetime import timedelta
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.fares import downsample
+
+
+class Command(BaseCommand):
+    help = "Reduces old fare observations to the latest per flight and observation day."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--full-days",
+            type=int,
+            default=settings.FARE_HISTORY_FULL_DAYS,
+            help="Days of fare history kept at full resolution.",
+        )
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        cutoff = timezone.now() - timedelta(days=kwargs["full_days"])
+        self.stdout.write(f"📉 Downsampling fare observations older than {cutoff:%Y-%m-%d %H:%M}...")
+        deleted = downsample(cutoff)
+        self.stdout.write(self.style.SUCCESS(f"✨ Removed {deleted} fare observations."))
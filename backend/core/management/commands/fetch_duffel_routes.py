@@ -1,13 +1,22 @@
-import os
 import logging
-import re
 import time
-import requests
-from typing import Any
-from datetime import datetime, timedelta
+from typing import Any, Optional
+from datetime import date, datetime, timedelta
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from core.models import Location, Route, Carrier, FlightInstance
+from core.connections import refresh_connections
+from core.models import FlightInstance, IngestRun
+from core.partitions import maintain, prune
+from core.pipeline import ingest_segments
+from core.planning import allocate_budget, build_refresh_queue, call_allowance
+from core.provider_http import MODES, ProviderHttp
+from core.providers import DuffelAdapter, ProviderError
+from core.projection import project_schedules
+from core.reconcile import ChangeSet, invalidate_caches, task_changes
+from core.runstats import RunStats
+from core.snapfile import publish as publish_snapfile
+from core.topology import TopologyRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -16,176 +25,221 @@ class Command(BaseCommand):
     help = "Fetches strictly DOM-centric flight routes via Duffel API for a rolling 3-Day POC window."
     api_calls = 0
 
-    def get_duffel_headers(self) -> dict[str, str]:
-        return {
-            "Authorization": f"Bearer {os.getenv('DUFFEL_ACCESS_TOKEN')}",
-            "Duffel-Version": "v2",
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.changes = ChangeSet()
+        self.provider = DuffelAdapter()
+        # Set by handle() (or a caller driving fetch_and_save) for call accounting.
+        self.run: Optional[IngestRun] = None
+        self.stats = RunStats()
+        self.http.run_stats = self.stats
+        self.allowance: Optional[int] = None
+        self.last_fetch_failed = False
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--http-mode",
+            choices=MODES,
+            help="Provider response cache mode (defaults to PROVIDER_HTTP_MODE).",
+        )
+        parser.add_argument(
+            "--budget",
+            type=int,
+            help="Max Duffel calls for this run; the rolling sweep is then planned by priority.",
+        )
+        parser.add_argument(
+            "--daily-budget",
+            type=int,
+            default=settings.DUFFEL_DAILY_BUDGET,
+            help="Max Duffel calls per day across all recorded runs (default: DUFFEL_DAILY_BUDGET).",
+        )
+        parser.add_argument(
+            "--reprobe",
+            action="store_true",
+            help="Re-run network discovery for every edge, ignoring the stored topology.",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Finish the unfinished tasks of the last interrupted run instead of starting over.",
+        )
+
+    @property
+    def http(self) -> ProviderHttp:
+        return self.provider.http
 
-    def parse_duration(self, iso_str: Any) -> int:
-        if not iso_str:
-            return 0
-        hours = int(match.group(1)) if (match := re.search(r"(\d+)H", iso_str)) else 0
-        minutes = int(match.group(1)) if (match := re.search(r"(\d+)M", iso_str)) else 0
-        return (hours * 60) + minutes
+    @http.setter
+    def http(self, value: ProviderHttp) -> None:
+        value.run_stats = self.stats
+        self.provider.http = value
+
+    def budget_left(self) -> bool:
+        return self.allowance is None or self.api_calls < self.allowance
 
     def fetch_and_save(self, origin: str, dest: str, date_str: str) -> bool:
+        """Fetches one O/D/date and writes it through the shared pipeline; True if flights were found."""
         target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        self.last_fetch_failed = False
+        if not self.budget_left():
+            return False
         self.stdout.write(
             f"[API Calls: {self.api_calls + 1}] 🔎 Duffel: {origin}->{dest} on {date_str}",
             ending="\r",
         )
 
-        self.api_calls += 1
-        payload = {
-            "data": {
-                "slices": [
-                    {"origin": origin, "destination": dest, "departure_date": date_str}
-                ],
-                "passengers": [{"type": "adult"}],
-                "max_connections": 0,
-            }
-        }
-
+        calls_before = self.provider.api_calls
+        started = time.monotonic()
+        changes: Optional[ChangeSet] = None
         try:
-            res = requests.post(
-                "https://api.duffel.com/air/offer_requests",
-                json=payload,
-                headers=self.get_duffel_headers(),
+            # Flights missing from the response are airline cancellations.
+            changes, found = ingest_segments(
+                origin,
+                dest,
+                target_date,
+                self.provider.segments(origin, dest, target_date),
+                stats=self.stats,
             )
-            if res.status_code == 429:
-                time.sleep(2)
-                return self.fetch_and_save(origin, dest, date_str)
-
-            response_data = res.json().get("data", {})
-        except Exception as e:
+        except ProviderError as e:
             logger.error(f"Request failed: {e}")
+            self.last_fetch_failed = True
+        finally:
+            calls = self.provider.api_calls - calls_before
+            self.api_calls += calls
+
+        if self.run:
+            # A failed task stays unfinished, so a resumed run retries it.
+            self.run.record(
+                origin,
+                dest,
+                target_date,
+                calls,
+                len(changes.changed_keys) if changes is not None else 0,
+                status="done" if changes is not None else "failed",
+                duration_ms=int((time.monotonic() - started) * 1000),
+            )
+        if changes is None:
             return False
+        self.changes.merge(changes)
 
-        offers = response_data.get("offers", [])
-
-        # Overwrite logic: Drops existing records for this day to account for airline cancellations
-        FlightInstance.objects.filter(
-            route__origin__code=origin, route__destination__code=dest, date=target_date
-        ).delete()
-
-        if not offers:
+        if not found:
             return False
 
-        for offer in offers:
-            price = offer.get("total_amount")
-            currency = offer.get("total_currency")
-            seats = 9  # Standardized availability assumption for the Stitcher
-
-            for slice_obj in offer.get("slices", []):
-                segments = slice_obj.get("segments", [])
-                if len(segments) == 1:
-                    cabin = (
-                        segments[0]
-                        .get("passengers", [{}])[0]
-                        .get("cabin_class", "economy")
-                    )
-                    self._process_segment(
-                        segments[0], date_str, price, currency, seats, cabin
-                    )
-
         time.sleep(0.2)
         return True
 
-    def _process_segment(
-        self,
-        segment: dict[str, Any],
-        date_str: str,
-        price: str,
-        currency: str,
-        seats: int,
-        cabin: str,
-    ) -> None:
-        # 1. Safely handle null JSON objects by falling back to {}
-        op_carrier = segment.get("operating_carrier") or {}
-        mkt_carrier = segment.get("marketing_carrier") or {}
-        aircraft_data = segment.get("aircraft") or {}
-
-        # 2. Safely extract codes
-        carrier_code = op_carrier.get("iata_code") or mkt_carrier.get(
-            "iata_code", "UNK"
-        )
-        dep_code = segment["origin"]["iata_code"]
-        arr_code = segment["destination"]["iata_code"]
-
-        carrier, _ = Carrier.objects.get_or_create(
-            code=carrier_code,
-            defaults={
-                "name": op_carrier.get("name", f"Airline {carrier_code}"),
-                "carrier_type": "AIR",
-            },
-        )
-        loc_dep, _ = Location.objects.get_or_create(
-            code=dep_code, defaults={"name": dep_code}
-        )
-        loc_arr, _ = Location.objects.get_or_create(
-            code=arr_code, defaults={"name": arr_code}
-        )
-
-        dep_time = segment["departing_at"].split("T")[1][:5]
-        arr_time = segment["arriving_at"].split("T")[1][:5]
-        flight_num = segment.get("operating_carrier_flight_number") or segment.get(
-            "marketing_carrier_flight_number", ""
-        )
-
-        route, _ = Route.objects.update_or_create(
-            origin=loc_dep,
-            destination=loc_arr,
-            carrier=carrier,
-            departure_time=dep_time,
-            defaults={
-                "is_active": True,
-                "duration_minutes": self.parse_duration(segment.get("duration")),
-                "arrival_time": arr_time,
-                "flight_number": f"{carrier_code} {flight_num}".strip(),
-                "aircraft_type": aircraft_data.get("iata_code", ""),
-            },
-        )
-
-        found_day = str(datetime.strptime(date_str, "%Y-%m-%d").isoweekday())
-        current_days = route.days_of_operation or ""
-        if found_day not in current_days:
-            route.days_of_operation = "".join(sorted(current_days + found_day))
-            route.save()
-
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-        FlightInstance.objects.update_or_create(
-            route=route,
-            date=date_obj,
-            defaults={
-                "price_amount": price,
-                "currency": currency,
-                "available_seats": seats,
-                "cabin_class": cabin,
-            },
+    def sweep(self, topology: TopologyRegistry, origin: str, dest: str, date_str: str) -> None:
+        if not self.budget_left():
+            return
+        found = self.fetch_and_save(origin, dest, date_str)
+        if not self.last_fetch_failed:
+            # Repeated empty days flag the edge for a re-probe on a later run.
+            topology.record(origin, dest, found)
+
+    def resume(self, run: IngestRun, today: date, extra_calls: Optional[int]) -> None:
+        """Re-runs the unfinished tasks of an interrupted run within what is left of its budget."""
+        self.run = run
+        self.api_calls = run.api_calls
+        self.allowance = run.budget
+        if extra_calls is not None:
+            cap = run.api_calls + extra_calls
+            self.allowance = cap if self.allowance is None else min(self.allowance, cap)
+
+        tasks = list(run.unfinished_tasks().filter(date__gte=today))
+        self.stdout.write(
+            self.style.WARNING(
+                f"\n--- RESUMING RUN #{run.pk} ({run.started_at:%Y-%m-%d %H:%M}): "
+                f"{len(tasks)} UNFINISHED TASKS ---"
+            )
         )
+        # Rows the interrupted run wrote before it died were never passed on
+        # to the connection refresh and cache invalidation; cover them now.
+        done = run.tasks.filter(status="done", changes__gt=0, date__gte=today)
+        self.changes.merge(task_changes(done.values_list("origin", "destination", "date")))
+        topology = TopologyRegistry("duffel")
+        for task in tasks:
+            self.sweep(topology, task.origin, task.destination, task.date.strftime("%Y-%m-%d"))
 
     def handle(self, *args: Any, **kwargs: Any) -> None:
         self.stdout.write("✈️  Initializing Global Micro-Network Duffel Scraper...")
 
-        if not os.getenv("DUFFEL_ACCESS_TOKEN"):
+        if kwargs.get("http_mode"):
+            self.http = ProviderHttp("duffel", mode=kwargs["http_mode"])
+
+        if not self.provider.is_configured():
             self.stdout.write(
                 self.style.ERROR("❌ Missing DUFFEL_ACCESS_TOKEN in environment.")
             )
             return
 
+        self.allowance = call_allowance("duffel", kwargs.get("budget"), kwargs.get("daily_budget"))
+        if self.allowance == 0:
+            self.stdout.write(
+                self.style.WARNING("💸 Daily Duffel call budget already spent.")
+            )
+            return
+
         today = datetime.now().date()
-        deleted_flights, _ = FlightInstance.objects.filter(date__lt=today).delete()
+        deleted_flights = prune(FlightInstance, today)
         if deleted_flights:
             self.stdout.write(f"🧹 Pruned {deleted_flights} past flight instances.")
+        maintain(today)
+
+        if kwargs.get("resume"):
+            run = IngestRun.resumable("fetch_duffel_routes")
+            if run is None:
+                self.stdout.write(self.style.WARNING("♻️  No interrupted run to resume."))
+                return
+            self.stats.start()
+            self.resume(run, today, self.allowance)
+        else:
+            self.stats.start()
+            self.run = IngestRun.objects.create(
+                command="fetch_duffel_routes", provider="duffel", budget=self.allowance
+            )
+            self.sweep_network(today, kwargs.get("reprobe", False))
+
+        self.stdout.write(
+            self.style.WARNING("\n--- PHASE 3: WEEKLY SCHEDULE PROJECTION ---")
+        )
+        with self.stats.phase("db"):
+            projected = project_schedules()
+        self.stats.add_changes(projected)
+        self.stdout.write(
+            f"📅 Projected flights: {len(projected.inserted)} new, "
+            f"{len(projected.deleted)} expired, {projected.unchanged} unchanged."
+        )
+        self.changes.merge(projected)
 
+        with self.stats.phase("db"):
+            connections = refresh_connections(self.changes.affected_dates)
+            if self.changes:
+                publish_snapfile()
+            invalidate_caches(self.changes)
+        self.stdout.write(
+            f"\n🔁 Flight changes: {len(self.changes.inserted)} new, "
+            f"{len(self.changes.updated)} updated, {len(self.changes.deleted)} removed, "
+            f"{self.changes.unchanged} unchanged."
+        )
+        self.stdout.write(f"🔗 Valid connections rebuilt: {connections} rows.")
+        if self.http.mode != "live":
+            self.stdout.write(f"🗄️  {self.http.stats()}")
+        metrics = self.stats.close(self.run, self.api_calls, retries=self.provider.retries)
+        self.stdout.write(f"📊 {self.stats.describe(metrics)}")
+        budget_note = f" of {self.allowance} budgeted" if self.allowance is not None else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"\n✨ DONE! Total usage: {self.api_calls}{budget_note} Duffel calls."
+            )
+        )
+
+    def sweep_network(self, today: date, reprobe: bool) -> None:
+        """Phases 1 and 2: map the network, then plan and run the rolling sweep."""
         self.stdout.write(
             self.style.WARNING("\n--- PHASE 1: GLOBAL MICRO-NETWORK DISCOVERY ---")
         )
 
         valid_routes = set()
+        topology = TopologyRegistry("duffel", force=reprobe)
 
         ferry_hubs = ["PTP", "FDF", "UVF"]
         flight_hubs = ["ANU", "BGI"]
@@ -201,24 +255,35 @@ class Command(BaseCommand):
             days_ahead += 7
         next_saturday = (today + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
 
-        if self.fetch_and_save("NYC", "DOM", next_saturday):
-            valid_routes.add(("NYC", "DOM"))
-            valid_routes.add(("DOM", "NYC"))
+        probed_now: set[tuple[str, str]] = set()
+
+        def probe(origin: str, dest: str) -> Optional[bool]:
+            # Only called for edges the registry considers due for a re-probe.
+            if not self.budget_left():
+                return None
+            probed_now.add((origin, dest))
+            found = self.fetch_and_save(origin, dest, next_saturday)
+            return None if self.last_fetch_failed else found
+
+        def edge(origin: str, dest: str) -> bool:
+            served = topology.check(origin, dest, lambda: probe(origin, dest))
+            # Only this direction is probed; the return leg is assumed to match.
+            topology.mirror(origin, dest)
+            if served:
+                valid_routes.add((origin, dest))
+                valid_routes.add((dest, origin))
+            return served
+
+        edge("NYC", "DOM")
 
-        active_flight_hubs = []
-        for hub in flight_hubs:
-            if self.fetch_and_save(hub, "DOM", next_saturday):
-                valid_routes.add((hub, "DOM"))
-                valid_routes.add(("DOM", hub))
-                active_flight_hubs.append(hub)
+        active_flight_hubs = [hub for hub in flight_hubs if edge(hub, "DOM")]
 
         for gateway, valid_hubs in GATEWAY_ROUTES.items():
             for hub in valid_hubs:
                 if hub in ferry_hubs or hub in active_flight_hubs:
-                    if self.fetch_and_save(gateway, hub, next_saturday):
-                        valid_routes.add((gateway, hub))
-                        valid_routes.add((hub, gateway))
+                    edge(gateway, hub)
 
+        self.stdout.write(f"🗺️  {topology.stats()}")
         self.stdout.write(
             self.style.SUCCESS(
                 f"\n✅ Global Network Mapped! Found {len(valid_routes) // 2} active two-way routes."
@@ -232,13 +297,28 @@ class Command(BaseCommand):
             (today + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(1, 4)
         ]
 
-        for date in rolling_dates:
-            for origin, dest in valid_routes:
-                if date != next_saturday:
-                    self.fetch_and_save(origin, dest, date)
-
-        self.stdout.write(
-            self.style.SUCCESS(
-                f"\n✨ DONE! Total usage: {self.api_calls} Duffel calls."
+        if self.allowance is None:
+            # A discovery probe already fetched next Saturday.
+            tasks = [
+                (origin, dest, day)
+                for day in rolling_dates
+                for origin, dest in valid_routes
+                if day != next_saturday or (origin, dest) not in probed_now
+            ]
+            # Checkpoint the sweep so an interrupted run can be resumed.
+            self.run.plan(tasks)
+            for origin, dest, day in tasks:
+                self.sweep(topology, origin, dest, day)
+        else:
+            # Spend what phase 1 left of the budget on the most valuable
+            # (route, date) pairs instead of sweeping all of them.
+            queue = build_refresh_queue(
+                valid_routes, [today + timedelta(days=i) for i in range(1, 4)]
             )
-        )
+            tasks = allocate_budget(queue, self.allowance - self.api_calls)
+            self.stdout.write(
+                f"📋 Budget covers {len(tasks)} of {len(tasks) + len(queue)} refresh tasks."
+            )
+            self.run.plan((t.origin, t.destination, t.date) for t in tasks)
+            for task in tasks:
+                self.sweep(topology, task.origin, task.destination, task.date_str)
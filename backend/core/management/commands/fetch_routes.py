@@ -1,14 +1,22 @@
-import os
 import logging
-import re
 import time
-from typing import Set, Any
-from datetime import datetime, timedelta
+from typing import Set, Any, Optional
+from datetime import date, datetime, timedelta
 
 from django.core.management.base import BaseCommand
-from amadeus import Client, ResponseError
 
-from core.models import Location, Route, Carrier, FlightInstance
+from core.connections import refresh_connections
+from core.models import FlightInstance, IngestRun
+from core.partitions import maintain, prune
+from core.pipeline import ingest_segments
+from core.planning import allocate_budget, build_refresh_queue, call_allowance
+from core.provider_http import MODES, ProviderHttp
+from core.providers import ProviderError
+from core.providers.amadeus import AmadeusAdapter
+from core.reconcile import ChangeSet, invalidate_caches, task_changes
+from core.runstats import RunStats
+from core.snapfile import publish as publish_snapfile
+from core.topology import TopologyRegistry
 from core.constants import TARGETS, REGIONAL_HUBS, GATEWAYS
 
 logger = logging.getLogger(__name__)
@@ -18,131 +26,143 @@ class Command(BaseCommand):
     help = "Fetches flight routes for a continuous 14-Day Free-Tier Proof of Concept window."
     api_calls = 0
 
-    def parse_duration(self, iso_str: Any) -> int:
-        if not iso_str:
-            return 0
-        hours = int(match.group(1)) if (match := re.search(r"(\d+)H", iso_str)) else 0
-        minutes = int(match.group(1)) if (match := re.search(r"(\d+)M", iso_str)) else 0
-        return (hours * 60) + minutes
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.changes = ChangeSet()
+        self.provider = AmadeusAdapter()
+        self.run: Optional[IngestRun] = None
+        self.stats = RunStats()
+        self.http.run_stats = self.stats
+        self.allowance: Optional[int] = None
 
-    def get_valid_destinations(self, amadeus: Client, origin: str) -> Set[str]:
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--http-mode",
+            choices=MODES,
+            help="Provider response cache mode (defaults to PROVIDER_HTTP_MODE).",
+        )
+        parser.add_argument(
+            "--budget",
+            type=int,
+            help="Max Amadeus calls for this run; the sweep is then planned by priority.",
+        )
+        parser.add_argument(
+            "--daily-budget",
+            type=int,
+            help="Max Amadeus calls per day across all recorded runs.",
+        )
+        parser.add_argument(
+            "--reprobe",
+            action="store_true",
+            help="Re-run topology mapping for every origin, ignoring the stored topology.",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Finish the unfinished tasks of the last interrupted run instead of starting over.",
+        )
+
+    def budget_left(self) -> bool:
+        return self.allowance is None or self.api_calls < self.allowance
+
+    @property
+    def http(self) -> ProviderHttp:
+        return self.provider.http
+
+    @http.setter
+    def http(self, value: ProviderHttp) -> None:
+        value.run_stats = self.stats
+        self.provider.http = value
+
+    def _spend(self, calls_before: int) -> int:
+        calls = self.provider.api_calls - calls_before
+        self.api_calls += calls
+        return calls
+
+    def get_valid_destinations(self, origin: str) -> Optional[Set[str]]:
+        if not self.budget_left():
+            return None
+        calls_before = self.provider.api_calls
         try:
-            self.api_calls += 1
-            response = amadeus.airport.direct_destinations.get(
-                departureAirportCode=origin
-            )
-            return (
-                {item["iataCode"] for item in response.data} if response.data else set()
-            )
-        except ResponseError:
-            return set()
+            return self.provider.direct_destinations(origin)
+        except ProviderError:
+            return None
+        finally:
+            self._spend(calls_before)
 
-    def fetch_and_save(self, amadeus: Client, origin: str, dest: str, date_str: str) -> None:
+    def fetch_and_save(self, origin: str, dest: str, date_str: str) -> Optional[bool]:
+        """Returns whether flights were found, or None when no answer was obtained."""
         target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        if not self.budget_left():
+            return None
         self.stdout.write(
             f"[API Calls: {self.api_calls + 1}] 🔎 Checking {origin}->{dest} on {date_str}",
             ending="\r",
         )
 
+        calls_before = self.provider.api_calls
+        started = time.monotonic()
+        changes: Optional[ChangeSet] = None
         try:
-            self.api_calls += 1
-            response = amadeus.shopping.flight_offers_search.get(
-                originLocationCode=origin,
-                destinationLocationCode=dest,
-                departureDate=date_str,
-                adults=1,
-                max=10,
-                nonStop="true",
+            # Flights missing from the response are airline cancellations.
+            changes, found = ingest_segments(
+                origin,
+                dest,
+                target_date,
+                self.provider.segments(origin, dest, target_date),
+                stats=self.stats,
             )
-        except ResponseError as e:
-            if e.code == 429:
-                time.sleep(2)
-            return
+        except ProviderError:
+            pass
+        finally:
+            calls = self._spend(calls_before)
 
-        if response.data is not None:
-            # Overwrite logic: Drops existing records for this day to account for airline cancellations
-            FlightInstance.objects.filter(
-                route__origin__code=origin,
-                route__destination__code=dest,
-                date=target_date,
-            ).delete()
-
-            for offer in response.data:
-                price = offer.get("price", {}).get("total")
-                currency = offer.get("price", {}).get("currency")
-                seats = offer.get("numberOfBookableSeats")
-
-                for itinerary in offer.get("itineraries", []):
-                    segments = itinerary.get("segments", [])
-                    if len(segments) == 1:
-                        cabin = (
-                            offer.get("travelerPricings", [{}])[0]
-                            .get("fareDetailsBySegment", [{}])[0]
-                            .get("cabin", "")
-                        )
-                        self._process_segment(
-                            segments[0], date_str, price, currency, seats, cabin
-                        )
+        if self.run:
+            # A failed task stays unfinished, so a resumed run retries it.
+            self.run.record(
+                origin,
+                dest,
+                target_date,
+                calls,
+                len(changes.changed_keys) if changes is not None else 0,
+                status="done" if changes is not None else "failed",
+                duration_ms=int((time.monotonic() - started) * 1000),
+            )
+        if changes is None:
+            return None
+        self.changes.merge(changes)
         time.sleep(0.1)
+        return bool(found)
 
-    def _process_segment(
-        self,
-        segment: dict[str, Any],
-        date_str: str,
-        price: str,
-        currency: str,
-        seats: int,
-        cabin: str,
-    ) -> None:
-        carrier_code = segment["carrierCode"]
-        dep_code = segment["departure"]["iataCode"]
-        arr_code = segment["arrival"]["iataCode"]
-
-        carrier, _ = Carrier.objects.get_or_create(
-            code=carrier_code,
-            defaults={"name": f"Airline {carrier_code}", "carrier_type": "AIR"},
-        )
-        loc_dep, _ = Location.objects.get_or_create(
-            code=dep_code, defaults={"name": dep_code}
-        )
-        loc_arr, _ = Location.objects.get_or_create(
-            code=arr_code, defaults={"name": arr_code}
-        )
+    def sweep(self, topology: TopologyRegistry, origin: str, dest: str, date_str: str) -> None:
+        found = self.fetch_and_save(origin, dest, date_str)
+        if found is not None:
+            # Repeated empty days flag the origin for a re-probe on a later run.
+            topology.record(origin, dest, found)
 
-        dep_time = segment["departure"]["at"].split("T")[1]
-        arr_time = segment["arrival"]["at"].split("T")[1]
-
-        route, _ = Route.objects.update_or_create(
-            origin=loc_dep,
-            destination=loc_arr,
-            carrier=carrier,
-            departure_time=dep_time,
-            defaults={
-                "is_active": True,
-                "duration_minutes": self.parse_duration(segment.get("duration")),
-                "arrival_time": arr_time,
-                "flight_number": f"{carrier_code} {segment.get('number', '')}".strip(),
-                "aircraft_type": segment.get("aircraft", {}).get("code", ""),
-            },
-        )
+    def resume(self, run: IngestRun, today: date, extra_calls: Optional[int]) -> None:
+        """Re-runs the unfinished tasks of an interrupted run within what is left of its budget."""
+        self.run = run
+        self.api_calls = run.api_calls
+        self.allowance = run.budget
+        if extra_calls is not None:
+            cap = run.api_calls + extra_calls
+            self.allowance = cap if self.allowance is None else min(self.allowance, cap)
 
-        found_day = str(datetime.strptime(date_str, "%Y-%m-%d").isoweekday())
-        current_days = route.days_of_operation or ""
-        if found_day not in current_days:
-            route.days_of_operation = "".join(sorted(current_days + found_day))
-            route.save()
-
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-        FlightInstance.objects.update_or_create(
-            route=route,
-            date=date_obj,
-            defaults={
-                "price_amount": price,
-                "currency": currency,
-                "available_seats": seats,
-                "cabin_class": cabin,
-            },
+        tasks = list(run.unfinished_tasks().filter(date__gte=today))
+        self.stdout.write(
+            self.style.WARNING(
+                f"\n--- RESUMING RUN #{run.pk} ({run.started_at:%Y-%m-%d %H:%M}): "
+                f"{len(tasks)} UNFINISHED TASKS ---"
+            )
         )
+        # Rows the interrupted run wrote before it died were never passed on
+        # to the connection refresh and cache invalidation; cover them now.
+        done = run.tasks.filter(status="done", changes__gt=0, date__gte=today)
+        self.changes.merge(task_changes(done.values_list("origin", "destination", "date")))
+        topology = TopologyRegistry("amadeus")
+        for task in tasks:
+            self.sweep(topology, task.origin, task.destination, task.date.strftime("%Y-%m-%d"))
 
     def handle(self, *args: Any, **kwargs: Any) -> None:
         self.stdout.write(
@@ -160,24 +180,80 @@ class Command(BaseCommand):
 
         today = datetime.now().date()
 
-        # Aggressive DietPi Database optimization: Immediately prune dead historical data
-        deleted_flights, _ = FlightInstance.objects.filter(date__lt=today).delete()
+        # Aggressive DietPi Database optimization: drop dead historical partitions
+        deleted_flights = prune(FlightInstance, today)
         if deleted_flights:
             self.stdout.write(f"🧹 Pruned {deleted_flights} past flight instances.")
+        maintain(today)
+
+        if kwargs.get("http_mode"):
+            self.http = ProviderHttp("amadeus", mode=kwargs["http_mode"])
 
-        amadeus = Client(
-            client_id=os.getenv("AMADEUS_API_KEY"),
-            client_secret=os.getenv("AMADEUS_API_SECRET"),
+        self.allowance = call_allowance("amadeus", kwargs.get("budget"), kwargs.get("daily_budget"))
+        if self.allowance == 0:
+            self.stdout.write(
+                self.style.WARNING("💸 Daily Amadeus call budget already spent.")
+            )
+            return
+
+        if kwargs.get("resume"):
+            run = IngestRun.resumable("fetch_routes")
+            if run is None:
+                self.stdout.write(self.style.WARNING("♻️  No interrupted run to resume."))
+                return
+            self.stats.start()
+            self.resume(run, today, self.allowance)
+        else:
+            self.stats.start()
+            self.run = IngestRun.objects.create(
+                command="fetch_routes", provider="amadeus", budget=self.allowance
+            )
+            self.sweep_network(today, kwargs.get("reprobe", False))
+
+        with self.stats.phase("db"):
+            connections = refresh_connections(self.changes.affected_dates)
+            if self.changes:
+                publish_snapfile()
+            invalidate_caches(self.changes)
+        self.stdout.write(
+            f"\n🔁 Flight changes: {len(self.changes.inserted)} new, "
+            f"{len(self.changes.updated)} updated, {len(self.changes.deleted)} removed, "
+            f"{self.changes.unchanged} unchanged."
+        )
+        self.stdout.write(f"🔗 Valid connections rebuilt: {connections} rows.")
+        if self.http.mode != "live":
+            self.stdout.write(f"🗄️  {self.http.stats()}")
+        metrics = self.stats.close(self.run, self.api_calls, retries=self.provider.retries)
+        self.stdout.write(f"📊 {self.stats.describe(metrics)}")
+        budget_note = f" of {self.allowance} budgeted" if self.allowance is not None else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"\n✨ DONE! Total usage: {self.api_calls}{budget_note} calls."
+            )
         )
 
+    def sweep_network(self, today: date, reprobe: bool) -> None:
+        """Phases 0 and 1: map the topology, then plan and run the 14-day sweep."""
         self.stdout.write(self.style.WARNING("\n--- PHASE 0: TOPOLOGY MAPPING ---"))
         valid_routes = set()
+        topology = TopologyRegistry("amadeus", force=reprobe)
         for origin in set(GATEWAYS + REGIONAL_HUBS):
-            destinations = self.get_valid_destinations(amadeus, origin)
+            if topology.origin_is_due(origin):
+                found = self.get_valid_destinations(origin)
+                if found is not None:
+                    topology.record_destinations(origin, found)
+            else:
+                topology.reused += 1
+            destinations = topology.active_destinations(origin)
+            # Gateways and hubs are probed themselves, so each direction between
+            # them comes from its own origin's answer. Targets are never probed:
+            # their return legs are assumed and tracked as mirrored edges.
+            for target in TARGETS:
+                topology.mirror(origin, target)
             if origin in GATEWAYS:
                 for hub in REGIONAL_HUBS:
                     if hub in destinations and hub != origin:
-                        valid_routes.update([(origin, hub), (hub, origin)])
+                        valid_routes.add((origin, hub))
                 for target in TARGETS:
                     if target in destinations:
                         valid_routes.update([(origin, target), (target, origin)])
@@ -185,9 +261,10 @@ class Command(BaseCommand):
                 for target in TARGETS:
                     if target in destinations:
                         valid_routes.update([(origin, target), (target, origin)])
-                for other_hub in REGIONAL_HUBS:
-                    if other_hub in destinations and other_hub != origin:
-                        valid_routes.add((origin, other_hub))
+                for other in GATEWAYS + REGIONAL_HUBS:
+                    if other in destinations and other != origin:
+                        valid_routes.add((origin, other))
+        self.stdout.write(f"🗺️  {topology.stats()}")
 
         self.stdout.write(
             self.style.WARNING("\n--- PHASE 1: SCHEDULE SWEEP (14-DAY WINDOW) ---")
@@ -196,10 +273,20 @@ class Command(BaseCommand):
             (datetime.now() + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(14)
         ]
 
-        for date in dates:
-            for origin, dest in valid_routes:
-                self.fetch_and_save(amadeus, origin, dest, date)
-
-        self.stdout.write(
-            self.style.SUCCESS(f"\n✨ DONE! Total usage: {self.api_calls} calls.")
-        )
+        if self.allowance is None:
+            tasks = [(origin, dest, day) for day in dates for origin, dest in valid_routes]
+            # Checkpoint the sweep so an interrupted run can be resumed.
+            self.run.plan(tasks)
+            for origin, dest, day in tasks:
+                self.sweep(topology, origin, dest, day)
+        else:
+            queue = build_refresh_queue(
+                valid_routes, [today + timedelta(days=i) for i in range(14)]
+            )
+            tasks = allocate_budget(queue, self.allowance - self.api_calls)
+            self.stdout.write(
+                f"📋 Budget covers {len(tasks)} of {len(tasks) + len(queue)} refresh tasks."
+            )
+            self.run.plan((t.origin, t.destination, t.date) for t in tasks)
+            for task in tasks:
+                self.sweep(topology, task.origin, task.destination, task.date_str)
@@ -0,0 +1,79 @@
+from dataclasses import replace
+from datetime import datetime, timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.connections import refresh_connections
+from core.partitions import maintain
+from core.synthetic import SCALES, clear_network, generate_network, parse_spec
+
+
+class Command(BaseCommand):
+    help = (
+        "Replaces the synthetic benchmark network (see core/synthetic.py) with a generated one. "
+        "Real network data and its cache entries are left alone."
+    )
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--scale",
+            default="small",
+            help=f"Preset ({', '.join(SCALES)}) or key=value,... overrides, e.g. groups=50,links=4.",
+        )
+        parser.add_argument("--groups", type=int, help="Alias groups (island airports).")
+        parser.add_argument("--aliases", type=int, help="Sub-locations per group; the first is a port.")
+        parser.add_argument("--links", type=int, help="Outbound links per group.")
+        parser.add_argument("--departures", type=int, help="Departures per link and day.")
+        parser.add_argument("--days", type=int, help="Days of departures from --start.")
+        parser.add_argument("--ferry-share", type=float, help="Share of links sailed instead of flown.")
+        parser.add_argument("--start", help="First departure day (YYYY-MM-DD). Defaults to tomorrow.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--connections",
+            action="store_true",
+            help="Rebuild the materialized connections for the generated days.",
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Only delete the synthetic network.",
+        )
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        if kwargs["clear"]:
+            self.stdout.write(f"🧹 Deleted {clear_network()} synthetic rows.")
+            return
+
+        try:
+            spec = parse_spec(kwargs["scale"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        overrides = {
+            field: kwargs[field]
+            for field in ("groups", "aliases", "links", "departures", "days", "ferry_share")
+            if kwargs[field] is not None
+        }
+        spec = replace(spec, **overrides)
+        start = (
+            datetime.strptime(kwargs["start"], "%Y-%m-%d").date()
+            if kwargs["start"]
+            else timezone.localdate() + timedelta(days=1)
+        )
+
+        self.stdout.write(f"🌱 Generating synthetic network: {spec.as_dict()}")
+        maintain(start, spec.days)
+        try:
+            rows = generate_network(spec, start, kwargs["seed"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"🗺️  {rows['locations']} locations, {rows['routes']} routes, "
+            f"{rows['flights']} flights, {rows['sailings']} sailings from {start}."
+        )
+
+        if kwargs["connections"]:
+            days = [start + timedelta(days=i) for i in range(spec.days)]
+            self.stdout.write(f"🔗 Valid connections rebuilt: {refresh_connections(days)} rows.")
+        self.stdout.write(self.style.SUCCESS("✨ Synthetic network ready."))
@@ -0,0 +1,58 @@
+from datetime import timedelta
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.partitions import PARTITIONED_MODELS, daily_partitions, is_partitioned, maintain, prune
+
+
+class Command(BaseCommand):
+    help = "Creates upcoming daily partitions of the departure tables and drops expired ones."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=settings.PARTITION_DAYS_AHEAD,
+            help="Days ahead to create partitions for.",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="Drop the partitions of days older than --keep-days.",
+        )
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=0,
+            help="Past days to retain when pruning.",
+        )
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        today = timezone.localdate()
+        if not any(is_partitioned(model) for model in PARTITIONED_MODELS):
+            self.stdout.write(
+                self.style.WARNING("⚠️  Departure tables are not partitioned (PostgreSQL only).")
+            )
+
+        for table, created in maintain(today, kwargs["ahead"]).items():
+            self.stdout.write(f"🧱 {table}: {created} partitions created.")
+
+        if kwargs["prune"]:
+            cutoff = today - timedelta(days=kwargs["keep_days"])
+            for model in PARTITIONED_MODELS:
+                removed = prune(model, cutoff)
+                self.stdout.write(
+                    f"🧹 {model._meta.db_table}: pruned {removed} rows before {cutoff}."
+                )
+
+        for model in PARTITIONED_MODELS:
+            if is_partitioned(model):
+                days = sorted(daily_partitions(model))
+                span = f"{days[0]} .. {days[-1]}" if days else "none"
+                self.stdout.write(
+                    f"📦 {model._meta.db_table}: {len(days)} daily partitions ({span})."
+                )
+        self.stdout.write(self.style.SUCCESS("✨ Partition maintenance done."))
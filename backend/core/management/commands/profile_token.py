@@ -0,0 +1,23 @@
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import issue_token
+
+
+class Command(BaseCommand):
+    help = "Issues a signed X-Profile-Token header value for profiling requests (see core/profiling.py)."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--path",
+            default="/api/",
+            help="Path prefix the token is valid for.",
+        )
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        token = issue_token(kwargs["path"])
+        minutes = settings.PROFILE_TOKEN_MAX_AGE // 60
+        self.stdout.write(f"🔏 Valid for {minutes} min on {kwargs['path']}*:")
+        self.stdout.write(f"X-Profile-Token: {token}")
@@ -0,0 +1,43 @@
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.connections import refresh_connections
+from core.projection import project_schedules
+from core.reconcile import invalidate_caches
+from core.snapfile import publish as publish_snapfile
+
+
+class Command(BaseCommand):
+    help = "Projects provisional flights over the search horizon from each route's weekly pattern."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--horizon",
+            type=int,
+            default=settings.SCHEDULE_PROJECTION_HORIZON_DAYS,
+            help="Days ahead to project.",
+        )
+        parser.add_argument(
+            "--validity",
+            type=int,
+            default=settings.SCHEDULE_PROJECTION_VALIDITY_DAYS,
+            help="Days a route's pattern is trusted after its last provider confirmation.",
+        )
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        self.stdout.write("📅 Projecting weekly flight schedules...")
+        changes = project_schedules(
+            horizon_days=kwargs["horizon"], validity_days=kwargs["validity"]
+        )
+        refresh_connections(changes.affected_dates)
+        if changes:
+            publish_snapfile()
+        invalidate_caches(changes)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✨ Projection done: {len(changes.inserted)} new, "
+                f"{len(changes.deleted)} expired, {changes.unchanged} unchanged."
+            )
+        )
@@ -0,0 +1,16 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from core.connections import refresh_connections
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the ValidConnection table for every upcoming day."
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        # Ingest runs refresh only the days they changed; a full rebuild also
+        # picks up route-level edits (times, deactivations) made elsewhere.
+        self.stdout.write("🔗 Rebuilding valid connections...")
+        rows = refresh_connections()
+        self.stdout.write(self.style.SUCCESS(f"✨ {rows} valid connections stored."))
@@ -0,0 +1,77 @@
+import itertools
+import json
+from pathlib import Path
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.replay import Replayer, parse_log, read_lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays the /api/ GET requests of gunicorn access logs against an instance and reports "
+        "throughput, latency percentiles, error rates and cache hit ratios (see core/replay.py)."
+    )
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument("logs", nargs="+", help="Access log files, in order (.gz accepted).")
+        parser.add_argument("--target", default="http://localhost:8000", help="Base URL to replay against.")
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=1.0,
+            help="Multiple of the recorded request rate; 0 replays as fast as possible.",
+        )
+        parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at most.")
+        parser.add_argument("--limit", type=int, help="Replay only the first N requests.")
+        parser.add_argument("--prefix", default="/api/", help="Only replay paths under this prefix.")
+        parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout (s).")
+        parser.add_argument("--output", help="Also write the JSON report to this path.")
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        paths = [Path(p) for p in kwargs["logs"]]
+        for path in paths:
+            if not path.exists():
+                raise CommandError(f"No such log: {path}")
+        if kwargs["speed"] < 0 or kwargs["concurrency"] < 1:
+            raise CommandError("--speed must be >= 0 and --concurrency >= 1")
+
+        logged = parse_log(itertools.chain.from_iterable(read_lines(p) for p in paths), kwargs["prefix"])
+        if kwargs["limit"]:
+            logged = itertools.islice(logged, kwargs["limit"])
+
+        pace = f"{kwargs['speed']:g}x" if kwargs["speed"] else "max speed"
+        self.stdout.write(
+            f"🔁 Replaying {', '.join(map(str, paths))} against {kwargs['target']} "
+            f"({pace}, {kwargs['concurrency']} concurrent)"
+        )
+        replayer = Replayer(kwargs["target"], kwargs["speed"], kwargs["concurrency"], kwargs["timeout"])
+        result = replayer.run(
+            logged, progress=lambda n: self.stdout.write(f"[{n}] requests sent", ending="\r")
+        ).as_dict()
+        if not result["requests"]:
+            raise CommandError(f"No replayable {kwargs['prefix']} requests in the logs.")
+
+        latency = result["latency_ms"]
+        hit_ratio = result["cache_hit_ratio"]
+        self.stdout.write(
+            f"\n📈 {result['requests']} requests in {result['wall_seconds']:.1f}s "
+            f"({result['throughput_rps']} req/s), p50 {latency['p50']} ms, p90 {latency['p90']} ms, "
+            f"p99 {latency['p99']} ms, max {latency['max']} ms"
+        )
+        self.stdout.write(
+            f"🚦 Errors {result['error_rate']:.2%} (4xx {result['client_error_rate']:.2%}), "
+            f"cache hits {f'{hit_ratio:.1%}' if hit_ratio is not None else '-'}, "
+            f"max lag behind schedule {result['max_lag_ms']} ms"
+        )
+        for endpoint, summary in result["endpoints"].items():
+            ratio = summary["cache_hit_ratio"]
+            self.stdout.write(
+                f"  {endpoint:<36} {summary['requests']:6d} req  p50 {summary['latency_ms']['p50']:>8} ms  "
+                f"p99 {summary['latency_ms']['p99']:>8} ms  err {summary['error_rate']:.1%}  "
+                f"hit {f'{ratio:.0%}' if ratio is not None else '-'}"
+            )
+        if kwargs["output"]:
+            Path(kwargs["output"]).write_text(json.dumps(result, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"📄 Report written to {kwargs['output']}"))
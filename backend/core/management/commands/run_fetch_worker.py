@@ -0,0 +1,126 @@
+import logging
+import time
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.connections import refresh_connections
+from core.jobs import claim_next, finish
+from core.management.commands.fetch_duffel_routes import Command as DuffelCommand
+from core.management.commands.scrape_ferries import Command as FerryCommand
+from core.models import FetchJob, IngestRun, Sailing
+from core.planning import call_allowance
+from core.provider_http import MODES, HostLimiter, ProviderHttp
+from core.providers import ProviderError
+from core.reconcile import ChangeSet, SnapshotFileBatch, invalidate_caches, reconcile_sailings
+from core.runstats import exit_on_sigterm
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Drains on-demand FetchJobs raised by empty searches using the Duffel and FRS-Express fetchers."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the queue is empty."
+        )
+        parser.add_argument(
+            "--poll", type=float, default=5.0, help="Seconds to wait when the queue is empty."
+        )
+        parser.add_argument(
+            "--max-jobs", type=int, default=0, help="Stop after this many jobs (0 = no limit)."
+        )
+        parser.add_argument(
+            "--http-mode",
+            choices=MODES,
+            help="Provider response cache mode (defaults to PROVIDER_HTTP_MODE).",
+        )
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        self.stdout.write("📬 Initializing On-Demand Fetch Worker...")
+
+        self.http_mode = kwargs["http_mode"]
+        self.duffel = DuffelCommand(stdout=self.stdout, stderr=self.stderr)
+        if self.http_mode:
+            self.duffel.http = ProviderHttp("duffel", mode=self.http_mode)
+        # On-demand Duffel calls count against DUFFEL_DAILY_BUDGET like any run.
+        self.duffel.run = IngestRun.objects.create(command="run_fetch_worker", provider="duffel")
+        self.stats = self.duffel.stats
+        self.stats.start()
+        self.ferries = FerryCommand(stdout=self.stdout, stderr=self.stderr)
+        self.limiter = HostLimiter()
+
+        processed = 0
+        # The snapshot file is rewritten in batches of jobs, and whenever the
+        # queue drains.
+        snapfile_batch = SnapshotFileBatch()
+        # Metrics are saved after every job and the run is closed however the
+        # worker stops, `docker stop` included.
+        exit_on_sigterm()
+        try:
+            while not kwargs["max_jobs"] or processed < kwargs["max_jobs"]:
+                # Once the day's Duffel budget is spent, flight jobs stay queued
+                # for tomorrow; ferry pages cost nothing.
+                allowance = call_allowance("duffel", None, settings.DUFFEL_DAILY_BUDGET)
+                job = claim_next(kinds=("ferry",) if allowance == 0 else None)
+                if job is None:
+                    snapfile_batch.flush()
+                    if kwargs["once"]:
+                        break
+                    time.sleep(kwargs["poll"])
+                    continue
+
+                self.stdout.write(f"🔄 {job}")
+                try:
+                    changes = self.run_job(job)
+                    with self.stats.phase("db"):
+                        refresh_connections(changes.affected_dates)
+                        invalidate_caches(changes)
+                    snapfile_batch.add(changes)
+                    finish(job)
+                    self.stdout.write(f"   ✅ {changes.summary()}")
+                except Exception as e:
+                    logger.error(f"Fetch job {job.pk} failed: {e}")
+                    finish(job, error=str(e))
+                processed += 1
+                self.stats.checkpoint(
+                    self.duffel.run, self.duffel.api_calls, retries=self.duffel.provider.retries
+                )
+        finally:
+            snapfile_batch.flush()
+            metrics = self.stats.close(
+                self.duffel.run, self.duffel.api_calls, retries=self.duffel.provider.retries
+            )
+            self.stdout.write(f"📊 {self.stats.describe(metrics)}")
+        self.stdout.write(self.style.SUCCESS(f"\n✨ DONE! Processed {processed} jobs."))
+
+    def run_job(self, job: FetchJob) -> ChangeSet:
+        if job.kind == "flight":
+            self.duffel.changes = ChangeSet()
+            self.duffel.fetch_and_save(
+                job.origin, job.destination, job.date.strftime("%Y-%m-%d")
+            )
+            if self.duffel.last_fetch_failed:
+                # Surface the failure so the job is retried instead of closed.
+                raise ProviderError(f"Duffel fetch failed for {job}")
+            return self.duffel.changes
+
+        route_obj = self.ferries.ferry_route(job.origin, job.destination)
+        http = ProviderHttp(
+            "frs",
+            mode=self.http_mode,
+            session=self.ferries.make_session(),
+            limiter=self.limiter,
+        )
+        http.run_stats = self.stats
+        scraped, seen_days = self.ferries.scrape_route(job.origin, job.destination, job.date, http)
+        fresh = [Sailing(route=route_obj, **row._asdict()) for row in scraped]
+        # Only the days we actually saw are authoritative.
+        with self.stats.phase("db"):
+            changes = reconcile_sailings(
+                Sailing.objects.filter(route=route_obj, date__in=seen_days), fresh
+            )
+        self.stats.add_changes(changes)
+        return changes
@@ -0,0 +1,136 @@
+import heapq
+import logging
+import time
+from datetime import timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.management.commands.fetch_duffel_routes import Command as DuffelCommand
+from core.connections import refresh_connections
+from core.models import IngestRun
+from core.planning import build_refresh_queue, flight_pairs, window_allowance
+from core.provider_http import MODES, ProviderHttp
+from core.reconcile import ChangeSet, SnapshotFileBatch, invalidate_caches
+from core.runstats import exit_on_sigterm
+
+logger = logging.getLogger(__name__)
+
+# How often a spent budget is checked again for calls that aged out (s).
+BUDGET_RECHECK_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Long-running refresh scheduler: spends a global Duffel call budget on the "
+        "stalest, soonest and most-searched (route, date) tasks first."
+    )
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--budget", type=int, default=70, help="Max Duffel calls per budget window."
+        )
+        parser.add_argument(
+            "--window-hours", type=float, default=24, help="Length of the budget window."
+        )
+        parser.add_argument(
+            "--horizon", type=int, default=3, help="Days ahead (from tomorrow) to keep fresh."
+        )
+        parser.add_argument(
+            "--pause", type=float, default=1.0, help="Seconds to wait between calls."
+        )
+        parser.add_argument(
+            "--replan-minutes",
+            type=float,
+            default=15,
+            help="Rebuild the priority queue this often so new demand is picked up.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain one planning round (or the budget) and exit, e.g. from cron.",
+        )
+        parser.add_argument(
+            "--http-mode",
+            choices=MODES,
+            help="Provider response cache mode (defaults to PROVIDER_HTTP_MODE).",
+        )
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        self.stdout.write("🗓️  Initializing Staleness & Demand Driven Scheduler...")
+
+        duffel = DuffelCommand(stdout=self.stdout, stderr=self.stderr)
+        if kwargs["http_mode"]:
+            duffel.http = ProviderHttp("duffel", mode=kwargs["http_mode"])
+        if not duffel.provider.is_configured():
+            self.stdout.write(
+                self.style.ERROR("❌ Missing DUFFEL_ACCESS_TOKEN in environment.")
+            )
+            return
+
+        budget = kwargs["budget"]
+        # Every task is recorded, which is also what feeds route volatility.
+        duffel.run = IngestRun.objects.create(
+            command="run_ingest_scheduler", provider="duffel", budget=budget
+        )
+        duffel.stats.start()
+        # The spend comes from the recorded runs, so a restart does not reset
+        # it and every other Duffel run counts against the same window.
+        window = timedelta(hours=kwargs["window_hours"])
+        replan_every = kwargs["replan_minutes"] * 60
+        probed: dict[tuple[str, str, Any], Any] = {}
+        # The snapshot file is rewritten in batches of tasks, and at the end
+        # of every planning round.
+        snapfile_batch = SnapshotFileBatch()
+
+        # Metrics are saved after every task and the run is closed however the
+        # scheduler stops, `docker stop` included.
+        exit_on_sigterm()
+        try:
+            while True:
+                today = timezone.localdate()
+                dates = [today + timedelta(days=i) for i in range(1, kwargs["horizon"] + 1)]
+                queue = build_refresh_queue(flight_pairs(), dates, probed=probed)
+                self.stdout.write(f"\n📋 Planned {len(queue)} refresh tasks.")
+                replan_at = time.monotonic() + replan_every
+
+                while queue and time.monotonic() < replan_at:
+                    if window_allowance("duffel", budget, window) == 0:
+                        if kwargs["once"]:
+                            self.stdout.write(self.style.WARNING("💸 Call budget exhausted."))
+                            break
+                        time.sleep(BUDGET_RECHECK_SECONDS)
+                        continue
+
+                    task = heapq.heappop(queue)
+                    duffel.changes = ChangeSet()
+                    duffel.fetch_and_save(task.origin, task.destination, task.date_str)
+                    probed[(task.origin, task.destination, task.date)] = timezone.now()
+                    with duffel.stats.phase("db"):
+                        refresh_connections(duffel.changes.affected_dates)
+                        invalidate_caches(duffel.changes)
+                    snapfile_batch.add(duffel.changes)
+
+                    spent = budget - window_allowance("duffel", budget, window)
+                    self.stdout.write(
+                        f"[{spent}/{budget}] 🔄 {task} -> {duffel.changes.summary()}"
+                    )
+                    duffel.stats.checkpoint(
+                        duffel.run, duffel.api_calls, retries=duffel.provider.retries
+                    )
+                    time.sleep(kwargs["pause"])
+
+                snapfile_batch.flush()
+                if kwargs["once"]:
+                    break
+                if not queue:
+                    # Everything is fresh: idle until the next planning round.
+                    time.sleep(max(replan_at - time.monotonic(), 0))
+        finally:
+            snapfile_batch.flush()
+            metrics = duffel.stats.close(duffel.run, duffel.api_calls, retries=duffel.provider.retries)
+            self.stdout.write(f"📊 {duffel.stats.describe(metrics)}")
+        self.stdout.write(
+            self.style.SUCCESS(f"\n✨ DONE! Spent {duffel.api_calls} Duffel calls this run.")
+        )
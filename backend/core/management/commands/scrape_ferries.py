@@ -1,13 +1,21 @@
-import time
 import logging
+import operator
 import requests
-import re
-from bs4 import BeautifulSoup
-from typing import Any, Optional
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import reduce
+from typing import Any, NamedTuple
 from datetime import datetime, timedelta, date
-from django.db import transaction
 from django.core.management.base import BaseCommand
-from core.models import Location, Route, Carrier, Sailing
+from django.db.models import Q
+from core.models import IngestRun, Location, Route, Carrier, Sailing
+from core.connections import refresh_connections
+from core.ferry_parser import ParsedPage, parse_page
+from core.partitions import maintain
+from core.provider_http import MODES, HostLimiter, ProviderHttp
+from core.reconcile import invalidate_caches, reconcile_sailings
+from core.runstats import RunStats
+from core.snapfile import publish as publish_snapfile
 from core.constants import (
     PORT_ROSEAU,
     PORT_PTP,
@@ -18,23 +26,21 @@ from core.constants import (
 
 logger = logging.getLogger(__name__)
 
-FRENCH_MONTHS = {
-    "jan": 1,
-    "fév": 2,
-    "fev": 2,
-    "mar": 3,
-    "avr": 4,
-    "mai": 5,
-    "juin": 6,
-    "juil": 7,
-    "aoû": 8,
-    "aou": 8,
-    "sep": 9,
-    "oct": 10,
-    "nov": 11,
-    "déc": 12,
-    "dec": 12,
+BASE_URL = "https://goexpress-b2c.frs-express.com/B2C_2018/"
+SESSION_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
+    "Referer": "https://www.frs-express.com/",
+    "Accept-Language": "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7",
 }
+CHECK_INTERVALS = [0, 7, 14]
+
+
+class ScrapedSailing(NamedTuple):
+    date: date
+    departure_time: str
+    arrival_time: str
+    duration_minutes: int
+    price_text: str
 
 
 class Command(BaseCommand):
@@ -42,10 +48,35 @@ class Command(BaseCommand):
         "FRS - Express Ferry Schedule Scraper: Extracts Exact Times, Durations & Prices"
     )
 
-    def __init__(self) -> None:
-        super().__init__()
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
         self.sailings_to_create: list[Sailing] = []
 
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--http-mode",
+            choices=MODES,
+            help="Provider response cache mode (defaults to PROVIDER_HTTP_MODE).",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=3, help="Routes scraped concurrently."
+        )
+        parser.add_argument(
+            "--per-host", type=int, default=2, help="Max in-flight requests per host."
+        )
+        parser.add_argument(
+            "--min-interval",
+            type=float,
+            default=0.5,
+            help="Minimum seconds between request starts to the same host.",
+        )
+
+    def make_session(self) -> requests.Session:
+        # requests.Session is not thread-safe, so every worker gets its own.
+        session = requests.Session()
+        session.headers.update(SESSION_HEADERS)
+        return session
+
     def bootstrap_locations(self) -> None:
         """
         Removes dependency on seed_data.py or fetch_routes.py.
@@ -93,6 +124,90 @@ class Command(BaseCommand):
                 port_loc.parent = parent_loc
                 port_loc.save()
 
+    def ferry_route(self, origin_code: str, dest_code: str) -> Route:
+        carrier, _ = Carrier.objects.get_or_create(
+            code="LXI",
+            defaults={
+                "name": "L'Express des Iles",
+                "carrier_type": "SEA",
+                "website": "https://www.frs-express.com",
+            },
+        )
+        route_obj, _ = Route.objects.get_or_create(
+            origin=Location.objects.get(code=origin_code),
+            destination=Location.objects.get(code=dest_code),
+            carrier=carrier,
+            defaults={"is_active": True},
+        )
+        return route_obj
+
+    def fetch_page(self, http: ProviderHttp, origin_code: str, dest_code: str, day: date) -> ParsedPage | None:
+        params = {
+            "aller": "AS",
+            "depart": DB_TO_SITE_OPTS[origin_code][0],
+            "arrivee": DB_TO_SITE_OPTS[dest_code][0],
+            "date_aller": day.strftime("%d/%m/%Y"),
+            "adultes": "1",
+            "enfants": "0",
+        }
+        resp = http.get(BASE_URL, params=params, timeout=20)
+        if resp.status_code != 200:
+            return None
+        with http.run_stats.phase("parse") if http.run_stats else nullcontext():
+            return parse_page(resp.content)
+
+    def scrape_route(
+        self, origin_code: str, dest_code: str, start_date: date, http: ProviderHttp
+    ) -> tuple[list[ScrapedSailing], set[date]]:
+        """
+        Walks the week probes for one route. Every page is fetched and parsed at
+        most once: a page rendered for a given day serves both as that day's
+        schedule and as a week probe, so overlapping weeks reuse earlier pages.
+        Returns the sailings and the days whose schedule page was read, empty
+        ones included; only those days are authoritative for the route.
+        """
+        logger.info(f"Checking Route: {origin_code} -> {dest_code}")
+        pages: dict[date, ParsedPage | None] = {}
+
+        def page_for(day: date) -> ParsedPage | None:
+            if day not in pages:
+                try:
+                    page = self.fetch_page(http, origin_code, dest_code, day)
+                except Exception as e:
+                    logger.error(f"Scrape Error on {day}: {e}")
+                    page = None
+                pages[day] = page
+                if page and page.header_date and page.header_date != day:
+                    pages.setdefault(page.header_date, page)
+            return pages[day]
+
+        scraped: list[ScrapedSailing] = []
+        seen_days: set[date] = set()
+        processed_dates: set[date] = set()
+        for days_offset in CHECK_INTERVALS:
+            week_page = page_for(start_date + timedelta(days=days_offset))
+            if week_page is None:
+                continue
+
+            for target_date, day_price in week_page.week_prices:
+                if target_date in processed_dates:
+                    continue
+                processed_dates.add(target_date)
+                day_page = (
+                    week_page
+                    if week_page.header_date == target_date
+                    else page_for(target_date)
+                )
+                if day_page is None:
+                    continue
+                seen_days.add(target_date)
+                scraped.extend(
+                    ScrapedSailing(target_date, *sailing, day_price)
+                    for sailing in day_page.sailings
+                )
+
+        return scraped, seen_days
+
     def handle(self, *args: Any, **kwargs: Any) -> None:
         self.stdout.write("🚢 Initializing FRS-Express Ferry Schedule Scraper...")
 
@@ -100,6 +215,7 @@ class Command(BaseCommand):
         self.bootstrap_locations()
 
         today = datetime.now().date()
+        maintain(today)
         base_routes = [
             (PORT_PTP, PORT_ROSEAU),
             (PORT_FDF, PORT_ROSEAU),
@@ -110,123 +226,82 @@ class Command(BaseCommand):
             final_routes.append((start, end))
             final_routes.append((end, start))
 
-        BASE_URL = "https://goexpress-b2c.frs-express.com/B2C_2018/"
-        session = requests.Session()
-        session.headers.update(
-            {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
-                "Referer": "https://www.frs-express.com/",
-                "Accept-Language": "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7",
-            }
-        )
-
-        carrier, _ = Carrier.objects.get_or_create(
-            code="LXI",
-            defaults={
-                "name": "L'Express des Iles",
-                "carrier_type": "SEA",
-                "website": "https://www.frs-express.com",
-            },
-        )
+        # All DB work stays on the main thread; workers only fetch and parse.
+        route_objs = {
+            route_key: self.ferry_route(*route_key) for route_key in final_routes
+        }
 
-        check_intervals = [0, 7, 14]
         start_date_base = today + timedelta(days=1)
+        limiter = HostLimiter(
+            max_concurrent=kwargs.get("per_host", 2),
+            min_interval=kwargs.get("min_interval", 0.5),
+        )
+        http_mode = kwargs.get("http_mode")
+        hits = misses = 0
+        run = IngestRun.objects.create(command="scrape_ferries", provider="frs")
+        stats = RunStats()
+        stats.start()
+        # (route, days) actually read; a route whose scrape failed keeps its rows.
+        scope: list[Q] = []
+
+        with ThreadPoolExecutor(max_workers=kwargs.get("workers", 3)) as pool:
+            futures = {}
+            for route_key in final_routes:
+                http = ProviderHttp(
+                    "frs", mode=http_mode, session=self.make_session(), limiter=limiter
+                )
+                http.run_stats = stats
+                future = pool.submit(self.scrape_route, *route_key, start_date_base, http)
+                futures[future] = (route_key, http)
 
-        for origin_code, dest_code in final_routes:
-            logger.info(f"Checking Route: {origin_code} -> {dest_code}")
-
-            loc_origin = Location.objects.get(code=origin_code)
-            loc_dest = Location.objects.get(code=dest_code)
-
-            route_obj, _ = Route.objects.get_or_create(
-                origin=loc_origin,
-                destination=loc_dest,
-                carrier=carrier,
-                defaults={"is_active": True},
-            )
-
-            processed_dates = set()
-
-            for days_offset in check_intervals:
-                check_date = start_date_base + timedelta(days=days_offset)
-                date_str = check_date.strftime("%d/%m/%Y")
-                params = {
-                    "aller": "AS",
-                    "depart": DB_TO_SITE_OPTS[origin_code][0],
-                    "arrivee": DB_TO_SITE_OPTS[dest_code][0],
-                    "date_aller": date_str,
-                    "adultes": "1",
-                    "enfants": "0",
-                }
-
+            for future in as_completed(futures):
+                (origin_code, dest_code), http = futures[future]
                 try:
-                    resp = session.get(BASE_URL, params=params, timeout=20)
-                    resp.encoding = "utf-8"
-                    if resp.status_code != 200:
-                        continue
-                    soup = BeautifulSoup(resp.content, "html.parser")
-
-                    valid_dates_in_week: list[tuple[date, str]] = []
-                    for btn in soup.find_all("button"):
-                        if "à partir de" in btn.get_text():
-                            p_tags = btn.find_all("p")
-                            if len(p_tags) >= 3:
-                                parsed_date = self.parse_french_date(
-                                    p_tags[0].get_text(strip=True)
-                                )
-                                price_text = p_tags[2].get_text(strip=True)
-                                if parsed_date and any(c.isdigit() for c in price_text):
-                                    valid_dates_in_week.append(
-                                        (parsed_date, price_text)
-                                    )
-
-                    for target_date, day_price in valid_dates_in_week:
-                        if target_date in processed_dates:
-                            continue
-
-                        is_current_page = False
-                        header_div = soup.find(text=re.compile("DATE DEPART"))
-                        if (
-                            header_div
-                            and self.parse_french_date(header_div) == target_date
-                        ):
-                            is_current_page = True
-
-                        target_soup = soup
-                        if not is_current_page:
-                            sub_params = params.copy()
-                            sub_params["date_aller"] = target_date.strftime("%d/%m/%Y")
-                            sub_resp = session.get(
-                                BASE_URL, params=sub_params, timeout=20
-                            )
-                            sub_resp.encoding = "utf-8"
-                            target_soup = BeautifulSoup(sub_resp.content, "html.parser")
-
-                        self.parse_daily_schedule(
-                            target_soup, route_obj, target_date, day_price
-                        )
-                        processed_dates.add(target_date)
-                        time.sleep(1)
-
+                    scraped, seen_days = future.result()
                 except Exception as e:
-                    logger.error(f"Scrape Error: {e}")
+                    logger.error(f"Scrape Error on {origin_code} -> {dest_code}: {e}")
+                    continue
+                hits += http.hits
+                misses += http.misses
+                route_obj = route_objs[(origin_code, dest_code)]
+                scope.append(Q(route=route_obj, date__in=seen_days))
+                self.sailings_to_create.extend(
+                    Sailing(route=route_obj, **row._asdict()) for row in scraped
+                )
+                self.stdout.write(
+                    f"⛴️  {origin_code} -> {dest_code}: {len(scraped)} sailings"
+                )
 
-        # Atomic commit logic for safety
-        # We use transaction.atomic() to ensure that clearing out old sailings 
-        # and inserting the newly scraped ones happens as a single unit of work.
-        # If the bulk_create fails, the delete is rolled back, preventing the 
-        # database from ending up in an empty, inconsistent state.
+        if http_mode and http_mode != "live":
+            self.stdout.write(f"🗄️  frs cache [{http_mode}]: {hits} hits, {misses} misses")
+
+        # Diff-based commit logic for safety
+        # The scrape is authoritative for the days it read on the routes it
+        # reached, and we reconcile those by (route, date, departure_time): only
+        # new, changed and vanished sailings are written. Reconciliation runs
+        # inside transaction.atomic(), so a failure leaves the previous schedule intact.
         if self.sailings_to_create:
             try:
-                with transaction.atomic():
-                    deleted_count, _ = Sailing.objects.all().delete()
-                    self.stdout.write(f"🗑️ Cleared {deleted_count} upcoming sailings.")
-                    Sailing.objects.bulk_create(self.sailings_to_create)
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f"✨ Successfully saved {len(self.sailings_to_create)} sailings!"
-                        )
+                with stats.phase("db"):
+                    changes = reconcile_sailings(
+                        Sailing.objects.filter(reduce(operator.or_, scope)),
+                        self.sailings_to_create,
+                    )
+                    refresh_connections(changes.affected_dates)
+                    if changes:
+                        publish_snapfile()
+                    invalidate_caches(changes)
+                stats.add_changes(changes)
+                self.stdout.write(
+                    f"🔁 Sailing changes: {len(changes.inserted)} new, "
+                    f"{len(changes.updated)} updated, {len(changes.deleted)} removed, "
+                    f"{changes.unchanged} unchanged."
+                )
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"✨ Successfully reconciled {len(self.sailings_to_create)} sailings!"
                     )
+                )
             except Exception as e:
                 self.stdout.write(
                     self.style.ERROR(
@@ -237,97 +312,5 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.WARNING("⚠️ No sailings found. Database was left untouched.")
             )
-
-    def parse_daily_schedule(self, soup: Any, route_obj: Any, date_obj: Any, price_text: str) -> None:
-        """
-        Parses the daily ferry schedule from the BeautifulSoup DOM.
-        
-        The target website's HTML is heavily nested and lacks semantic class names 
-        for departure and arrival times. To reliably find the times associated with a 
-        specific trip, we first locate the node containing the text 'Durée du voyage' 
-        (Trip Duration). We then traverse up the DOM tree (parent by parent, up to 8 levels deep) 
-        until we find a container that holds at least two <time> tags. The first tag is assumed 
-        to be the departure time, and the second is the arrival time.
-        """
-        try:
-            duration_nodes = soup.find_all(text=re.compile("Durée du voyage"))
-            if not duration_nodes:
-                self.fallback_parse_times(soup, route_obj, date_obj, price_text)
-                return
-
-            for dur_node in duration_nodes:
-                container = dur_node.parent
-                times = []
-                depth = 0
-                while depth < 8 and container:
-                    times = container.find_all("time")
-                    if len(times) >= 2:
-                        break
-                    container = container.parent
-                    depth += 1
-
-                if len(times) >= 2:
-                    dep_time = times[0].get_text(strip=True)
-                    arr_time = times[1].get_text(strip=True)
-                    duration_mins = 120
-                    if match := re.search(r"(\d+)h(\d+)", dur_node.strip()):
-                        duration_mins = (int(match.group(1)) * 60) + int(match.group(2))
-
-                    self.sailings_to_create.append(
-                        Sailing(
-                            route=route_obj,
-                            date=date_obj,
-                            departure_time=dep_time,
-                            arrival_time=arr_time,
-                            duration_minutes=duration_mins,
-                            price_text=price_text,
-                        )
-                    )
-        except Exception as e:
-            logger.error(f"Parse Error on {date_obj}: {e}")
-
-    def fallback_parse_times(self, soup: Any, route_obj: Any, date_obj: Any, price_text: str) -> None:
-        times = soup.find_all("time")
-        for i in range(0, len(times), 2):
-            if i + 1 < len(times):
-                self.sailings_to_create.append(
-                    Sailing(
-                        route=route_obj,
-                        date=date_obj,
-                        departure_time=times[i].get_text(strip=True),
-                        arrival_time=times[i + 1].get_text(strip=True),
-                        duration_minutes=120,
-                        price_text=price_text,
-                    )
-                )
-
-    def parse_french_date(self, date_str: Any) -> Optional[date]:
-        if not date_str:
-            return None
-        try:
-            parts = (
-                date_str.lower()
-                .replace(".", "")
-                .replace(":", "")
-                .replace("date depart", "")
-                .strip()
-                .split()
-            )
-            day, month_idx = next(
-                ((int(p), i + 1) for i, p in enumerate(parts) if p.isdigit()),
-                (None, -1),
-            )
-            if not day or month_idx >= len(parts):
-                return None
-
-            month_str = parts[month_idx]
-            month = 1
-            for k in sorted(FRENCH_MONTHS.keys(), key=len, reverse=True):
-                if month_str.startswith(k):
-                    month = FRENCH_MONTHS[k]
-                    break
-            today = datetime.now().date()
-            year = today.year + 1 if month < today.month - 2 else today.year
-            return datetime(year, month, day).date()
-        except:
-            return None
+        metrics = stats.close(run)
+        self.stdout.write(f"📊 {stats.describe(metrics)}")
@@ -0,0 +1,34 @@
+from pathlib import Path
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.snapfile import write
+
+
+class Command(BaseCommand):
+    help = "Writes the memory-mapped network snapshot file searches can run off (see core/snapfile.py)."
+
+    def add_arguments(self, parser: Any) -> None:
+        parser.add_argument(
+            "--path",
+            default=None,
+            help="Target file (default: NETWORK_SNAPSHOT_FILE).",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Upcoming days of departures to include (default: NETWORK_SNAPSHOT_DAYS).",
+        )
+
+    def handle(self, *args: Any, **kwargs: Any) -> None:
+        path = Path(kwargs["path"]) if kwargs["path"] else None
+        if path is None and not settings.NETWORK_SNAPSHOT_FILE:
+            # The init container runs this whatever the search engine is.
+            self.stdout.write("⏭️  NETWORK_SNAPSHOT_FILE is not set; no snapshot file to write.")
+            return
+        self.stdout.write("🗺️  Writing the network snapshot file...")
+        mapped = write(path, kwargs["days"])
+        self.stdout.write(self.style.SUCCESS(f"✨ {mapped.stats()} at {mapped.path}."))  # type: ignore[union-attr]
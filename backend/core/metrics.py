@@ -0,0 +1,60 @@
+"""
+Application metrics exported on the `/metrics` endpoint of django_prometheus.
+
+django_prometheus only measures whole requests. These series break the
+search down by stage and record what each stage had to work with, so a
+latency regression can be traced to the part of the pipeline that moved:
+
+- `prop_search_stage_seconds{stage, engine}`: alias resolution, direct legs,
+  leg-1 departures and hub expansion, leg-2 arrivals, pairing and itinerary
+  serialization, plus the response filters,
+- `prop_search_candidates_total{kind}`: legs considered per search,
+- `prop_search_pairs_total{outcome}`: leg pairs checked against the
+  connection rules (`evaluated`, Python engine only) and kept (`accepted`),
+- `prop_cache_requests_total{endpoint, result}`: hits and misses of the
+  response and leg caches.
+
+Codec sizes of the shared cache (core/cache.py) are defined here as well.
+"""
+
+from prometheus_client import Counter, Histogram
+
+# Search stages run from well under a millisecond (cached legs) to seconds.
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+SEARCH_STAGE_SECONDS = Histogram(
+    "prop_search_stage_seconds",
+    "Time spent in each stage of an itinerary search.",
+    ["stage", "engine"],
+    buckets=STAGE_BUCKETS,
+)
+SEARCH_CANDIDATES = Counter(
+    "prop_search_candidates",
+    "Candidate legs loaded by searches, by kind.",
+    ["kind"],
+)
+SEARCH_PAIRS = Counter(
+    "prop_search_pairs",
+    "Leg-1/leg-2 pairs evaluated against the connection rules and accepted.",
+    ["outcome"],
+)
+CACHE_REQUESTS = Counter(
+    "prop_cache_requests",
+    "Cache lookups per endpoint, by result.",
+    ["endpoint", "result"],
+)
+
+CODEC_BYTES = Counter(
+    "prop_cache_codec_bytes",
+    "Bytes of cache values before (raw) and after (stored) encoding.",
+    ["stage"],
+)
+COMPRESSION_RATIO = Histogram(
+    "prop_cache_compression_ratio",
+    "Raw to stored size of each encoded cache value.",
+    buckets=(1, 1.5, 2, 3, 4, 6, 8, 12, 16, 24),
+)
+
+
+def record_cache(endpoint: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(endpoint, "hit" if hit else "miss").inc()
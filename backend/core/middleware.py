@@ -0,0 +1,93 @@
+"""
+Per-request query budgets and N+1 detection.
+
+`QueryBudgetMiddleware` records every SQL statement a request issues on the
+default connection and checks two things when the response is ready:
+
+- the statement count against the budget the view declares in its
+  `query_budgets` attribute (`{action: max queries}` on a viewset),
+- repeated query shapes: the same statement issued `QUERY_REPEAT_THRESHOLD`
+  times or more in one request is almost always a per-row lookup (N+1).
+
+`QUERY_BUDGET_MODE` decides what happens on a violation: `warn` logs it
+(the local default), `raise` fails the request with `QueryBudgetExceeded`
+(what the tests use), `off` skips recording altogether (production).
+"""
+
+import logging
+import re
+from collections import Counter
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# `IN (%s, %s, ...)` lists vary with their arguments, not with the query shape.
+IN_LIST = re.compile(r"\((?:%s, )*%s\)")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """An execute wrapper collecting the SQL of every statement it sees."""
+
+    def __init__(self) -> None:
+        self.statements: list[str] = []
+
+    def __call__(self, execute: Callable, sql: str, params: Any, many: bool, context: Any) -> Any:
+        self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """Query shapes issued at least `threshold` times, most frequent first."""
+        shapes = Counter(IN_LIST.sub("(...)", sql) for sql in self.statements)
+        return [(shape, n) for shape, n in shapes.most_common() if n >= threshold]
+
+
+def declared_budget(view_func: Callable, method: str) -> Optional[int]:
+    """The `query_budgets` entry of the viewset action serving `method`, if any."""
+    view_class = getattr(view_func, "cls", None)
+    action = getattr(view_func, "actions", {}).get(method.lower())
+    if view_class is None or action is None:
+        return None
+    return getattr(view_class, "query_budgets", {}).get(action)
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        mode = getattr(settings, "QUERY_BUDGET_MODE", "off")
+        if mode == "off":
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        problems = []
+        budget = getattr(request, "query_budget", None)
+        if budget is not None and len(recorder) > budget:
+            problems.append(f"{len(recorder)} queries, budget {budget}")
+        threshold = getattr(settings, "QUERY_REPEAT_THRESHOLD", 5)
+        for shape, count in recorder.repeated(threshold):
+            problems.append(f"N+1: {count}x {shape[:200]}")
+
+        if problems:
+            message = f"{request.method} {request.path}: " + "; ".join(problems)
+            if mode == "raise":
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request: HttpRequest, view_func: Callable, view_args: Any, view_kwargs: Any) -> None:
+        request.query_budget = declared_budget(view_func, request.method or "GET")  # type: ignore[attr-defined]
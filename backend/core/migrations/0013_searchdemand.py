@@ -0,0 +1,27 @@
+# Generated by Django 5.2.10 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_flightinstance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDemand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin', models.CharField(max_length=5)),
+                ('destination', models.CharField(max_length=5)),
+                ('day', models.DateField()),
+                ('searches', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='core_search_day_1b9228_idx')],
+                'unique_together': {('origin', 'destination', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.10 on 2026-10-19 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_fetchjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flightinstance',
+            name='is_projected',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='last_confirmed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='valid_from',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='valid_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.10 on 2026-10-19 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_schedule_projection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(db_index=True, max_length=50)),
+                ('started_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('budget', models.PositiveIntegerField(blank=True, null=True)),
+                ('api_calls', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='IngestTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin', models.CharField(max_length=5)),
+                ('destination', models.CharField(max_length=5)),
+                ('date', models.DateField()),
+                ('api_calls', models.PositiveSmallIntegerField(default=1)),
+                ('changes', models.PositiveIntegerField(default=0)),
+                ('completed_at', models.DateTimeField(auto_now_add=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='core.ingestrun')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['completed_at', 'origin', 'destination'], name='core_ingest_complet_6ada8c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.10 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_ingestrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=20)),
+                ('origin', models.CharField(max_length=5)),
+                ('destination', models.CharField(max_length=5)),
+                ('is_active', models.BooleanField(default=True)),
+                ('first_seen_at', models.DateTimeField(blank=True, null=True)),
+                ('last_confirmed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_probed_at', models.DateTimeField(blank=True, null=True)),
+                ('empty_streak', models.PositiveSmallIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('provider', 'origin', 'destination')},
+            },
+        ),
+    ]
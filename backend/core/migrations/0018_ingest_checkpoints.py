@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-19 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_networkedge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingesttask',
+            name='duration_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        # Tasks recorded before checkpointing were all completed fetches.
+        migrations.AddField(
+            model_name='ingesttask',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='done', max_length=7),
+        ),
+        migrations.AlterField(
+            model_name='ingesttask',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=7),
+        ),
+        migrations.AlterField(
+            model_name='ingesttask',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.2.10 on 2026-10-19 14:00
+
+from django.db import migrations
+
+# Departure tables partitioned by RANGE (date) on PostgreSQL; see core/partitions.py.
+TABLES = ("core_flightinstance", "core_sailing")
+
+
+def _constraints(cursor, table):
+    """Index and constraint DDL of `table`, to be replayed on the new parent."""
+    cursor.execute(
+        """
+        SELECT conname, contype, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+        """,
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT indexdef FROM pg_indexes
+        WHERE tablename = %s
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)
+        """,
+        [table, table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    return constraints, indexes
+
+
+def _rebuild(cursor, table, partitioned):
+    constraints, indexes = _constraints(cursor, table)
+    old = f"{table}_unpartitioned" if partitioned else f"{table}_partitioned"
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    if partitioned:
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY "
+            f"INCLUDING CONSTRAINTS) PARTITION BY RANGE (date)"
+        )
+        cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        # One partition per day already holding rows; core/partitions.py
+        # creates the rest ahead of the ingesters.
+        cursor.execute(f"SELECT DISTINCT date FROM {old}")
+        for (day,) in cursor.fetchall():
+            cursor.execute(
+                f"CREATE TABLE {table}_p{day:%Y%m%d} PARTITION OF {table} "
+                f"FOR VALUES FROM (%s) TO (%s::date + 1)",
+                [day, day],
+            )
+    else:
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY "
+            f"INCLUDING CONSTRAINTS)"
+        )
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) "
+        f"FROM {table}",
+        [table],
+    )
+    # Nothing references the departure tables yet; a plain DROP fails loudly
+    # rather than silently taking foreign keys or views with it.
+    cursor.execute(f"DROP TABLE {old}")
+
+    for name, kind, definition in constraints:
+        if kind == "p":
+            # Unique constraints on a partitioned table must include the
+            # partition key; ids stay unique through the identity sequence.
+            definition = "PRIMARY KEY (id, date)" if partitioned else "PRIMARY KEY (id)"
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+    for definition in indexes:
+        cursor.execute(definition)
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            _rebuild(cursor, table, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            _rebuild(cursor, table, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_ingest_checkpoints'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
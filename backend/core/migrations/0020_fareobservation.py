@@ -0,0 +1,29 @@
+# Generated by Django 5.2.10 on 2026-10-19 14:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_partition_departures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FareObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('observed_at', models.DateTimeField()),
+                ('price_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('currency', models.CharField(default='USD', max_length=5)),
+                ('available_seats', models.SmallIntegerField(blank=True, null=True)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fare_observations', to='core.route')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['route', 'date', 'observed_at'], name='core_fareob_route_i_f0d0d2_idx'), models.Index(fields=['observed_at'], name='core_fareob_observe_38f80d_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.10 on 2026-10-19 15:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_fareobservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValidConnection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('gap_seconds', models.PositiveIntegerField()),
+                ('origin_group', models.CharField(max_length=5)),
+                ('destination_group', models.CharField(max_length=5)),
+                ('leg1', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.flightinstance')),
+                ('leg2_flight', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.flightinstance')),
+                ('leg2_sailing', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.sailing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['origin_group', 'destination_group', 'date'], name='core_validc_origin__378518_idx')],
+            },
+        ),
+    ]
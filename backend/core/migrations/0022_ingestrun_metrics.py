@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-19 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_validconnection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestrun',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+# The provider each ingest command spends its API calls on.
+PROVIDERS = {
+    "fetch_duffel_routes": "duffel",
+    "run_fetch_worker": "duffel",
+    "run_ingest_scheduler": "duffel",
+    "fetch_routes": "amadeus",
+    "scrape_ferries": "frs",
+}
+
+
+def backfill_providers(apps, schema_editor):
+    IngestRun = apps.get_model("core", "IngestRun")
+    for command, provider in PROVIDERS.items():
+        IngestRun.objects.filter(command=command).update(provider=provider)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_ingestrun_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestrun',
+            name='provider',
+            field=models.CharField(blank=True, db_index=True, max_length=20),
+        ),
+        migrations.RunPython(backfill_providers, migrations.RunPython.noop),
+    ]
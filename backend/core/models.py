@@ -1,4 +1,9 @@
-from django.db import models
+from datetime import date, timedelta
+from typing import Any, Iterable, Optional
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
 
 
 class Carrier(models.Model):
@@ -70,6 +75,11 @@ class Location(models.Model):
                 codes.add(sibling.code)
         return list(codes)
 
+    @property
+    def group_code(self) -> str:
+        """The alias group this location belongs to (see `resolve_aliases`)."""
+        return self.parent.code if self.parent else self.code
+
     def __str__(self) -> str:
         return f"{self.code} - {self.name}"
 
@@ -102,6 +112,12 @@ class Route(models.Model):
     departure_time = models.TimeField(null=True, blank=True)
     arrival_time = models.TimeField(null=True, blank=True)
 
+    # Schedule projection inputs: the optional seasonal validity window, and
+    # when a provider last returned this exact flight.
+    valid_from = models.DateField(null=True, blank=True)
+    valid_until = models.DateField(null=True, blank=True)
+    last_confirmed_at = models.DateTimeField(null=True, blank=True)
+
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -115,6 +131,17 @@ class Route(models.Model):
 
 
 class FlightInstance(models.Model):
+    """
+    A flight on a specific date.
+
+    Rows come either from a provider response or, with `is_projected` set,
+    from `project_schedules`, which extends a route's weekly pattern past the
+    scraped window. Projected rows carry no price or seat count and are
+    replaced by the real row as soon as a provider returns that flight.
+
+    On PostgreSQL the table is range-partitioned by `date` (see
+    core/partitions.py): unique constraints must include `date`.
+    """
     route = models.ForeignKey(
         Route, on_delete=models.CASCADE, related_name="flight_instances"
     )
@@ -125,6 +152,7 @@ class FlightInstance(models.Model):
     currency = models.CharField(max_length=5, default="USD")
     available_seats = models.IntegerField(null=True, blank=True)
     cabin_class = models.CharField(max_length=30, blank=True)
+    is_projected = models.BooleanField(default=False, db_index=True)
     last_seen_at = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -136,6 +164,7 @@ class FlightInstance(models.Model):
 
 
 class Sailing(models.Model):
+    """A ferry departure on a specific date; partitioned by `date` like FlightInstance."""
     route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name="sailings")
     date = models.DateField(db_index=True)
     departure_time = models.TimeField()
@@ -151,6 +180,312 @@ class Sailing(models.Model):
         return f"{self.route} on {self.date}"
 
 
+class FareObservation(models.Model):
+    """
+    One observed fare for a flight (route, date), appended by the ingest
+    pipeline only when the price or seat count differs from the previous
+    observation. FlightInstance keeps the current fare; this is its history.
+    `downsample_fares` thins out old observations to one per observation day.
+    """
+    route = models.ForeignKey(
+        Route, on_delete=models.CASCADE, related_name="fare_observations"
+    )
+    date = models.DateField()
+    observed_at = models.DateTimeField()
+    price_amount = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, blank=True
+    )
+    currency = models.CharField(max_length=5, default="USD")
+    available_seats = models.SmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["route", "date", "observed_at"]),
+            models.Index(fields=["observed_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.route_id} on {self.date} @ {self.observed_at:%Y-%m-%d %H:%M}: {self.price_amount}"
+
+
+class ValidConnection(models.Model):
+    """
+    A bookable two-leg connection (flight, then flight or ferry), maintained
+    by core/connections.py after each ingest so search can look connections
+    up instead of pairing legs on every cache miss.
+
+    Groups are alias groups: the code of the location's parent, or its own
+    code when it has none. The leg references carry no database constraint,
+    since the departure tables are partitioned on PostgreSQL; a leg removed
+    since the last refresh simply drops out of the lookup.
+    """
+    leg1 = models.ForeignKey(
+        FlightInstance, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    leg2_flight = models.ForeignKey(
+        FlightInstance,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    leg2_sailing = models.ForeignKey(
+        Sailing,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    # Departure date of leg 1.
+    date = models.DateField()
+    gap_seconds = models.PositiveIntegerField()
+    origin_group = models.CharField(max_length=5)
+    destination_group = models.CharField(max_length=5)
+
+    class Meta:
+        indexes = [models.Index(fields=["origin_group", "destination_group", "date"])]
+
+    def __str__(self) -> str:
+        return f"{self.origin_group} -> {self.destination_group} on {self.date} ({self.gap_seconds}s)"
+
+
+class SearchDemand(models.Model):
+    """
+    Daily search counter per requested origin/destination pair.
+
+    Recorded by the search endpoint and read by the ingestion scheduler, so the
+    API-call budget is spent on the parts of the network users actually look at.
+    """
+    origin = models.CharField(max_length=5)
+    destination = models.CharField(max_length=5)
+    day = models.DateField()
+    searches = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("origin", "destination", "day")
+        indexes = [models.Index(fields=["day"])]
+
+    def __str__(self) -> str:
+        return f"{self.origin} -> {self.destination} on {self.day}: {self.searches}"
+
+    @classmethod
+    def record(cls, origin: str, destination: str, searches: int = 1, day: Optional[date] = None) -> None:
+        """Adds `searches` to the pair's counter; the search endpoint batches them (core/demand.py)."""
+        day = day or timezone.localdate()
+        lookup = {"origin": origin[:5], "destination": destination[:5], "day": day}
+        if cls.objects.filter(**lookup).update(searches=F("searches") + searches):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(searches=searches, **lookup)
+        except IntegrityError:
+            # Another worker created today's row first.
+            cls.objects.filter(**lookup).update(searches=F("searches") + searches)
+
+
+class FetchJob(models.Model):
+    """
+    A deduplicated, on-demand refresh request raised when a search comes back empty.
+
+    Jobs are drained by the `run_fetch_worker` command, which reuses the Duffel
+    and FRS-Express fetch logic. A partial unique constraint guarantees at most
+    one open (pending or running) job per kind/O/D/date.
+    """
+    KIND_CHOICES = (("flight", "Flight"), ("ferry", "Ferry"))
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+    OPEN_STATUSES = ("pending", "running")
+
+    kind = models.CharField(max_length=6, choices=KIND_CHOICES)
+    origin = models.CharField(max_length=5)
+    destination = models.CharField(max_length=5)
+    date = models.DateField()
+    status = models.CharField(
+        max_length=7, choices=STATUS_CHOICES, default="pending", db_index=True
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "origin", "destination", "date"],
+                condition=models.Q(status__in=["pending", "running"]),
+                name="unique_open_fetch_job",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.origin} -> {self.destination} on {self.date} [{self.status}]"
+
+
+class NetworkEdge(models.Model):
+    """
+    An origin/destination pair a flight provider was found to serve.
+
+    Discovery probes are expensive, so edges persist between runs and are only
+    re-probed once `last_probed_at` is older than the topology TTL, or after
+    the rolling sweep has come back empty `empty_streak` times in a row.
+    Codes are stored as requested (e.g. the metro code NYC).
+    """
+    provider = models.CharField(max_length=20)
+    origin = models.CharField(max_length=5)
+    destination = models.CharField(max_length=5)
+    is_active = models.BooleanField(default=True)
+    first_seen_at = models.DateTimeField(null=True, blank=True)
+    last_confirmed_at = models.DateTimeField(null=True, blank=True)
+    last_probed_at = models.DateTimeField(null=True, blank=True)
+    empty_streak = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("provider", "origin", "destination")
+
+    def __str__(self) -> str:
+        state = "active" if self.is_active else "inactive"
+        return f"{self.provider}: {self.origin} -> {self.destination} ({state})"
+
+
+class IngestRun(models.Model):
+    """
+    One execution of an ingest command and the provider calls it spent.
+
+    Runs make per-day call budgets enforceable across separate cron
+    invocations, and their tasks are the history the budget planner learns
+    route volatility from. A sweep plans its (route, date) tasks up front as
+    pending rows, so a run that never reached `finished_at` (container
+    restart, OOM) can be resumed with only its unfinished tasks. `metrics`
+    holds the run's latency, row and phase summary (core/runstats.py).
+    """
+    command = models.CharField(max_length=50, db_index=True)
+    # Whose API the run's calls were spent on (duffel, amadeus, frs): daily
+    # budgets are per provider.
+    provider = models.CharField(max_length=20, blank=True, db_index=True)
+    started_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    budget = models.PositiveIntegerField(null=True, blank=True)
+    api_calls = models.PositiveIntegerField(default=0)
+    metrics = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ["-started_at"]
+
+    def __str__(self) -> str:
+        return f"{self.command} @ {self.started_at:%Y-%m-%d %H:%M}: {self.api_calls} calls"
+
+    @property
+    def duration(self) -> Optional[timedelta]:
+        return self.finished_at - self.started_at if self.finished_at else None
+
+    @classmethod
+    def calls_since(cls, since: Any, provider: str) -> int:
+        """
+        Calls spent on `provider` since `since`: everything the runs started
+        since then spent, plus the tasks older, long-running daemons completed.
+        """
+        started = cls.objects.filter(started_at__gte=since, provider=provider).aggregate(
+            total=Sum("api_calls")
+        )["total"]
+        ongoing = IngestTask.objects.filter(
+            run__started_at__lt=since, run__provider=provider, completed_at__gte=since
+        ).aggregate(total=Sum("api_calls"))["total"]
+        return (started or 0) + (ongoing or 0)
+
+    @classmethod
+    def resumable(cls, command: str) -> Optional["IngestRun"]:
+        """The latest run of `command` that never finished, if any."""
+        return cls.objects.filter(command=command, finished_at__isnull=True).first()
+
+    def plan(self, tasks: Iterable[tuple[str, str, Any]]) -> None:
+        """Checkpoints the sweep: one pending task per (origin, destination, date)."""
+        IngestTask.objects.bulk_create(
+            [
+                IngestTask(run=self, origin=o, destination=d, date=day, api_calls=0)
+                for o, d, day in tasks
+            ]
+        )
+
+    def unfinished_tasks(self) -> "models.QuerySet[IngestTask]":
+        return self.tasks.exclude(status="done").order_by("pk")
+
+    def record(
+        self,
+        origin: str,
+        destination: str,
+        day: Any,
+        api_calls: int,
+        changes: int,
+        status: str = "done",
+        duration_ms: Optional[int] = None,
+    ) -> "IngestTask":
+        """Completes the planned task for the fetch, or logs an unplanned one."""
+        values = {
+            "api_calls": api_calls,
+            "changes": changes,
+            "status": status,
+            "duration_ms": duration_ms,
+            "completed_at": timezone.now(),
+        }
+        task = self.unfinished_tasks().filter(
+            origin=origin, destination=destination, date=day
+        ).first()
+        if task is None:
+            task = IngestTask.objects.create(
+                run=self, origin=origin, destination=destination, date=day, **values
+            )
+        else:
+            for name, value in values.items():
+                setattr(task, name, value)
+            task.save(update_fields=list(values))
+        # Kept current while the run is in progress so a concurrent run sees
+        # the spend when it checks the daily budget.
+        IngestRun.objects.filter(pk=self.pk).update(api_calls=F("api_calls") + api_calls)
+        self.api_calls += api_calls
+        return task
+
+    def finish(self, api_calls: Optional[int] = None, metrics: Optional[dict[str, Any]] = None) -> None:
+        """Closes the run; `api_calls` overrides the tally with the command's own counter."""
+        self.finished_at = timezone.now()
+        if api_calls is not None:
+            self.api_calls = api_calls
+        if metrics is not None:
+            self.metrics = metrics
+        self.save(update_fields=["finished_at", "api_calls", "metrics"])
+
+
+class IngestTask(models.Model):
+    """A single provider fetch (origin, destination, date) inside an IngestRun."""
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+    run = models.ForeignKey(IngestRun, on_delete=models.CASCADE, related_name="tasks")
+    origin = models.CharField(max_length=5)
+    destination = models.CharField(max_length=5)
+    date = models.DateField()
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default="pending")
+    api_calls = models.PositiveSmallIntegerField(default=1)
+    # Rows inserted, updated or deleted by the fetch's reconciliation.
+    changes = models.PositiveIntegerField(default=0)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["completed_at", "origin", "destination"])]
+
+    def __str__(self) -> str:
+        return f"{self.origin} -> {self.destination} on {self.date} [{self.status}]: {self.changes} changes"
+
+
 class ReportedIssue(models.Model):
     ISSUE_TYPES = [
         ("routing_error", "Bad Route or Connection"),
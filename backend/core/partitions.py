@@ -0,0 +1,181 @@
+"""
+Daily range partitions for the departure tables.
+
+On PostgreSQL, migration 0019 turns `core_flightinstance` and `core_sailing`
+into tables partitioned by RANGE (date): one `<table>_pYYYYMMDD` partition per
+day plus a `<table>_default` catch-all. This module keeps the partitions in
+step with the calendar:
+
+- `ensure_partitions` creates the daily partitions ahead of the ingesters, so
+  new rows land in their own partition rather than the default one,
+- `prune` detaches and drops the partitions of past days, which replaces the
+  row-by-row `DELETE ... WHERE date < today` the ingesters used to run.
+
+Searches filter on `date`, so the planner only scans the partitions of the
+requested days. On SQLite (dev, tests) the tables are plain and `prune` falls
+back to a queryset delete.
+"""
+
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .models import FlightInstance, Sailing
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_MODELS: tuple[type[models.Model], ...] = (FlightInstance, Sailing)
+
+
+def partition_name(table: str, day: date) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def is_partitioned(model: type[models.Model]) -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_class WHERE relname = %s AND relkind = 'p'",
+            [model._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def daily_partitions(model: type[models.Model]) -> dict[date, str]:
+    """The attached daily partitions of a partitioned table, by day."""
+    table = model._meta.db_table
+    pattern = re.compile(rf"^{re.escape(table)}_p(\d{{8}})$")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return {
+        datetime.strptime(match.group(1), "%Y%m%d").date(): name
+        for name in names
+        if (match := pattern.match(name))
+    }
+
+
+def has_default_partition(model: type[models.Model]) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT partdefid <> 0 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def ensure_partitions(model: type[models.Model], start: date, end: date) -> int:
+    """Creates the missing daily partitions for [start, end]; returns how many."""
+    if not is_partitioned(model):
+        return 0
+    table = model._meta.db_table
+    default = f"{table}_default"
+    qn = connection.ops.quote_name
+    existing = daily_partitions(model)
+    created = 0
+
+    day = start
+    while day <= end:
+        if day not in existing:
+            name = partition_name(table, day)
+            bounds = [day.isoformat(), (day + timedelta(days=1)).isoformat()]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT EXISTS (SELECT 1 FROM {qn(default)} WHERE date >= %s AND date < %s)",
+                    bounds,
+                )
+                if cursor.fetchone()[0]:
+                    # Postgres refuses a partition whose rows already sit in
+                    # the default one: move them across, then attach.
+                    cursor.execute(
+                        f"CREATE TABLE {qn(name)} "
+                        f"(LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                    )
+                    cursor.execute(
+                        f"WITH moved AS (DELETE FROM {qn(default)} "
+                        f"WHERE date >= %s AND date < %s RETURNING *) "
+                        f"INSERT INTO {qn(name)} SELECT * FROM moved",
+                        bounds,
+                    )
+                    cursor.execute(
+                        f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} "
+                        f"FOR VALUES FROM (%s) TO (%s)",
+                        bounds,
+                    )
+                else:
+                    cursor.execute(
+                        f"CREATE TABLE {qn(name)} PARTITION OF {qn(table)} "
+                        f"FOR VALUES FROM (%s) TO (%s)",
+                        bounds,
+                    )
+            created += 1
+        day += timedelta(days=1)
+
+    if created:
+        logger.info(f"Created {created} daily partitions of {table}")
+    return created
+
+
+def prune(model: type[models.Model], before: date) -> int:
+    """
+    Removes every row dated before `before` and returns how many went.
+
+    Past daily partitions are detached, then dropped whole; only stray rows in
+    the default partition are deleted row by row. The DROP then only locks
+    the detached table. The DETACH itself takes an ACCESS EXCLUSIVE lock on
+    the parent for a catalog update: Postgres refuses `DETACH ... CONCURRENTLY`
+    while a default partition exists, and migration 0019 always creates one.
+    """
+    if not is_partitioned(model):
+        deleted, _ = model._default_manager.filter(date__lt=before).delete()
+        return deleted
+
+    table = model._meta.db_table
+    qn = connection.ops.quote_name
+    default = has_default_partition(model)
+    removed = 0
+    with connection.cursor() as cursor:
+        for day, name in sorted(daily_partitions(model).items()):
+            if day >= before:
+                break
+            cursor.execute(f"SELECT count(*) FROM {qn(name)}")
+            removed += cursor.fetchone()[0]
+            cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+            cursor.execute(f"DROP TABLE {qn(name)}")
+        if default:
+            cursor.execute(
+                f"DELETE FROM {qn(table + '_default')} WHERE date < %s", [before.isoformat()]
+            )
+            removed += cursor.rowcount
+    return removed
+
+
+def maintain(
+    today: Optional[date] = None, days_ahead: Optional[int] = None
+) -> dict[str, int]:
+    """Creates the partitions from today to the horizon for every partitioned table."""
+    today = today or timezone.localdate()
+    if days_ahead is None:
+        days_ahead = getattr(settings, "PARTITION_DAYS_AHEAD", 60)
+    return {
+        model._meta.db_table: ensure_partitions(
+            model, today, today + timedelta(days=days_ahead)
+        )
+        for model in PARTITIONED_MODELS
+    }
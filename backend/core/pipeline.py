@@ -0,0 +1,241 @@
+"""
+Shared write path for provider segment streams.
+
+Provider adapters yield `SegmentRecord`s; `ingest_segments()` runs them
+through the same stages regardless of where they came from:
+
+1. validate   -- drop records with missing codes, unparsable times or prices,
+2. dedupe     -- collapse the many offers for one flight into a single record
+                 carrying the minimum price,
+3. resolve    -- bulk get-or-create the carriers, locations and routes, and
+                 refresh the route templates (times, weekday pattern, last
+                 confirmation) with one bulk update,
+4. reconcile  -- diff the resulting flights against the stored slice,
+5. record     -- append the fares that moved to the history (core/fares.py).
+
+The stream is consumed once and only one record per distinct flight is kept,
+so memory grows with the number of flights, not the number of offers.
+"""
+
+import logging
+from datetime import date, time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from django.db import models
+from django.utils import timezone
+
+from .fares import record_observations
+from .models import Carrier, FlightInstance, Location, Route
+from .providers.base import SegmentRecord
+from .reconcile import ChangeSet, flight_scope, reconcile_flights, route_changes
+from .runstats import RunStats
+
+logger = logging.getLogger(__name__)
+
+# (carrier, origin, destination, departure time, date): one flight.
+FlightKey = tuple[str, str, str, str, date]
+# (carrier, origin, destination, departure time): the Route natural key.
+RouteKey = tuple[str, str, str, str]
+
+
+def _price(value: Optional[str]) -> Optional[Decimal]:
+    if value in (None, ""):
+        return None
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"bad price {value!r}")
+    if price < 0:
+        raise ValueError(f"negative price {value!r}")
+    return price
+
+
+def validate(records: Iterable[SegmentRecord]) -> Iterator[SegmentRecord]:
+    for record in records:
+        try:
+            if not record.carrier_code or not record.origin or not record.destination:
+                raise ValueError("missing carrier or airport code")
+            if max(len(record.origin), len(record.destination)) > 5:
+                raise ValueError("airport code too long")
+            time.fromisoformat(record.departure_time)
+            time.fromisoformat(record.arrival_time)
+            _price(record.price_amount)
+        except ValueError as e:
+            logger.warning(f"Dropped segment {record.flight_number} on {record.date}: {e}")
+            continue
+        yield record
+
+
+def dedupe(records: Iterable[SegmentRecord]) -> dict[FlightKey, SegmentRecord]:
+    """Keeps one record per flight: the one with the lowest price (unpriced loses)."""
+    best: dict[FlightKey, SegmentRecord] = {}
+    for record in records:
+        key = (
+            record.carrier_code,
+            record.origin,
+            record.destination,
+            record.departure_time,
+            record.date,
+        )
+        current = best.get(key)
+        if current is None or _cheaper(record, current):
+            best[key] = record
+    return best
+
+
+def _cheaper(a: SegmentRecord, b: SegmentRecord) -> bool:
+    price_a, price_b = _price(a.price_amount), _price(b.price_amount)
+    if price_a is None:
+        return False
+    return price_b is None or price_a < price_b
+
+
+def resolve_routes(records: Iterable[SegmentRecord]) -> tuple[dict[RouteKey, Route], set[int]]:
+    """
+    Bulk get-or-create of every carrier, location and route the records use,
+    and a single bulk update of the route templates. Replaces the per-segment
+    `get_or_create`/`update_or_create` calls the ingesters used to make.
+    Also returns the ids of the routes whose arrival time, duration or active
+    flag the update changed.
+    """
+    records = list(records)
+    if not records:
+        return {}, set()
+    now = timezone.now()
+
+    carrier_names = {r.carrier_code: r.carrier_name for r in records}
+    carriers = _get_or_create_by_code(
+        Carrier,
+        carrier_names,
+        lambda code: Carrier(code=code, name=carrier_names[code], carrier_type="AIR"),
+    )
+    codes = {code for r in records for code in (r.origin, r.destination)}
+    locations = _get_or_create_by_code(
+        Location, codes, lambda code: Location(code=code, name=code)
+    )
+
+    latest: dict[RouteKey, SegmentRecord] = {}
+    weekdays: dict[RouteKey, set[str]] = {}
+    for r in records:
+        key = (r.carrier_code, r.origin, r.destination, r.departure_time)
+        latest[key] = r
+        weekdays.setdefault(key, set()).add(str(r.date.isoweekday()))
+
+    def route_key(route: Route) -> RouteKey:
+        return (
+            route.carrier.code,
+            route.origin.code,
+            route.destination.code,
+            route.departure_time.strftime("%H:%M") if route.departure_time else "",
+        )
+
+    def existing_routes() -> dict[RouteKey, Route]:
+        found = Route.objects.filter(
+            carrier__in=carriers.values(),
+            origin__in=[locations[r.origin] for r in latest.values()],
+            destination__in=[locations[r.destination] for r in latest.values()],
+            departure_time__in={r.departure_time for r in latest.values()},
+        ).select_related("carrier", "origin", "destination")
+        return {k: route for route in found if (k := route_key(route)) in latest}
+
+    routes = existing_routes()
+    missing = [key for key in latest if key not in routes]
+    if missing:
+        Route.objects.bulk_create(
+            [
+                Route(
+                    carrier=carriers[key[0]],
+                    origin=locations[key[1]],
+                    destination=locations[key[2]],
+                    departure_time=key[3],
+                    days_of_operation="",
+                )
+                for key in missing
+            ],
+            ignore_conflicts=True,
+        )
+        routes = existing_routes()
+
+    retimed: set[int] = set()
+    for key, route in routes.items():
+        r = latest[key]
+        fresh = (True, time.fromisoformat(r.arrival_time), r.duration_minutes)
+        if (route.is_active, route.arrival_time, route.duration_minutes) != fresh:
+            retimed.add(route.pk)
+        route.is_active = True
+        route.last_confirmed_at = now
+        route.duration_minutes = r.duration_minutes
+        route.arrival_time = r.arrival_time
+        route.flight_number = r.flight_number
+        route.aircraft_type = r.aircraft_type
+        route.days_of_operation = "".join(
+            sorted(set(route.days_of_operation or "") | weekdays[key])
+        )
+        route.updated_at = now
+    Route.objects.bulk_update(
+        routes.values(),
+        [
+            "is_active",
+            "last_confirmed_at",
+            "duration_minutes",
+            "arrival_time",
+            "flight_number",
+            "aircraft_type",
+            "days_of_operation",
+            "updated_at",
+        ],
+    )
+    return routes, retimed
+
+
+def _get_or_create_by_code(
+    model: type[models.Model], codes: Iterable[str], build: Callable[[str], models.Model]
+) -> dict[str, Any]:
+    codes = set(codes)
+    found = model.objects.in_bulk(codes, field_name="code")
+    missing = codes - found.keys()
+    if missing:
+        model.objects.bulk_create([build(code) for code in missing], ignore_conflicts=True)
+        found = model.objects.in_bulk(codes, field_name="code")
+    return found
+
+
+def ingest_segments(
+    origin: str,
+    dest: str,
+    day: date,
+    records: Iterable[SegmentRecord],
+    stats: Optional[RunStats] = None,
+) -> tuple[ChangeSet, int]:
+    """
+    Runs one provider answer through the pipeline and reconciles it against
+    the stored flights for the query. Returns the change set and the number of
+    distinct flights the provider offered. With `stats`, stages 1-2 are timed
+    as the run's parse phase and stages 3-5 as its DB phase.
+    """
+    stats = stats or RunStats()
+    with stats.phase("parse"):
+        flights = dedupe(validate(records))
+
+    with stats.phase("db"):
+        routes, retimed = resolve_routes(flights.values())
+        fresh = [
+            FlightInstance(
+                route=routes[(r.carrier_code, r.origin, r.destination, r.departure_time)],
+                date=r.date,
+                price_amount=r.price_amount,
+                currency=r.currency,
+                available_seats=r.available_seats,
+                cabin_class=r.cabin_class,
+            )
+            for r in flights.values()
+        ]
+        changes = reconcile_flights(flight_scope(origin, dest, day, fresh), fresh)
+        if retimed:
+            # Connections and cached legs are built from the route's times
+            # and active flag, so every upcoming flight of the route is stale.
+            changes.merge(route_changes(retimed, exclude=changes.changed_keys))
+        record_observations(fresh)
+    stats.add_changes(changes)
+    return changes, len(fresh)
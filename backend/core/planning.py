@@ -0,0 +1,221 @@
+"""
+Refresh prioritisation for the flight ingesters.
+
+Instead of re-probing every route for a fixed rolling window, the scheduler
+scores each (origin, destination, date) refresh task and spends the API budget
+on the highest scores first. A task scores higher when:
+
+- its data is stale (oldest real `FlightInstance.last_seen_at`, or never
+  seen; projected rows do not count as seen),
+- the departure date is close, and
+- users have recently searched for an O/D that the leg can serve, and
+- past fetches of the pair tended to change something (volatility, learned
+  from `IngestTask` history).
+
+With a call budget, `allocate_budget()` takes the top of the queue, and
+`call_allowance()` caps a run by its own budget and what is left of the day's.
+`window_allowance()` does the same for the scheduler's rolling window.
+"""
+
+import heapq
+import math
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from django.db.models import Count, Min, Q, Sum
+from django.utils import timezone
+
+from .legs import group_of, location_groups
+from .models import FlightInstance, IngestRun, IngestTask, Route, SearchDemand
+
+# Data younger than this is not worth a paid call at all.
+MIN_REFRESH_AGE = timedelta(hours=6)
+# Data this old (or never fetched) counts as fully stale.
+STALE_AFTER = timedelta(hours=72)
+DEMAND_LOOKBACK_DAYS = 7
+VOLATILITY_LOOKBACK_DAYS = 14
+# Volatility of a pair with no fetch history (the Laplace prior).
+DEFAULT_VOLATILITY = 0.5
+
+
+@dataclass(order=True)
+class RefreshTask:
+    # heapq is a min-heap, so the queue stores the negated score.
+    sort_key: float
+    origin: str = field(compare=False)
+    destination: str = field(compare=False)
+    date: date = field(compare=False)
+    score: float = field(compare=False, default=0.0)
+    last_seen_at: Optional[datetime] = field(compare=False, default=None)
+    demand: int = field(compare=False, default=0)
+    volatility: float = field(compare=False, default=DEFAULT_VOLATILITY)
+
+    @property
+    def date_str(self) -> str:
+        return self.date.strftime("%Y-%m-%d")
+
+    def __str__(self) -> str:
+        return f"{self.origin}->{self.destination} {self.date_str} (score {self.score:.2f})"
+
+
+def score_task(
+    last_seen_at: Optional[datetime],
+    days_out: int,
+    demand: int,
+    now: datetime,
+    volatility: float = DEFAULT_VOLATILITY,
+) -> float:
+    if last_seen_at is None:
+        staleness = 1.0
+    else:
+        age = now - last_seen_at
+        if age < MIN_REFRESH_AGE:
+            return 0.0
+        staleness = min(age / STALE_AFTER, 1.0)
+    proximity = 1.0 / (1 + max(days_out, 0))
+    return (
+        staleness
+        * (0.5 + proximity)
+        * (1 + math.log1p(demand))
+        * (0.5 + volatility)
+    )
+
+
+def recent_demand(groups: dict[str, str], today: date) -> tuple[dict[str, int], dict[str, int]]:
+    """Searches in the lookback window, summed per origin group and per destination group."""
+    by_origin: dict[str, int] = {}
+    by_dest: dict[str, int] = {}
+    rows = (
+        SearchDemand.objects.filter(day__gte=today - timedelta(days=DEMAND_LOOKBACK_DAYS))
+        .values("origin", "destination")
+        .annotate(total=Sum("searches"))
+    )
+    for row in rows:
+        o = group_of(row["origin"], groups)
+        d = group_of(row["destination"], groups)
+        by_origin[o] = by_origin.get(o, 0) + row["total"]
+        by_dest[d] = by_dest.get(d, 0) + row["total"]
+    return by_origin, by_dest
+
+
+def route_volatility(now: datetime) -> dict[tuple[str, str], float]:
+    """
+    Share of recent fetches per O/D pair that changed at least one row,
+    Laplace-smoothed so a pair with little history stays near the prior.
+    """
+    rows = (
+        IngestTask.objects.filter(
+            status="done",
+            completed_at__gte=now - timedelta(days=VOLATILITY_LOOKBACK_DAYS),
+        )
+        .values("origin", "destination")
+        .annotate(fetches=Count("id"), changed=Count("id", filter=Q(changes__gt=0)))
+    )
+    return {
+        (row["origin"], row["destination"]): (row["changed"] + 1) / (row["fetches"] + 2)
+        for row in rows
+    }
+
+
+def call_allowance(
+    provider: str,
+    run_budget: Optional[int],
+    daily_budget: Optional[int],
+    now: Optional[datetime] = None,
+) -> Optional[int]:
+    """
+    Calls a new run may spend: the tighter of its own budget and whatever the
+    day's runs against the same `provider` have left of `daily_budget`. None
+    means unlimited.
+    """
+    limits = [] if run_budget is None else [run_budget]
+    if daily_budget is not None:
+        now = now or timezone.now()
+        day_start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        limits.append(max(daily_budget - IngestRun.calls_since(day_start, provider), 0))
+    return min(limits, default=None)
+
+
+def window_allowance(
+    provider: str, budget: int, window: timedelta, now: Optional[datetime] = None
+) -> int:
+    """Calls left of a rolling `budget` after what every run spent on `provider` within `window`."""
+    since = (now or timezone.now()) - window
+    return max(budget - IngestRun.calls_since(since, provider), 0)
+
+
+def allocate_budget(queue: list[RefreshTask], calls: int) -> list[RefreshTask]:
+    """Pops the `calls` highest-scoring tasks (one provider call each) off the heap."""
+    return [heapq.heappop(queue) for _ in range(min(calls, len(queue)))]
+
+
+def flight_pairs() -> list[tuple[str, str]]:
+    return list(
+        Route.objects.filter(is_active=True, carrier__carrier_type="AIR")
+        .values_list("origin__code", "destination__code")
+        .distinct()
+    )
+
+
+def build_refresh_queue(
+    pairs: Iterable[tuple[str, str]],
+    dates: Iterable[date],
+    now: Optional[datetime] = None,
+    probed: Optional[dict[tuple[str, str, date], datetime]] = None,
+) -> list[RefreshTask]:
+    """
+    Returns a heap of refresh tasks for every pair/date, highest score first.
+    Tasks refreshed more recently than MIN_REFRESH_AGE are left out.
+
+    `probed` holds probe times the caller knows about beyond `last_seen_at`;
+    a probe that came back empty leaves no FlightInstance behind, and without
+    it the same empty day would be re-fetched on every round.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    pairs = list(pairs)
+    dates = list(dates)
+
+    groups = location_groups()
+    # Pairs may use metro codes (NYC) for routes stored under their airports
+    # (JFK), so rows count for their own codes and their alias groups.
+    seen: dict[tuple[str, str, date], datetime] = {}
+    rows = (
+        FlightInstance.objects.filter(date__in=dates, is_projected=False)
+        .values("route__origin__code", "route__destination__code", "date")
+        .annotate(oldest=Min("last_seen_at"))
+    )
+    for row in rows:
+        origin, dest = row["route__origin__code"], row["route__destination__code"]
+        for o in {origin, group_of(origin, groups)}:
+            for d in {dest, group_of(dest, groups)}:
+                key = (o, d, row["date"])
+                seen[key] = min(seen.get(key, row["oldest"]), row["oldest"])
+    demand_from, demand_to = recent_demand(groups, today)
+    volatility = route_volatility(now)
+
+    queue: list[RefreshTask] = []
+    for origin, dest in pairs:
+        # A leg serves searches leaving its origin group or reaching its destination group.
+        demand = demand_from.get(group_of(origin, groups), 0) + demand_to.get(
+            group_of(dest, groups), 0
+        )
+        pair_volatility = volatility.get((origin, dest), DEFAULT_VOLATILITY)
+        for day in dates:
+            last_seen = max(
+                filter(None, [seen.get((origin, dest, day)), (probed or {}).get((origin, dest, day))]),
+                default=None,
+            )
+            score = score_task(
+                last_seen, (day - today).days, demand, now, pair_volatility
+            )
+            if score <= 0:
+                continue
+            queue.append(
+                RefreshTask(
+                    -score, origin, dest, day, score, last_seen, demand, pair_volatility
+                )
+            )
+    heapq.heapify(queue)
+    return queue
@@ -0,0 +1,191 @@
+"""
+On-demand profiling of single requests.
+
+A slow search in production is rarely reproducible locally, and profiling
+every request is far too expensive. `RequestProfilerMiddleware` profiles only
+the requests that ask for it:
+
+- requests carrying a signed `X-Profile-Token` header (`manage.py
+  profile_token` issues one, valid for `PROFILE_TOKEN_MAX_AGE` seconds and for
+  the path prefix it was signed for), or
+- requests of a logged-in staff user with `?_profile=1`.
+
+Such a request runs under cProfile while every SQL statement it issues is
+timed. The profile is stored as `<id>.pstats` (for `python -m pstats` or
+snakeviz) next to `<id>.json`, which holds the request, its SQL timeline and
+the top functions by cumulative time, in `PROFILE_DIR` (the logs volume in
+production). The response carries the id in `X-Profile-Id`.
+
+Profiling is bounded three ways: only `PROFILE_SAMPLE_RATE` of the eligible
+requests are profiled, at most one request per process at a time, and the
+oldest profiles are deleted beyond `PROFILE_MAX_FILES` / `PROFILE_MAX_BYTES`.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TOKEN_HEADER = "HTTP_X_PROFILE_TOKEN"
+STAFF_PARAM = "_profile"
+TOKEN_SALT = "core.profiling"
+TOP_FUNCTIONS = 40
+
+# One profiled request per process: bounds the overhead and keeps profiles of
+# concurrent requests from interleaving.
+_busy = threading.Lock()
+
+
+def issue_token(path_prefix: str = "/") -> str:
+    """A header value allowing requests under `path_prefix` to be profiled."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(path_prefix)
+
+
+def token_allows(token: str, path: str) -> bool:
+    max_age = getattr(settings, "PROFILE_TOKEN_MAX_AGE", 3600)
+    try:
+        prefix = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=max_age)
+    except signing.BadSignature:
+        return False
+    return path.startswith(prefix)
+
+
+def trigger(request: HttpRequest) -> Optional[str]:
+    """Why `request` asked to be profiled ("token" or "staff"), or None."""
+    token = request.META.get(TOKEN_HEADER)
+    if token:
+        if token_allows(token, request.path):
+            return "token"
+        logger.warning(f"Rejected profiling token for {request.path}")
+        return None
+    user = getattr(request, "user", None)
+    if request.GET.get(STAFF_PARAM) == "1" and user is not None and user.is_staff:
+        return "staff"
+    return None
+
+
+class SqlTimeline:
+    """An execute wrapper recording when each statement ran and how long it took."""
+
+    def __init__(self, started: float) -> None:
+        self.started = started
+        self.entries: list[dict[str, Any]] = []
+
+    def __call__(self, execute: Callable, sql: str, params: Any, many: bool, context: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            end = time.perf_counter()
+            self.entries.append(
+                {
+                    "start_ms": round((start - self.started) * 1000, 3),
+                    "duration_ms": round((end - start) * 1000, 3),
+                    "sql": sql,
+                }
+            )
+
+
+def top_functions(profiler: cProfile.Profile, limit: int = TOP_FUNCTIONS) -> list[dict[str, Any]]:
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():  # type: ignore[attr-defined]
+        rows.append(
+            {
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "tottime_ms": round(tottime * 1000, 3),
+                "cumtime_ms": round(cumtime * 1000, 3),
+            }
+        )
+    rows.sort(key=lambda row: row["cumtime_ms"], reverse=True)
+    return rows[:limit]
+
+
+def enforce_caps(directory: Path) -> int:
+    """Deletes the oldest profiles beyond the file and byte caps; returns how many went."""
+    max_files = getattr(settings, "PROFILE_MAX_FILES", 200)
+    max_bytes = getattr(settings, "PROFILE_MAX_BYTES", 100 * 1024 * 1024)
+    profiles = sorted(directory.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True)
+    kept_bytes, removed = 0, 0
+    for index, report in enumerate(profiles):
+        files = [report, report.with_suffix(".pstats")]
+        size = sum(path.stat().st_size for path in files if path.exists())
+        kept_bytes += size
+        if index >= max_files or kept_bytes > max_bytes:
+            for path in files:
+                path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+class RequestProfilerMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        rate = getattr(settings, "PROFILE_SAMPLE_RATE", 1.0)
+        reason = trigger(request) if rate > 0 else None
+        if reason is None or random.random() >= rate or not _busy.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request, reason)
+        finally:
+            _busy.release()
+
+    def profile(self, request: HttpRequest, reason: str) -> HttpResponse:
+        started_at = timezone.now()
+        started = time.perf_counter()
+        timeline = SqlTimeline(started)
+        profiler = cProfile.Profile()
+        with connection.execute_wrapper(timeline):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+
+        slug = re.sub(r"[^a-z0-9]+", "-", request.path.lower()).strip("-")[:60]
+        profile_id = f"{started_at:%Y%m%dT%H%M%S}-{slug}-{uuid.uuid4().hex[:8]}"
+        report = {
+            "id": profile_id,
+            "trigger": reason,
+            "method": request.method,
+            "path": request.path,
+            "query": {key: value for key, value in request.GET.items() if key != STAFF_PARAM},
+            "status": response.status_code,
+            "started_at": started_at.isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "sql_ms": round(sum(entry["duration_ms"] for entry in timeline.entries), 3),
+            "sql": timeline.entries,
+            "top": top_functions(profiler),
+        }
+        directory = Path(getattr(settings, "PROFILE_DIR", "profiles"))
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(directory / f"{profile_id}.pstats"))
+            (directory / f"{profile_id}.json").write_text(json.dumps(report, indent=1))
+            enforce_caps(directory)
+        except OSError as e:
+            logger.error(f"Could not store request profile {profile_id}: {e}")
+            return response
+        logger.info(f"Profiled {request.method} {request.path} ({reason}): {profile_id}")
+        response["X-Profile-Id"] = profile_id
+        return response
@@ -0,0 +1,129 @@
+"""
+Schedule projection for flights.
+
+Duffel is only swept a few days ahead, but most Caribbean flights repeat on a
+weekly pattern that the ingesters already record in `Route.days_of_operation`.
+`project_schedules()` materializes provisional `FlightInstance` rows
+(`is_projected=True`) for the rest of the horizon from that pattern, bounded by:
+
+- the route's optional seasonal window (`valid_from` / `valid_until`), and
+- `last_confirmed_at` + the validity period, so a route that providers stop
+  returning fades out of search instead of being projected forever.
+
+Real provider rows always win: projections are never created on a day that
+already holds a real row, and the ingesters' reconciliation overwrites a
+projected row in place (clearing the flag) when the flight is returned. Nor
+are they created on a day a sweep task or on-demand fetch already asked the
+provider about: a flight missing from that answer was cancelled.
+
+Routes still carrying the model's default pattern ("1234567") are not
+projected: for routes created before patterns were learned from offers it
+says nothing about when the flight actually runs.
+"""
+
+import logging
+from datetime import date, timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import FetchJob, FlightInstance, IngestTask, Route
+from .reconcile import ChangeSet, reconcile_flights
+
+logger = logging.getLogger(__name__)
+
+LEGACY_PATTERN = "1234567"
+
+
+def projection_window(
+    route: Route, today: date, horizon_days: int, validity_days: int
+) -> Optional[tuple[date, date]]:
+    """The (first, last) dates a route may be projected on, or None."""
+    if not route.last_confirmed_at or route.days_of_operation in ("", LEGACY_PATTERN):
+        return None
+    start = max(today, route.valid_from or today)
+    end = min(
+        today + timedelta(days=horizon_days),
+        timezone.localdate(route.last_confirmed_at) + timedelta(days=validity_days),
+    )
+    if route.valid_until:
+        end = min(end, route.valid_until)
+    return (start, end) if start <= end else None
+
+
+def probed_days(first: date, last: date) -> set[tuple[str, str, date]]:
+    """(origin, destination, date) flight fetches answered by a provider in the range."""
+    tasks = IngestTask.objects.filter(status="done", date__range=[first, last])
+    jobs = FetchJob.objects.filter(kind="flight", status="done", date__range=[first, last])
+    return {
+        *tasks.values_list("origin", "destination", "date"),
+        *jobs.values_list("origin", "destination", "date"),
+    }
+
+
+def project_schedules(
+    today: Optional[date] = None,
+    horizon_days: Optional[int] = None,
+    validity_days: Optional[int] = None,
+) -> ChangeSet:
+    """
+    Rebuilds every projected flight from today onwards and returns the change
+    set, so callers can invalidate caches like any other ingest.
+    """
+    today = today or timezone.localdate()
+    if horizon_days is None:
+        horizon_days = getattr(settings, "SCHEDULE_PROJECTION_HORIZON_DAYS", 42)
+    if validity_days is None:
+        validity_days = getattr(settings, "SCHEDULE_PROJECTION_VALIDITY_DAYS", 28)
+
+    routes = Route.objects.filter(
+        is_active=True,
+        carrier__carrier_type="AIR",
+        last_confirmed_at__isnull=False,
+    ).select_related("origin__parent", "destination__parent")
+    last = today + timedelta(days=horizon_days)
+    real = set(
+        FlightInstance.objects.filter(is_projected=False, date__range=[today, last]).values_list(
+            "route_id", "date"
+        )
+    )
+    probed = probed_days(today, last)
+
+    fresh: list[FlightInstance] = []
+    for route in routes:
+        window = projection_window(route, today, horizon_days, validity_days)
+        if window is None:
+            continue
+        # Fetches are keyed by the requested codes: the airport or its group.
+        pairs = {
+            (o, d)
+            for o in (route.origin.code, route.origin.group_code)
+            for d in (route.destination.code, route.destination.group_code)
+        }
+        day, end = window
+        while day <= end:
+            if (
+                str(day.isoweekday()) in route.days_of_operation
+                and (route.pk, day) not in real
+                and not any((o, d, day) in probed for o, d in pairs)
+            ):
+                fresh.append(
+                    FlightInstance(
+                        route=route,
+                        date=day,
+                        price_amount=None,
+                        available_seats=None,
+                        cabin_class="",
+                        is_projected=True,
+                    )
+                )
+            day += timedelta(days=1)
+
+    # The projection is authoritative for all projected rows: anything it no
+    # longer produces (route deactivated, pattern expired) is removed.
+    changes = reconcile_flights(
+        FlightInstance.objects.filter(is_projected=True, date__gte=today), fresh
+    )
+    logger.info(f"Projected {len(fresh)} flights ({changes.summary()})")
+    return changes
@@ -0,0 +1,338 @@
+"""
+Pluggable HTTP layer for the external data providers.
+
+All provider traffic (Duffel offer requests, the Amadeus SDK and the
+FRS-Express HTML pages) goes through `ProviderHttp`, which can serve responses
+from an on-disk cache keyed by the request itself. Four modes are supported:
+
+- live:   plain pass-through, nothing is read or written.
+- cache:  serve stored responses younger than the TTL, fetch and store otherwise.
+- record: always hit the network and (over)write the stored responses.
+- replay: never touch the network; a request without a recording fails.
+
+Replay makes ingestion deterministic and network-free for tests and
+benchmarks, while the TTL cache avoids paying twice for the same Duffel call
+when a sweep is rerun.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from urllib.request import Request as UrllibRequest
+from urllib.request import urlopen
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MODES = ("live", "cache", "record", "replay")
+
+# Credentials never become part of a cache key (and so never land on disk in one).
+REDACTED_PARAMS = {"client_id", "client_secret", "access_token"}
+# Tokens expire long before the cache TTL and their bodies are credentials:
+# this call is never stored. Replay and cache mode answer it with a synthetic
+# token, which a cache miss swaps for a real one before going to the network.
+AMADEUS_TOKEN_PATH = "/v1/security/oauth2/token"
+SYNTHETIC_TOKEN = "provider-http-synthetic-token"
+
+
+class ReplayMiss(requests.RequestException):
+    """Raised in replay mode when no recording exists for a request."""
+
+
+class CachedResponse:
+    """
+    A stored provider response exposing the parts of `requests.Response` the
+    ingesters rely on (`status_code`, `content`, `text`, `json()`, `encoding`).
+    """
+
+    from_cache = True
+
+    def __init__(self, url: str, status_code: int, headers: dict[str, str], content: bytes) -> None:
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class _AmadeusResponse:
+    """Duck-types the `http.client.HTTPResponse` the Amadeus SDK parses."""
+
+    def __init__(self, status: int, headers: dict[str, str], body: bytes) -> None:
+        self.status = self.code = status
+        self._headers = headers
+        self._body = body
+
+    def getheaders(self) -> list[tuple[str, str]]:
+        return list(self._headers.items())
+
+    def read(self) -> bytes:
+        return self._body
+
+
+def _synthetic_token_response() -> _AmadeusResponse:
+    body = {
+        "type": "amadeusOAuth2Token",
+        "token_type": "Bearer",
+        "access_token": SYNTHETIC_TOKEN,
+        "expires_in": 1799,
+        "state": "approved",
+    }
+    return _AmadeusResponse(200, {"Content-Type": "application/json"}, json.dumps(body).encode("utf-8"))
+
+
+def _canonical_url(url: str, params: Optional[dict[str, Any]] = None) -> str:
+    parts = urlsplit(url)
+    query = [
+        (k, str(v))
+        for k, v in [*parse_qsl(parts.query), *(params or {}).items()]
+        if k not in REDACTED_PARAMS
+    ]
+    return urlunsplit(parts._replace(query=urlencode(sorted(query))))
+
+
+def _canonical_body(body: Any) -> str:
+    if body is None:
+        return ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    if isinstance(body, str):
+        # Form-encoded bodies (the Amadeus token call) carry credentials.
+        pairs = parse_qsl(body, keep_blank_values=True)
+        if pairs and "=" in body and not body.lstrip().startswith("{"):
+            return urlencode(sorted((k, v) for k, v in pairs if k not in REDACTED_PARAMS))
+        return body
+    return json.dumps(body, sort_keys=True, separators=(",", ":"))
+
+
+class HostLimiter:
+    """
+    Per-host politeness limit shared by concurrent fetchers: at most
+    `max_concurrent` requests in flight per host, and request starts spaced at
+    least `min_interval` seconds apart. Cache hits never take a slot.
+    """
+
+    def __init__(self, max_concurrent: int = 2, min_interval: float = 1.0) -> None:
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._slots: dict[str, threading.BoundedSemaphore] = {}
+        self._next_start: dict[str, float] = {}
+
+    @contextmanager
+    def slot(self, host: str) -> Iterator[None]:
+        with self._lock:
+            sem = self._slots.setdefault(host, threading.BoundedSemaphore(self.max_concurrent))
+        with sem:
+            with self._lock:
+                now = time.monotonic()
+                start_at = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start_at + self.min_interval
+            if start_at > now:
+                time.sleep(start_at - now)
+            yield
+
+
+class ProviderHttp:
+    def __init__(
+        self,
+        namespace: str,
+        mode: Optional[str] = None,
+        cache_dir: Optional[Path] = None,
+        ttl: Optional[int] = None,
+        session: Optional[requests.Session] = None,
+        limiter: Optional[HostLimiter] = None,
+    ) -> None:
+        self.namespace = namespace
+        self.mode = mode or getattr(settings, "PROVIDER_HTTP_MODE", "live")
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown provider HTTP mode '{self.mode}' (expected one of {MODES})")
+        self.cache_dir = Path(
+            cache_dir or getattr(settings, "PROVIDER_HTTP_CACHE_DIR", "provider_cache")
+        ) / namespace
+        self.ttl = ttl if ttl is not None else getattr(settings, "PROVIDER_HTTP_TTL", 6 * 60 * 60)
+        self.session = session or requests.Session()
+        self.limiter = limiter
+        # A core.runstats.RunStats observing every request sent to the network.
+        self.run_stats: Any = None
+        self.hits = 0
+        self.misses = 0
+
+    # --- Keying & storage -------------------------------------------------
+
+    def cache_key(self, method: str, url: str, params: Optional[dict[str, Any]] = None, body: Any = None) -> str:
+        raw = "\n".join([method.upper(), _canonical_url(url, params), _canonical_body(body)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _load(self, key: str, honour_ttl: bool) -> Optional[CachedResponse]:
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if honour_ttl and time.time() - entry["stored_at"] > self.ttl:
+            return None
+        return CachedResponse(
+            entry["url"],
+            entry["status_code"],
+            entry["headers"],
+            base64.b64decode(entry["body"]),
+        )
+
+    def _store(self, key: str, method: str, url: str, status_code: int, headers: dict[str, str], content: bytes) -> None:
+        # Only successful responses are worth replaying; a recorded 429 or 500
+        # would poison every later run.
+        if not 200 <= status_code < 300:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "method": method.upper(),
+            "url": _canonical_url(url),
+            "status_code": status_code,
+            "headers": {"Content-Type": headers.get("Content-Type", "")},
+            "stored_at": time.time(),
+            "body": base64.b64encode(content).decode("ascii"),
+        }
+        # Write-then-rename so a concurrent reader never sees a torn file.
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(entry, fh)
+        os.replace(tmp, path)
+
+    def _lookup(self, key: str, description: str) -> Optional[CachedResponse]:
+        if self.mode in ("live", "record"):
+            return None
+        cached = self._load(key, honour_ttl=self.mode == "cache")
+        if cached is not None:
+            self.hits += 1
+            return cached
+        if self.mode == "replay":
+            raise ReplayMiss(f"No recorded {self.namespace} response for {description}")
+        self.misses += 1
+        return None
+
+    # --- requests-style API ----------------------------------------------
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[dict[str, Any]] = None,
+        json: Any = None,
+        **kwargs: Any,
+    ) -> Any:
+        key = self.cache_key(method, url, params, json)
+        cached = self._lookup(key, f"{method.upper()} {_canonical_url(url, params)}")
+        if cached is not None:
+            return cached
+
+        started, status = time.monotonic(), 0
+        try:
+            if self.limiter:
+                with self.limiter.slot(urlsplit(url).netloc):
+                    response = self.session.request(method, url, params=params, json=json, **kwargs)
+            else:
+                response = self.session.request(method, url, params=params, json=json, **kwargs)
+            status = response.status_code
+        finally:
+            self._observe(started, status)
+        if self.mode != "live":
+            self._store(key, method, url, response.status_code, response.headers, response.content)
+        return response
+
+    def get(self, url: str, params: Optional[dict[str, Any]] = None, **kwargs: Any) -> Any:
+        return self.request("GET", url, params=params, **kwargs)
+
+    def post(self, url: str, json: Any = None, **kwargs: Any) -> Any:
+        return self.request("POST", url, json=json, **kwargs)
+
+    # --- Amadeus SDK transport ---------------------------------------------
+
+    def amadeus_transport(self) -> Callable[[UrllibRequest], Any]:
+        """
+        Returns a callable for `amadeus.Client(http=...)`, which hands us a
+        `urllib.request.Request` and expects an HTTPResponse-like object back.
+        The OAuth token call is never cached; in replay and cache mode the SDK
+        gets a synthetic token so that answered requests stay network-free.
+        """
+        token_requests: list[UrllibRequest] = []
+        real_token: dict[str, Any] = {"value": None, "expires_at": 0.0}
+
+        def authorize(http_request: UrllibRequest) -> None:
+            # A cache miss is about to hit the network with the synthetic
+            # token: exchange the SDK's own token request for a real one.
+            if http_request.get_header("Authorization") != f"Bearer {SYNTHETIC_TOKEN}" or not token_requests:
+                return
+            if real_token["value"] is None or time.time() >= real_token["expires_at"]:
+                token = json.loads(urlopen(token_requests[-1]).read())
+                real_token["value"] = token["access_token"]
+                real_token["expires_at"] = time.time() + int(token.get("expires_in", 0)) - 10
+            http_request.add_header("Authorization", f"Bearer {real_token['value']}")
+
+        def transport(http_request: UrllibRequest) -> Any:
+            method = http_request.get_method()
+            url = http_request.full_url
+            if urlsplit(url).path == AMADEUS_TOKEN_PATH:
+                if self.mode in ("replay", "cache"):
+                    token_requests[:] = [http_request]
+                    return _synthetic_token_response()
+                return urlopen(http_request)
+            key = self.cache_key(method, url, body=http_request.data)
+            try:
+                cached = self._lookup(key, f"{method} {_canonical_url(url)}")
+            except ReplayMiss as e:
+                raise URLError(str(e)) from e
+            if cached is not None:
+                return _AmadeusResponse(cached.status_code, cached.headers, cached.content)
+
+            authorize(http_request)
+            started, status = time.monotonic(), 0
+            try:
+                response = urlopen(http_request)
+                body = response.read()
+                status = response.status
+            except HTTPError as e:
+                status = e.code
+                raise
+            finally:
+                self._observe(started, status)
+            headers = dict(response.getheaders())
+            if self.mode != "live":
+                self._store(key, method, url, response.status, headers, body)
+            return _AmadeusResponse(response.status, headers, body)
+
+        return transport
+
+    def _observe(self, started: float, status: int) -> None:
+        if self.run_stats is not None:
+            self.run_stats.observe_request(time.monotonic() - started, status)
+
+    def stats(self) -> str:
+        return f"{self.namespace} cache [{self.mode}]: {self.hits} hits, {self.misses} misses"
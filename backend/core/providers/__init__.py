@@ -0,0 +1,17 @@
+"""
+Flight data provider adapters.
+
+The Amadeus adapter is not re-exported here because it needs the optional
+`amadeus` SDK; import it from `core.providers.amadeus`.
+"""
+
+from .base import ProviderAdapter, ProviderError, SegmentRecord, parse_iso_duration
+from .duffel import DuffelAdapter
+
+__all__ = [
+    "DuffelAdapter",
+    "ProviderAdapter",
+    "ProviderError",
+    "SegmentRecord",
+    "parse_iso_duration",
+]
@@ -0,0 +1,96 @@
+import os
+import time
+from datetime import date
+from typing import Any, Callable, Iterator, Optional
+
+from amadeus import Client, ResponseError
+
+from .base import ProviderAdapter, ProviderError, SegmentRecord, clock_time, parse_iso_duration
+
+MAX_ATTEMPTS = 5
+
+
+class AmadeusAdapter(ProviderAdapter):
+    """
+    Adapter for the (deprecated) Amadeus Self-Service API. The SDK is only
+    needed when this module is imported, which keeps it an optional dependency.
+    """
+
+    name = "amadeus"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._client: Optional[Client] = None
+
+    @property
+    def client(self) -> Client:
+        if self._client is None:
+            self._client = Client(
+                client_id=os.getenv("AMADEUS_API_KEY"),
+                client_secret=os.getenv("AMADEUS_API_SECRET"),
+                http=self.http.amadeus_transport(),
+            )
+        return self._client
+
+    def call(self, request: Callable[[], Any], description: str) -> Any:
+        """Sends an SDK request, retrying (and counting) rate-limited attempts."""
+        for _ in range(MAX_ATTEMPTS):
+            self.api_calls += 1
+            try:
+                return request()
+            except ResponseError as e:
+                if getattr(e.response, "status_code", None) != 429:
+                    raise ProviderError(f"Amadeus {description} failed: {e}") from e
+                self.retries += 1
+                time.sleep(2)
+        raise ProviderError(f"Amadeus kept rate limiting the {description}")
+
+    def direct_destinations(self, origin: str) -> set[str]:
+        response = self.call(
+            lambda: self.client.airport.direct_destinations.get(departureAirportCode=origin),
+            "direct destinations",
+        )
+        return {item["iataCode"] for item in response.data} if response.data else set()
+
+    def segments(self, origin: str, dest: str, day: date) -> Iterator[SegmentRecord]:
+        response = self.call(
+            lambda: self.client.shopping.flight_offers_search.get(
+                originLocationCode=origin,
+                destinationLocationCode=dest,
+                departureDate=day.strftime("%Y-%m-%d"),
+                adults=1,
+                max=10,
+                nonStop="true",
+            ),
+            "offer search",
+        )
+
+        for offer in response.data or []:
+            for itinerary in offer.get("itineraries", []):
+                segments = itinerary.get("segments", [])
+                if len(segments) == 1:
+                    yield self.to_record(segments[0], offer, day)
+
+    def to_record(self, segment: dict[str, Any], offer: dict[str, Any], day: date) -> SegmentRecord:
+        carrier_code = segment["carrierCode"]
+        cabin = (
+            offer.get("travelerPricings", [{}])[0]
+            .get("fareDetailsBySegment", [{}])[0]
+            .get("cabin", "")
+        )
+        return SegmentRecord(
+            carrier_code=carrier_code,
+            carrier_name=f"Airline {carrier_code}",
+            origin=segment["departure"]["iataCode"],
+            destination=segment["arrival"]["iataCode"],
+            date=day,
+            departure_time=clock_time(segment["departure"]["at"]),
+            arrival_time=clock_time(segment["arrival"]["at"]),
+            duration_minutes=parse_iso_duration(segment.get("duration")),
+            flight_number=f"{carrier_code} {segment.get('number', '')}".strip(),
+            aircraft_type=segment.get("aircraft", {}).get("code", ""),
+            price_amount=offer.get("price", {}).get("total"),
+            currency=offer.get("price", {}).get("currency") or "USD",
+            available_seats=offer.get("numberOfBookableSeats"),
+            cabin_class=cabin,
+        )
@@ -0,0 +1,78 @@
+"""
+Provider adapter interface.
+
+Each flight data provider (Duffel, Amadeus, ...) is wrapped in a
+`ProviderAdapter` whose only job is to turn one origin/destination/date
+query into a stream of normalized `SegmentRecord`s. Everything downstream
+(validation, de-duplication, route resolution, the database write) lives in
+`core.pipeline` and is shared by every provider.
+"""
+
+import re
+from abc import ABC, abstractmethod
+from datetime import date
+from typing import Any, Iterator, NamedTuple, Optional
+
+from core.provider_http import ProviderHttp
+
+ISO_HOURS_RE = re.compile(r"(\d+)H")
+ISO_MINUTES_RE = re.compile(r"(\d+)M")
+
+
+class ProviderError(Exception):
+    """A provider query that produced no usable answer (as opposed to an empty one)."""
+
+
+class SegmentRecord(NamedTuple):
+    """One non-stop flight as offered by a provider, in provider-neutral form."""
+
+    carrier_code: str
+    carrier_name: str
+    origin: str
+    destination: str
+    date: date
+    departure_time: str  # "HH:MM", local to the origin
+    arrival_time: str
+    duration_minutes: int
+    flight_number: str
+    aircraft_type: str
+    price_amount: Optional[str]
+    currency: str
+    available_seats: Optional[int]
+    cabin_class: str
+
+
+def parse_iso_duration(iso_str: Any) -> int:
+    """Minutes in an ISO-8601 duration such as "PT2H35M"."""
+    if not iso_str:
+        return 0
+    hours = int(match.group(1)) if (match := ISO_HOURS_RE.search(iso_str)) else 0
+    minutes = int(match.group(1)) if (match := ISO_MINUTES_RE.search(iso_str)) else 0
+    return (hours * 60) + minutes
+
+
+def clock_time(timestamp: str) -> str:
+    """Clock time of an ISO timestamp: 2026-07-01T16:30:00 -> 16:30."""
+    return timestamp.split("T")[1][:5]
+
+
+class ProviderAdapter(ABC):
+    name: str = ""
+
+    def __init__(self, http: Optional[ProviderHttp] = None) -> None:
+        self.http = http or ProviderHttp(self.name)
+        # Every request sent to the provider, retries included.
+        self.api_calls = 0
+        # Requests repeated after the provider rate limited us.
+        self.retries = 0
+
+    @abstractmethod
+    def segments(self, origin: str, dest: str, day: date) -> Iterator[SegmentRecord]:
+        """
+        Yields the non-stop segments the provider offers for the query.
+        Raises ProviderError when the provider could not be asked.
+        """
+
+    def is_configured(self) -> bool:
+        """Whether credentials are available (replay mode never needs them)."""
+        return True
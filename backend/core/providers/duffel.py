@@ -0,0 +1,92 @@
+import os
+import time
+from datetime import date
+from typing import Any, Iterator
+
+from .base import ProviderAdapter, ProviderError, SegmentRecord, clock_time, parse_iso_duration
+
+OFFER_REQUESTS_URL = "https://api.duffel.com/air/offer_requests"
+MAX_ATTEMPTS = 5
+# Standardized availability assumption for the Stitcher: Duffel offers do not
+# expose a seat count.
+DEFAULT_SEATS = 9
+
+
+class DuffelAdapter(ProviderAdapter):
+    name = "duffel"
+
+    def is_configured(self) -> bool:
+        return self.http.mode == "replay" or bool(os.getenv("DUFFEL_ACCESS_TOKEN"))
+
+    def headers(self) -> dict[str, str]:
+        return {
+            "Authorization": f"Bearer {os.getenv('DUFFEL_ACCESS_TOKEN')}",
+            "Duffel-Version": "v2",
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+
+    def offers(self, origin: str, dest: str, day: date) -> list[dict[str, Any]]:
+        payload = {
+            "data": {
+                "slices": [
+                    {
+                        "origin": origin,
+                        "destination": dest,
+                        "departure_date": day.strftime("%Y-%m-%d"),
+                    }
+                ],
+                "passengers": [{"type": "adult"}],
+                "max_connections": 0,
+            }
+        }
+        for _ in range(MAX_ATTEMPTS):
+            self.api_calls += 1
+            try:
+                res = self.http.post(OFFER_REQUESTS_URL, json=payload, headers=self.headers())
+            except Exception as e:
+                raise ProviderError(f"Duffel request failed: {e}") from e
+            if res.status_code == 429:
+                self.retries += 1
+                time.sleep(2)
+                continue
+            if res.status_code >= 400:
+                raise ProviderError(f"Duffel returned HTTP {res.status_code}")
+            return (res.json().get("data") or {}).get("offers", [])
+        raise ProviderError("Duffel kept rate limiting the request")
+
+    def segments(self, origin: str, dest: str, day: date) -> Iterator[SegmentRecord]:
+        for offer in self.offers(origin, dest, day):
+            for slice_obj in offer.get("slices", []):
+                segments = slice_obj.get("segments", [])
+                if len(segments) == 1:
+                    yield self.to_record(segments[0], offer, day)
+
+    def to_record(self, segment: dict[str, Any], offer: dict[str, Any], day: date) -> SegmentRecord:
+        # Null JSON objects fall back to {}
+        op_carrier = segment.get("operating_carrier") or {}
+        mkt_carrier = segment.get("marketing_carrier") or {}
+        aircraft_data = segment.get("aircraft") or {}
+
+        carrier_code = op_carrier.get("iata_code") or mkt_carrier.get("iata_code", "UNK")
+        flight_num = segment.get("operating_carrier_flight_number") or segment.get(
+            "marketing_carrier_flight_number", ""
+        )
+        cabin = (segment.get("passengers") or [{}])[0].get("cabin_class", "economy")
+
+        return SegmentRecord(
+            carrier_code=carrier_code,
+            carrier_name=op_carrier.get("name", f"Airline {carrier_code}"),
+            origin=segment["origin"]["iata_code"],
+            destination=segment["destination"]["iata_code"],
+            date=day,
+            departure_time=clock_time(segment["departing_at"]),
+            arrival_time=clock_time(segment["arriving_at"]),
+            duration_minutes=parse_iso_duration(segment.get("duration")),
+            flight_number=f"{carrier_code} {flight_num}".strip(),
+            aircraft_type=aircraft_data.get("iata_code", ""),
+            price_amount=offer.get("total_amount"),
+            currency=offer.get("total_currency") or "USD",
+            available_seats=DEFAULT_SEATS,
+            cabin_class=cabin,
+        )
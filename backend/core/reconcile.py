@@ -0,0 +1,351 @@
+"""
+Diff-based reconciliation of freshly scraped rows against the database.
+
+Ingest commands used to wipe a slice of FlightInstance/Sailing rows and
+recreate it from scratch on every run. Instead, the ingesters now build the
+fresh rows in memory and hand them to `reconcile()`, which compares them with
+the current rows by natural key and only issues the INSERTs, UPDATEs and
+DELETEs that are actually required. The returned `ChangeSet` describes exactly
+what moved so that caches can be invalidated selectively.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Iterable, Optional, Sequence
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import cache
+from .legs import group_of, leg_key, location_groups
+from .models import FlightInstance, Route, Sailing
+from .snapfile import file_path as snapfile_path
+from .snapfile import publish as publish_snapfile
+from .snapshot import publish as publish_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Natural keys and the mutable columns compared on each model.
+FLIGHT_KEY = ("route_id", "date")
+# `is_projected` is compared so a real row overwrites a projection in place.
+FLIGHT_FIELDS = ("price_amount", "currency", "available_seats", "cabin_class", "is_projected")
+
+SAILING_KEY = ("route_id", "date", "departure_time")
+SAILING_FIELDS = ("arrival_time", "duration_minutes", "price_text")
+
+
+@dataclass
+class ChangeSet:
+    """
+    The outcome of a reconciliation pass.
+
+    Keys are the natural keys of the affected rows. `routes` maps every touched
+    route id to its (origin code, destination code) pair so callers can work out
+    which cached O/D pairs went stale without another query.
+    """
+
+    inserted: list[tuple[Any, ...]] = field(default_factory=list)
+    updated: list[tuple[Any, ...]] = field(default_factory=list)
+    deleted: list[tuple[Any, ...]] = field(default_factory=list)
+    unchanged: int = 0
+    routes: dict[int, tuple[str, str]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted)
+
+    def merge(self, other: "ChangeSet") -> "ChangeSet":
+        self.inserted.extend(other.inserted)
+        self.updated.extend(other.updated)
+        self.deleted.extend(other.deleted)
+        self.unchanged += other.unchanged
+        self.routes.update(other.routes)
+        return self
+
+    @property
+    def changed_keys(self) -> list[tuple[Any, ...]]:
+        return self.inserted + self.updated + self.deleted
+
+    @property
+    def affected_dates(self) -> set[date]:
+        return {key[1] for key in self.changed_keys}
+
+    @property
+    def affected_pairs(self) -> set[tuple[str, str]]:
+        """(origin code, destination code) pairs with at least one changed row."""
+        route_ids = {key[0] for key in self.changed_keys}
+        return {self.routes[r] for r in route_ids if r in self.routes}
+
+    def summary(self) -> str:
+        return (
+            f"+{len(self.inserted)} ~{len(self.updated)} -{len(self.deleted)} "
+            f"={self.unchanged}"
+        )
+
+
+def _key(obj: models.Model, key_fields: Sequence[str]) -> tuple[Any, ...]:
+    return tuple(getattr(obj, f) for f in key_fields)
+
+
+def _normalize(model: type[models.Model], name: str, value: Any) -> Any:
+    # Scrapers hand us strings ("14:20", "199.99"); the DB hands back typed
+    # values. Run both through the field's own parser before comparing.
+    if value is None:
+        return None
+    return model._meta.get_field(name).to_python(value)
+
+
+def reconcile(
+    model: type[models.Model],
+    existing: "models.QuerySet[Any]",
+    fresh: Iterable[models.Model],
+    key_fields: Sequence[str],
+    compare_fields: Sequence[str],
+) -> ChangeSet:
+    """
+    Brings `existing` (the scope a scrape is authoritative for) in line with
+    `fresh` (unsaved instances) using the minimum number of writes.
+
+    - Fresh rows whose natural key is missing are bulk inserted.
+    - Fresh rows whose key exists but whose `compare_fields` differ are bulk updated.
+    - Existing rows that no longer appear in the scrape are deleted.
+
+    Duplicate keys in `fresh` resolve last-wins, matching the old
+    `update_or_create` loop.
+    """
+    fresh_by_key: dict[tuple[Any, ...], models.Model] = {}
+    for obj in fresh:
+        for name in (*key_fields[1:], *compare_fields):
+            setattr(obj, name, _normalize(model, name, getattr(obj, name)))
+        fresh_by_key[_key(obj, key_fields)] = obj
+
+    changes = ChangeSet()
+    to_create: list[models.Model] = []
+    to_update: list[models.Model] = []
+    to_touch: list[int] = []
+
+    with transaction.atomic():
+        current = {_key(obj, key_fields): obj for obj in existing.select_for_update()}
+
+        for key, obj in fresh_by_key.items():
+            row = current.pop(key, None)
+            if row is None:
+                to_create.append(obj)
+                changes.inserted.append(key)
+                continue
+
+            dirty = False
+            for name in compare_fields:
+                new_value = getattr(obj, name)
+                if getattr(row, name) != new_value:
+                    setattr(row, name, new_value)
+                    dirty = True
+            if dirty:
+                to_update.append(row)
+                changes.updated.append(key)
+            else:
+                to_touch.append(row.pk)
+                changes.unchanged += 1
+
+        stale = list(current.keys())
+        if stale:
+            model.objects.filter(pk__in=[row.pk for row in current.values()]).delete()
+            changes.deleted.extend(stale)
+
+        if to_create:
+            model.objects.bulk_create(to_create)
+
+        extra_fields = _touch_fields(model)
+        if to_update:
+            now = timezone.now()
+            for row in to_update:
+                for name in extra_fields:
+                    setattr(row, name, now)
+            model.objects.bulk_update(to_update, [*compare_fields, *extra_fields])
+
+        # Rows that were confirmed but did not change only get their
+        # "last seen" timestamp bumped in a single statement.
+        if to_touch and extra_fields:
+            model.objects.filter(pk__in=to_touch).update(
+                **{name: timezone.now() for name in extra_fields}
+            )
+
+    route_ids = {key[0] for key in changes.changed_keys}
+    if route_ids:
+        changes.routes = {
+            r_id: (o, d)
+            for r_id, o, d in Route.objects.filter(pk__in=route_ids).values_list(
+                "pk", "origin__code", "destination__code"
+            )
+        }
+    return changes
+
+
+def _touch_fields(model: type[models.Model]) -> list[str]:
+    # `auto_now` is not applied by bulk_update()/update(), so do it by hand.
+    return [
+        f.name
+        for f in model._meta.concrete_fields
+        if getattr(f, "auto_now", False)
+    ]
+
+
+def reconcile_flights(
+    existing: "models.QuerySet[FlightInstance]", fresh: Iterable[FlightInstance]
+) -> ChangeSet:
+    return reconcile(FlightInstance, existing, fresh, FLIGHT_KEY, FLIGHT_FIELDS)
+
+
+def flight_scope(
+    origin: str, dest: str, day: date, fresh: Iterable[FlightInstance]
+) -> "models.QuerySet[FlightInstance]":
+    """
+    The rows a single origin/destination/date provider response is
+    authoritative for: everything stored under the requested codes, plus the
+    rows of every route the response returned. The latter matters when a
+    metro code (NYC) comes back as JFK/EWR legs, and when the stored row for a
+    returned flight is a projection waiting to be replaced.
+    """
+    return FlightInstance.objects.filter(
+        Q(route__origin__code=origin, route__destination__code=dest)
+        | Q(route_id__in={obj.route_id for obj in fresh}),
+        date=day,
+    )
+
+
+def route_changes(
+    route_ids: Iterable[int], exclude: Iterable[tuple[Any, ...]] = ()
+) -> ChangeSet:
+    """
+    A change set marking every upcoming flight of the routes as updated, for
+    route template edits (times, active flag) that leave the rows untouched.
+    Keys already in `exclude` are left out.
+    """
+    exclude = set(exclude)
+    changes = ChangeSet()
+    rows = FlightInstance.objects.filter(
+        route_id__in=route_ids, date__gte=timezone.localdate()
+    ).values_list("route_id", "date", "route__origin__code", "route__destination__code")
+    for route_id, day, origin, dest in rows:
+        if (route_id, day) not in exclude:
+            changes.routes[route_id] = (origin, dest)
+            changes.updated.append((route_id, day))
+    return changes
+
+
+def task_changes(tasks: Iterable[tuple[str, str, date]]) -> ChangeSet:
+    """
+    A change set covering every route stored under the (origin, destination,
+    date) tasks, matching metro codes through the airports' parents. Used by a
+    resumed run for tasks whose rows an interrupted run wrote but never passed
+    on to `refresh_connections` / `invalidate_caches`.
+    """
+    tasks = set(tasks)
+    codes = {o for o, _, _ in tasks} | {d for _, d, _ in tasks}
+    changes = ChangeSet()
+    if not tasks:
+        return changes
+    routes = Route.objects.filter(
+        Q(origin__code__in=codes) | Q(origin__parent__code__in=codes),
+        Q(destination__code__in=codes) | Q(destination__parent__code__in=codes),
+    ).values_list(
+        "id", "origin__code", "origin__parent__code", "destination__code", "destination__parent__code"
+    )
+    for route_id, origin, origin_parent, dest, dest_parent in routes:
+        for o, d, day in tasks:
+            if o in (origin, origin_parent) and d in (dest, dest_parent):
+                changes.routes[route_id] = (origin, dest)
+                changes.updated.append((route_id, day))
+    return changes
+
+
+def reconcile_sailings(
+    existing: "models.QuerySet[Sailing]", fresh: Iterable[Sailing]
+) -> ChangeSet:
+    return reconcile(Sailing, existing, fresh, SAILING_KEY, SAILING_FIELDS)
+
+
+def invalidate_caches(changes: ChangeSet) -> int:
+    """
+    Drops only the cached responses that can observe the change set.
+
+    Date calendars and direct searches are keyed by the alias groups of the
+    O/D pair, so the matching `prop_dates_*` / `prop_search_*` keys are
+    removed for the search windows (4 days) that contain a changed date, along
+    with the changed day's `out` leg set of the origin group and `in` leg set
+    of the destination group (core/legs.py). Connection responses through
+    arbitrary hubs are not enumerable and keep their short TTL, but the legs
+    they are rebuilt from are fresh. Network snapshots (core/snapshot.py) are
+    told to rebuild; the snapshot file (core/snapfile.py) is written by the
+    ingest run before its last invalidation (see `SnapshotFileBatch`). An
+    empty change set invalidates nothing.
+    """
+    if not changes:
+        return 0
+    dropped = _drop_cached(changes)
+    publish_snapshot()
+    logger.info(f"Invalidated {dropped} cache keys ({changes.summary()})")
+    return dropped
+
+
+def _drop_cached(changes: ChangeSet) -> int:
+    """Deletes the cache keys that can observe `changes`; returns how many."""
+    stale = {
+        (*changes.routes[key[0]], key[1])
+        for key in changes.changed_keys
+        if key[0] in changes.routes
+    }
+    groups = location_groups()
+
+    keys: set[str] = set()
+    for origin, dest, day in stale:
+        o, d = group_of(origin, groups), group_of(dest, groups)
+        keys.add(leg_key("out", o, day))
+        keys.add(leg_key("in", d, day))
+        keys.add(f"prop_dates_{o}_{d}")
+        for offset in range(4):
+            date_str = (day - timedelta(days=offset)).strftime("%Y-%m-%d")
+            for transport_filter in ("all", "flight", "ferry"):
+                keys.add(f"prop_search_{o}_{d}_{date_str}_{transport_filter}")
+
+    cache.delete_many(list(keys))
+    return len(keys)
+
+
+class SnapshotFileBatch:
+    """
+    Rewrites the snapshot file for a long-running ingester, at most every
+    `NETWORK_SNAPSHOT_FILE_BATCH` change sets or `NETWORK_SNAPSHOT_FILE_MAX_DELAY`
+    seconds instead of after every job. Each change set is still invalidated
+    when it lands, so under the mapped engine responses can be rebuilt off the
+    old file in between: `flush()` drops the caches of everything it wrote
+    once more, after the new file is in place.
+    """
+
+    def __init__(self, every: Optional[int] = None, max_delay: Optional[float] = None) -> None:
+        self.every = every or settings.NETWORK_SNAPSHOT_FILE_BATCH
+        self.max_delay = max_delay if max_delay is not None else settings.NETWORK_SNAPSHOT_FILE_MAX_DELAY
+        self.pending = ChangeSet()
+        self.batched = 0
+        self.since = time.monotonic()
+
+    def add(self, changes: ChangeSet) -> None:
+        if changes and snapfile_path() is not None:
+            if not self.pending:
+                self.since = time.monotonic()
+            self.pending.merge(changes)
+            self.batched += 1
+        if self.pending and (
+            self.batched >= self.every or time.monotonic() - self.since >= self.max_delay
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        publish_snapfile()
+        _drop_cached(self.pending)
+        self.pending, self.batched = ChangeSet(), 0
@@ -0,0 +1,192 @@
+"""
+Replay of recorded production traffic.
+
+Gunicorn writes every request to `gunicorn-access.log` in its default
+format:
+
+    1.2.3.4 - - [19/Oct/2026:14:02:03 +0000] "GET /api/routes/search/?origin=SXM&... HTTP/1.1" 200 5123 "-" "Mozilla/5.0"
+
+`parse_log` extracts the `/api/` requests from such logs and `Replayer`
+sends them to another instance, at their recorded inter-arrival times
+divided by `speed` (0 sends them as fast as the workers allow) on
+`concurrency` threads. Only GET and HEAD requests are replayed: a recorded
+POST carries no body in the log, and replaying it would create rows.
+
+`ReplayReport` aggregates throughput, latency percentiles, status and error
+rates, the `X-Cache` hit ratio of the cached endpoints (see
+`views.CachedResponseMixin`) and how far the replay fell behind schedule,
+overall and per endpoint, so a cache or engine change can be validated
+against a realistic traffic mix offline.
+"""
+
+import gzip
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+import requests
+
+from .runstats import percentile
+
+LOG_LINE = re.compile(
+    r'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<target>\S+)[^"]*" (?P<status>\d{3}) '
+)
+LOG_TIME_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+REPLAYED_METHODS = ("GET", "HEAD")
+# /api/routes/123/ and /api/routes/456/ are the same endpoint.
+NUMERIC_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+class LoggedRequest(NamedTuple):
+    at: datetime
+    method: str
+    target: str
+    status: int
+
+
+class Outcome(NamedTuple):
+    endpoint: str
+    status: int  # 0: no response (connection error or timeout)
+    seconds: float
+    cache: Optional[str]
+    lag: float
+
+
+def endpoint_of(target: str) -> str:
+    return NUMERIC_SEGMENT.sub("/{id}", target.split("?", 1)[0])
+
+
+def read_lines(path: Path) -> Iterator[str]:
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", errors="replace") as fh:  # type: ignore[operator]
+        yield from fh
+
+
+def parse_log(lines: Iterable[str], prefix: str = "/api/") -> Iterator[LoggedRequest]:
+    """The replayable requests under `prefix`; unparsable lines are skipped."""
+    for line in lines:
+        match = LOG_LINE.match(line)
+        if not match or match["method"] not in REPLAYED_METHODS or not match["target"].startswith(prefix):
+            continue
+        try:
+            at = datetime.strptime(match["time"], LOG_TIME_FORMAT)
+        except ValueError:
+            continue
+        yield LoggedRequest(at, match["method"], match["target"], int(match["status"]))
+
+
+@dataclass
+class ReplayReport:
+    outcomes: list[Outcome] = field(default_factory=list)
+    wall_seconds: float = 0.0
+
+    @staticmethod
+    def summarize(outcomes: list[Outcome], wall_seconds: float) -> dict[str, Any]:
+        latencies = [o.seconds * 1000 for o in outcomes]
+        statuses = Counter(o.status for o in outcomes)
+        errors = sum(n for status, n in statuses.items() if status == 0 or status >= 500)
+        cached = [o.cache for o in outcomes if o.cache]
+        return {
+            "requests": len(outcomes),
+            "throughput_rps": round(len(outcomes) / wall_seconds, 2) if wall_seconds else None,
+            "latency_ms": {
+                name: round(value, 1) if value is not None else None
+                for name, value in (
+                    ("p50", percentile(latencies, 50)),
+                    ("p90", percentile(latencies, 90)),
+                    ("p99", percentile(latencies, 99)),
+                    ("max", max(latencies, default=None)),
+                )
+            },
+            "statuses": {str(status): n for status, n in sorted(statuses.items())},
+            "error_rate": round(errors / len(outcomes), 4) if outcomes else 0.0,
+            "client_error_rate": (
+                round(sum(n for s, n in statuses.items() if 400 <= s < 500) / len(outcomes), 4)
+                if outcomes
+                else 0.0
+            ),
+            "cache_hit_ratio": round(cached.count("HIT") / len(cached), 4) if cached else None,
+            "max_lag_ms": round(max((o.lag for o in outcomes), default=0.0) * 1000, 1),
+        }
+
+    def as_dict(self) -> dict[str, Any]:
+        by_endpoint: defaultdict[str, list[Outcome]] = defaultdict(list)
+        for outcome in self.outcomes:
+            by_endpoint[outcome.endpoint].append(outcome)
+        return {
+            "wall_seconds": round(self.wall_seconds, 3),
+            **self.summarize(self.outcomes, self.wall_seconds),
+            "endpoints": {
+                endpoint: self.summarize(outcomes, self.wall_seconds)
+                for endpoint, outcomes in sorted(by_endpoint.items(), key=lambda item: -len(item[1]))
+            },
+        }
+
+
+class Replayer:
+    def __init__(
+        self,
+        base_url: str,
+        speed: float = 1.0,
+        concurrency: int = 8,
+        timeout: float = 30.0,
+        send: Optional[Callable[[str, str], requests.Response]] = None,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.speed = speed
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.send = send or self._send
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def _send(self, method: str, url: str) -> requests.Response:
+        # One keep-alive session per worker thread.
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session.request(method, url, timeout=self.timeout, allow_redirects=False)
+
+    def _replay_one(self, logged: LoggedRequest, due: float, report: ReplayReport) -> None:
+        started = time.monotonic()
+        status, cache = 0, None
+        try:
+            response = self.send(logged.method, self.base_url + logged.target)
+            status, cache = response.status_code, response.headers.get("X-Cache")
+        except requests.RequestException:
+            pass
+        outcome = Outcome(
+            endpoint_of(logged.target), status, time.monotonic() - started, cache, max(started - due, 0.0)
+        )
+        with self.lock:
+            report.outcomes.append(outcome)
+
+    def run(self, logged: Iterable[LoggedRequest], progress: Optional[Callable[[int], None]] = None) -> ReplayReport:
+        """Replays `logged` (in log order) on the worker pool and waits for every response."""
+        report = ReplayReport()
+        started = time.monotonic()
+        first: Optional[datetime] = None
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for n, request in enumerate(logged, 1):
+                first = first or request.at
+                if self.speed > 0:
+                    due = started + max((request.at - first).total_seconds(), 0.0) / self.speed
+                    if due > time.monotonic():
+                        time.sleep(due - time.monotonic())
+                else:
+                    # Lag is then the time spent queued behind busy workers.
+                    due = time.monotonic()
+                futures.append(pool.submit(self._replay_one, request, due, report))
+                if progress:
+                    progress(n)
+        report.wall_seconds = time.monotonic() - started
+        for future in futures:
+            future.result()  # Surface anything but a failed request.
+        return report
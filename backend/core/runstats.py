@@ -0,0 +1,209 @@
+"""
+Structured metrics of one ingest run.
+
+The ingest commands used to leave nothing behind but their emoji progress
+lines and the `api_calls` tally. `RunStats` collects what is needed to
+diagnose a slow or expensive sweep after the fact:
+
+- provider latency of the requests that went to the network (cache hits
+  excluded), reported as p50/p90/p99/max over the latest `LATENCY_WINDOW`
+  of them, with the HTTP statuses seen, 429s and the retries they caused,
+- rows inserted, updated and deleted,
+- wall time split into network, parse and DB phases. A phase's own time
+  excludes the network time spent inside it on the same thread, so lazily
+  consumed provider streams are not counted twice,
+- peak traced memory (tracemalloc, `INGEST_TRACE_MEMORY`, off by default).
+
+`close()` stores the summary on the `IngestRun` (`metrics`) and, when
+`INGEST_METRICS_TEXTFILE_DIR` is set, writes it as a Prometheus textfile
+(`prop_ingest_<command>.prom`) for the node exporter's textfile collector.
+Long-running commands never reach the end of a run: they `checkpoint()` the
+summary after every job and close the run in a `finally`, with
+`exit_on_sigterm()` so that `docker stop` unwinds to it.
+"""
+
+import logging
+import math
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from django.conf import settings
+from prometheus_client import CollectorRegistry, Gauge, write_to_textfile
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("network", "parse", "db")
+# Latencies kept for the percentiles; a daemon's run would otherwise grow forever.
+LATENCY_WINDOW = 10_000
+
+
+def percentile(values: list[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of `values`, or None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+class RunStats:
+    def __init__(self) -> None:
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.statuses: Counter[int] = Counter()
+        self.rows: Counter[str] = Counter()
+        self.phases: defaultdict[str, float] = defaultdict(float)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.monotonic()
+        self.tracing = False
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        if getattr(settings, "INGEST_TRACE_MEMORY", False) and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+    def observe_request(self, seconds: float, status: int) -> None:
+        """One provider request that went to the network (status 0: no response)."""
+        self.local.network = getattr(self.local, "network", 0.0) + seconds
+        with self.lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+            self.statuses[status] += 1
+            self.phases["network"] += seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        network_before = getattr(self.local, "network", 0.0)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            network = getattr(self.local, "network", 0.0) - network_before
+            with self.lock:
+                self.phases[name] += max(elapsed - network, 0.0)
+
+    def add_changes(self, changes: Any) -> None:
+        with self.lock:
+            self.rows["inserted"] += len(changes.inserted)
+            self.rows["updated"] += len(changes.updated)
+            self.rows["deleted"] += len(changes.deleted)
+            self.rows["unchanged"] += changes.unchanged
+
+    def summary(self, retries: int = 0) -> dict[str, Any]:
+        peak = None
+        if tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1] // 1024
+        with self.lock:
+            latencies_ms = [s * 1000 for s in self.latencies]
+        return {
+            "wall_seconds": round(time.monotonic() - self.started, 3),
+            "requests": self.requests,
+            "latency_ms": {
+                name: round(value, 1) if value is not None else None
+                for name, value in (
+                    ("p50", percentile(latencies_ms, 50)),
+                    ("p90", percentile(latencies_ms, 90)),
+                    ("p99", percentile(latencies_ms, 99)),
+                    ("max", max(latencies_ms, default=None)),
+                )
+            },
+            "statuses": {str(status): n for status, n in sorted(self.statuses.items())},
+            "rate_limited": self.statuses[429],
+            "retries": retries,
+            "rows": {name: self.rows[name] for name in ("inserted", "updated", "deleted", "unchanged")},
+            "phase_seconds": {name: round(self.phases[name], 3) for name in PHASES},
+            "peak_memory_kb": peak,
+        }
+
+    def checkpoint(self, run: Any, api_calls: Optional[int] = None, retries: int = 0) -> dict[str, Any]:
+        """Stores and exports the summary so far without finishing `run`."""
+        metrics = self.summary(retries)
+        if api_calls is not None:
+            run.api_calls = api_calls
+        run.metrics = metrics
+        run.save(update_fields=["api_calls", "metrics"])
+        self.export(run, metrics)
+        return metrics
+
+    def close(self, run: Any, api_calls: Optional[int] = None, retries: int = 0) -> dict[str, Any]:
+        """Finishes `run` with this run's summary and exports it; stops tracing if we started it."""
+        metrics = self.summary(retries)
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        run.finish(api_calls, metrics=metrics)
+        self.export(run, metrics)
+        return metrics
+
+    def export(self, run: Any, metrics: dict[str, Any]) -> None:
+        directory = getattr(settings, "INGEST_METRICS_TEXTFILE_DIR", "")
+        if directory:
+            try:
+                write_textfile(Path(directory) / f"prop_ingest_{run.command}.prom", run.command, metrics)
+            except OSError as e:
+                logger.error(f"Could not write ingest metrics textfile: {e}")
+
+    def describe(self, metrics: dict[str, Any]) -> str:
+        phases = ", ".join(f"{name} {metrics['phase_seconds'][name]:.1f}s" for name in PHASES)
+        p50, p99 = (metrics["latency_ms"][q] for q in ("p50", "p99"))
+        peak = metrics["peak_memory_kb"]
+        return (
+            f"{metrics['requests']} requests (p50 {p50 if p50 is not None else '-'} ms, "
+            f"p99 {p99 if p99 is not None else '-'} ms, {metrics['rate_limited']} rate limited, "
+            f"{metrics['retries']} retries); {phases}"
+            + (f"; peak memory {peak / 1024:.1f} MiB" if peak is not None else "")
+        )
+
+
+def exit_on_sigterm() -> None:
+    """Turns SIGTERM (`docker stop`) into SystemExit so `finally` blocks still run."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def write_textfile(path: Path, command: str, metrics: dict[str, Any]) -> None:
+    """Writes `metrics` in the Prometheus text format (atomically, via a temp file)."""
+    registry = CollectorRegistry()
+
+    def gauge(name: str, doc: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return Gauge(name, doc, ["command", *labels], registry=registry)
+
+    gauge("prop_ingest_last_run_timestamp_seconds", "When the last run finished.").labels(
+        command
+    ).set(time.time())
+    gauge("prop_ingest_duration_seconds", "Wall time of the last run.").labels(command).set(
+        metrics["wall_seconds"]
+    )
+    latency = gauge("prop_ingest_provider_latency_seconds", "Provider request latency.", ("quantile",))
+    for name, value in metrics["latency_ms"].items():
+        if value is not None:
+            latency.labels(command, {"p50": "0.5", "p90": "0.9", "p99": "0.99", "max": "1"}[name]).set(
+                value / 1000
+            )
+    requests = gauge("prop_ingest_provider_requests", "Provider requests by HTTP status.", ("status",))
+    for status, n in metrics["statuses"].items():
+        requests.labels(command, status).set(n)
+    gauge("prop_ingest_retries", "Requests repeated after a rate limit.").labels(command).set(
+        metrics["retries"]
+    )
+    rows = gauge("prop_ingest_rows", "Rows written by the last run.", ("change",))
+    for change, n in metrics["rows"].items():
+        rows.labels(command, change).set(n)
+    phases = gauge("prop_ingest_phase_seconds", "Time per phase of the last run.", ("phase",))
+    for phase, seconds in metrics["phase_seconds"].items():
+        phases.labels(command, phase).set(seconds)
+    if metrics["peak_memory_kb"] is not None:
+        gauge("prop_ingest_peak_memory_bytes", "Peak traced memory of the last run.").labels(
+            command
+        ).set(metrics["peak_memory_kb"] * 1024)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_to_textfile(str(path), registry)
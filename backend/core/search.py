@@ -0,0 +1,487 @@
+"""
+Itinerary search engines behind `RouteViewSet.search`.
+
+The engines answer the same question -- the direct and two-leg itineraries
+from one set of location codes to another, on the first day of a 4-day window
+that has any -- and return identical results:
+
+- `PythonSearchEngine` loads every candidate leg-1 and leg-2 departure in the
+  window and pairs them up in Python; the candidates come from the
+  preloaded network snapshot (core/snapshot.py) when enabled, otherwise from
+  the leg-level cache in core/legs.py, shared with every search touching the
+  same groups,
+- `SqlSearchEngine` pushes the pairing into the database as one parameterized
+  CTE that joins the legs on alias group and applies the connection-time rules
+  there, so only valid pairs come back,
+- `MaterializedSearchEngine` reads the pairs from the `ValidConnection` table
+  the ingesters maintain (core/connections.py): one indexed lookup by
+  (origin group, destination group, date),
+- `MappedSearchEngine` pairs the legs on the arrays of the memory-mapped
+  snapshot file ingest writes (core/snapfile.py).
+
+The engine is chosen per request with `?engine=` or by the `SEARCH_ENGINE`
+setting; `bench_search` compares them on live data. Every engine times its
+stages into `prop_search_stage_seconds` (core/metrics.py).
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Iterable, Optional
+
+from django.conf import settings
+from django.db import connection
+
+from .legs import BOOKABLE_FLIGHTS, LEG_RELATIONS, Leg, window_legs
+from .metrics import SEARCH_CANDIDATES, SEARCH_PAIRS, SEARCH_STAGE_SECONDS, record_cache
+from .models import FlightInstance, Location, Sailing, ValidConnection
+from .serializers import ItineraryLegSerializer
+from .snapfile import FLIGHT, SAILING, MappedNetwork
+from .snapfile import NULL as SNAPFILE_NULL
+from .snapfile import current as current_snapfile
+from .snapshot import current as current_snapshot
+
+# We define acceptable connection times based on the mode of transport
+MIN_CONNECT_FLIGHT = 3600  # 1 Hour: Minimum time to connect plane-to-plane
+MIN_CONNECT_FERRY = 7200  # 2 Hours: Minimum time to connect plane-to-ferry (accounts for port transit)
+MAX_CONNECT = 64800  # 18 Hours: Max layover time before we consider it two separate trips
+
+# Days scanned from the requested date; the data window reaches one day further
+# so a late flight on the last day may connect to an early ferry on the next.
+WINDOW_DAYS = 4
+
+
+@dataclass
+class SearchResult:
+    results: list[dict[str, Any]]
+    found_date: date
+    date_was_changed: bool
+
+
+def direct_itinerary(leg: Leg) -> dict[str, Any]:
+    prefix = "s" if isinstance(leg, Sailing) else "f"
+    return {"id": f"{prefix}_{leg.id}", "legs": [ItineraryLegSerializer(leg).data]}
+
+
+def connection_itinerary(l1: FlightInstance, l2: Leg, gap: float) -> dict[str, Any]:
+    l1_data = ItineraryLegSerializer(l1).data
+    l2_data = ItineraryLegSerializer(l2).data
+    hours, mins = int(gap // 3600), int((gap % 3600) // 60)
+    city = l1.route.destination.city
+
+    # Dynamically flag if the layover spills into the next day
+    if isinstance(l2, Sailing):
+        if l1.date != l2.date:
+            l1_data["layover_text"] = f"🌙 Overnight Layover: {hours}h {mins}m in {city} • Connect via Ferry"
+        else:
+            l1_data["layover_text"] = f"⛴️ {hours}h {mins}m Layover in {city} • Connect via Ferry"
+        return {"id": f"c_fs_{l1.id}_{l2.id}", "legs": [l1_data, l2_data]}
+
+    if l1.date != l2.date:
+        l1_data["layover_text"] = f"🌙 Overnight Layover: {hours}h {mins}m in {city} • Connect via Flight"
+    else:
+        l1_data["layover_text"] = f"✈️ {hours}h {mins}m Layover in {city} • Connect via Flight"
+    return {"id": f"c_ff_{l1.id}_{l2.id}", "legs": [l1_data, l2_data]}
+
+
+class PythonSearchEngine:
+    """Pairs the legs in Python: the original `RouteViewSet.search` algorithm."""
+
+    name = "python"
+
+    def __init__(self, origin_aliases: Iterable[str], dest_aliases: Iterable[str], target_date: date) -> None:
+        self.origin_aliases = list(origin_aliases)
+        self.dest_aliases = list(dest_aliases)
+        self.target_date = target_date
+        self.end_date = target_date + timedelta(days=WINDOW_DAYS)
+        # The preloaded network (core/snapshot.py), when it holds the whole window.
+        snapshot = current_snapshot()
+        covered = snapshot is not None and snapshot.covers(self.target_date, self.end_date)
+        self.snapshot = snapshot if covered else None
+        if snapshot is not None:
+            record_cache("snapshot", covered)
+
+    def stage(self, name: str) -> Any:
+        """Context manager timing one search stage of this engine."""
+        return SEARCH_STAGE_SECONDS.labels(name, self.name).time()
+
+    def legs(self, direction: str, aliases: list[str]) -> list[Leg]:
+        if self.snapshot is not None:
+            group = self.snapshot.group_of(aliases[0])
+            return self.snapshot.window(direction, group, self.target_date, self.end_date)
+        return window_legs(direction, aliases, self.target_date, self.end_date)
+
+    def departures(self) -> list[FlightInstance]:
+        """Bookable flights leaving the origin group in the window (cached per group and day)."""
+        return self.legs("out", self.origin_aliases)  # type: ignore[return-value]
+
+    def arrivals(self) -> list[Leg]:
+        """Bookable flights and sailings reaching the destination group in the window."""
+        return self.legs("in", self.dest_aliases)
+
+    def hub_aliases(self, hub_codes: set[str]) -> dict[str, set[str]]:
+        """The aliases of every hub code, resolved once per search."""
+        if self.snapshot is not None and hub_codes <= self.snapshot.aliases.keys():
+            return {code: set(self.snapshot.aliases[code]) for code in hub_codes}
+        return {
+            loc.code: set(loc.resolve_aliases())
+            for loc in Location.objects.filter(code__in=hub_codes)
+            .select_related("parent")
+            .prefetch_related("sub_locations", "parent__sub_locations")
+        }
+
+    def direct_legs(self) -> tuple[list[FlightInstance], list[Sailing]]:
+        # Find direct flights or ferries between the origin and destination directly.
+        origins, dests = set(self.origin_aliases), set(self.dest_aliases)
+        flights = [f for f in self.departures() if f.route.destination.code in dests]
+        ferries = [
+            s for s in self.arrivals() if isinstance(s, Sailing) and s.route.origin.code in origins
+        ]
+        return flights, ferries
+
+    def connections(self) -> list[tuple[FlightInstance, Leg, float]]:
+        """Every valid (leg 1, leg 2, gap in seconds) pair in the window, in leg-1 order."""
+        # Get all flights departing from the origin that do NOT go straight to the destination.
+        # These are potential "Leg 1" flights landing at a hub.
+        dests = set(self.dest_aliases)
+        with self.stage("leg1"):
+            leg1_flights = [f for f in self.departures() if f.route.destination.code not in dests]
+
+            # Expand the hubs these flights land at to include their aliases
+            # (e.g. an airport and a nearby ferry port).
+            hub_aliases = self.hub_aliases({f.route.destination.code for f in leg1_flights})
+            expanded_hubs = set().union(*hub_aliases.values())
+
+        # Get all flights and ferries that depart from these expanded hubs and go to the final destination.
+        with self.stage("leg2"):
+            leg2 = [leg for leg in self.arrivals() if leg.route.origin.code in expanded_hubs]
+            leg2_flights = [leg for leg in leg2 if isinstance(leg, FlightInstance)]
+            leg2_ferries = [leg for leg in leg2 if isinstance(leg, Sailing)]
+        SEARCH_CANDIDATES.labels("leg1").inc(len(leg1_flights))
+        SEARCH_CANDIDATES.labels("leg2").inc(len(leg2))
+
+        with self.stage("pairing"):
+            return self.pair(leg1_flights, leg2_flights, leg2_ferries, hub_aliases)
+
+    def pair(
+        self,
+        leg1_flights: list[FlightInstance],
+        leg2_flights: list[FlightInstance],
+        leg2_ferries: list[Sailing],
+        hub_aliases: dict[str, set[str]],
+    ) -> list[tuple[FlightInstance, Leg, float]]:
+        """Applies the connection-time rules to every leg-1/leg-2 combination."""
+        pairs: list[tuple[FlightInstance, Leg, float]] = []
+        evaluated = 0
+        for l1 in leg1_flights:
+            if not l1.route.arrival_time:
+                continue
+            evaluated += len(leg2_flights) + len(leg2_ferries)
+            l1_arr_dt = datetime.combine(l1.date, l1.route.arrival_time)
+            # Resolved once per hub above, not once per leg-1 flight.
+            l1_dest_aliases = hub_aliases.get(l1.route.destination.code, set())
+            next_date = l1.date + timedelta(days=1)
+
+            for l2 in leg2_flights:
+                if l2.date not in (l1.date, next_date):
+                    continue
+                if l2.route.origin.code not in l1_dest_aliases or not l2.route.departure_time:
+                    continue
+                gap = (datetime.combine(l2.date, l2.route.departure_time) - l1_arr_dt).total_seconds()
+                if MIN_CONNECT_FLIGHT <= gap <= MAX_CONNECT:
+                    pairs.append((l1, l2, gap))
+
+            for l2_s in leg2_ferries:
+                if l2_s.date not in (l1.date, next_date):
+                    continue
+                if l2_s.route.origin.code not in l1_dest_aliases or not l2_s.departure_time:
+                    continue
+                gap = (datetime.combine(l2_s.date, l2_s.departure_time) - l1_arr_dt).total_seconds()
+                if MIN_CONNECT_FERRY <= gap <= MAX_CONNECT:
+                    pairs.append((l1, l2_s, gap))
+        SEARCH_PAIRS.labels("evaluated").inc(evaluated)
+        return pairs
+
+    def search(self) -> SearchResult:
+        with self.stage("direct"):
+            direct_flights, direct_ferries = self.direct_legs()
+        with self.stage("connections"):
+            pairs = self.connections()
+        SEARCH_CANDIDATES.labels("direct").inc(len(direct_flights) + len(direct_ferries))
+        SEARCH_PAIRS.labels("accepted").inc(len(pairs))
+
+        # Loop through the window looking for a day with valid itineraries
+        with self.stage("serialize"):
+            for i in range(WINDOW_DAYS):
+                check_date = self.target_date + timedelta(days=i)
+                day_itineraries = [direct_itinerary(f) for f in direct_flights if f.date == check_date]
+                day_itineraries += [direct_itinerary(s) for s in direct_ferries if s.date == check_date]
+                day_itineraries += [
+                    connection_itinerary(l1, l2, gap) for l1, l2, gap in pairs if l1.date == check_date
+                ]
+                if day_itineraries:
+                    return SearchResult(day_itineraries, check_date, i > 0)
+        return SearchResult([], self.target_date, False)
+
+
+# Seconds between leg-1 arrival and leg-2 departure, per database vendor.
+GAP_SQL = {
+    "postgresql": "EXTRACT(EPOCH FROM ((leg2.date + leg2.departs) - (leg1.date + leg1.arrives)))",
+    "sqlite": (
+        "CAST(ROUND((julianday(leg2.date || ' ' || leg2.departs) "
+        "- julianday(leg1.date || ' ' || leg1.arrives)) * 86400) AS INTEGER)"
+    ),
+}
+
+CONNECTIONS_SQL = """
+WITH leg1 AS (
+    SELECT f.id, f.date, r.arrival_time AS arrives, hub.id AS hub_id, hub.parent_id AS hub_parent_id
+    FROM core_flightinstance f
+    JOIN core_route r ON r.id = f.route_id
+    JOIN core_location o ON o.id = r.origin_id
+    JOIN core_location hub ON hub.id = r.destination_id
+    WHERE o.code IN ({origins}) AND hub.code NOT IN ({dests})
+      AND f.date BETWEEN %s AND %s
+      AND r.is_active AND (f.available_seats > 0 OR f.is_projected)
+      AND r.arrival_time IS NOT NULL
+),
+leg2 AS (
+    SELECT 'f' AS kind, f.id, f.date, r.departure_time AS departs, o.id AS origin_id, o.parent_id AS origin_parent_id
+    FROM core_flightinstance f
+    JOIN core_route r ON r.id = f.route_id
+    JOIN core_location o ON o.id = r.origin_id
+    JOIN core_location d ON d.id = r.destination_id
+    WHERE d.code IN ({dests}) AND f.date BETWEEN %s AND %s
+      AND r.is_active AND (f.available_seats > 0 OR f.is_projected)
+      AND r.departure_time IS NOT NULL
+    UNION ALL
+    SELECT 's' AS kind, s.id, s.date, s.departure_time AS departs, o.id, o.parent_id
+    FROM core_sailing s
+    JOIN core_route r ON r.id = s.route_id
+    JOIN core_location o ON o.id = r.origin_id
+    JOIN core_location d ON d.id = r.destination_id
+    WHERE d.code IN ({dests}) AND s.date BETWEEN %s AND %s AND r.is_active
+),
+pairs AS (
+    SELECT leg1.id AS l1_id, leg1.date AS l1_date, leg2.kind, leg2.id AS l2_id,
+           leg2.date AS l2_date, leg2.departs, {gap} AS gap
+    FROM leg1
+    JOIN leg2 ON (
+        -- Same alias group: the hub itself, its children, its parent, its siblings.
+        leg2.origin_id = leg1.hub_id
+        OR leg2.origin_parent_id = leg1.hub_id
+        OR leg2.origin_id = leg1.hub_parent_id
+        OR leg2.origin_parent_id = leg1.hub_parent_id
+    )
+)
+SELECT l1_id, kind, l2_id, gap FROM pairs
+WHERE gap >= CASE kind WHEN 'f' THEN %s ELSE %s END AND gap <= %s
+ORDER BY l1_date, l1_id, kind, l2_date, departs, l2_id
+"""
+
+
+class SqlSearchEngine(PythonSearchEngine):
+    """
+    Pairs the legs in the database with one CTE. Direct legs are shared with
+    the Python engine; vendors without a gap expression fall back to it.
+    """
+
+    name = "sql"
+
+    def connections(self) -> list[tuple[FlightInstance, Leg, float]]:
+        gap = GAP_SQL.get(connection.vendor)
+        if gap is None:
+            return super().connections()
+
+        last_day = self.target_date + timedelta(days=WINDOW_DAYS - 1)
+        origins = ", ".join(["%s"] * len(self.origin_aliases))
+        dests = ", ".join(["%s"] * len(self.dest_aliases))
+        sql = CONNECTIONS_SQL.format(origins=origins, dests=dests, gap=gap)
+        params = [
+            *self.origin_aliases, *self.dest_aliases, self.target_date, last_day,
+            *self.dest_aliases, self.target_date, self.end_date,
+            *self.dest_aliases, self.target_date, self.end_date,
+            MIN_CONNECT_FLIGHT, MIN_CONNECT_FERRY, MAX_CONNECT,
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if not rows:
+            return []
+
+        leg1 = FlightInstance.objects.select_related(*LEG_RELATIONS).in_bulk({r[0] for r in rows})
+        flights = FlightInstance.objects.select_related(*LEG_RELATIONS).in_bulk(
+            {r[2] for r in rows if r[1] == "f"}
+        )
+        ferries = Sailing.objects.select_related(*LEG_RELATIONS).in_bulk(
+            {r[2] for r in rows if r[1] == "s"}
+        )
+        return [
+            (leg1[l1_id], flights[l2_id] if kind == "f" else ferries[l2_id], float(gap))
+            for l1_id, kind, l2_id, gap in rows
+        ]
+
+
+class MaterializedSearchEngine(PythonSearchEngine):
+    """Reads the pairs from `ValidConnection`; as fresh as the last ingest refresh."""
+
+    name = "materialized"
+
+    def connections(self) -> list[tuple[FlightInstance, Leg, float]]:
+        last_day = self.target_date + timedelta(days=WINDOW_DAYS - 1)
+        rows = ValidConnection.objects.filter(
+            # An alias list always holds its group's code.
+            origin_group__in=self.origin_aliases,
+            destination_group__in=self.dest_aliases,
+            date__range=[self.target_date, last_day],
+        ).select_related(
+            *(f"leg1__{r}" for r in LEG_RELATIONS),
+            *(f"leg2_flight__{r}" for r in LEG_RELATIONS),
+            *(f"leg2_sailing__{r}" for r in LEG_RELATIONS),
+        )
+        pairs: list[tuple[FlightInstance, Leg, float]] = []
+        for row in rows:
+            leg2 = row.leg2_flight or row.leg2_sailing
+            if leg2 is None:
+                # Deleted since the last refresh.
+                continue
+            pairs.append((row.leg1, leg2, float(row.gap_seconds)))
+        pairs.sort(key=lambda p: (p[0].date, p[0].id, isinstance(p[1], Sailing), p[2]))
+        return pairs
+
+
+class MappedSearchEngine(PythonSearchEngine):
+    """
+    Pairs the legs on the arrays of the memory-mapped snapshot file
+    (core/snapfile.py) with the Python engine's rules, and only materializes
+    the legs of the day it returns. Without a file covering the window it is
+    the Python engine.
+    """
+
+    name = "mapped"
+
+    def __init__(self, origin_aliases: Iterable[str], dest_aliases: Iterable[str], target_date: date) -> None:
+        mapped = current_snapfile()
+        end_date = target_date + timedelta(days=WINDOW_DAYS)
+        covered = mapped is not None and mapped.covers(target_date, end_date)
+        if mapped is not None:
+            record_cache("snapfile", covered)
+        if not covered:
+            self.mapped: Optional[MappedNetwork] = None
+            super().__init__(origin_aliases, dest_aliases, target_date)
+            return
+        self.mapped = mapped
+        self.snapshot = None
+        self.origin_aliases = list(origin_aliases)
+        self.dest_aliases = list(dest_aliases)
+        self.target_date = target_date
+        self.end_date = end_date
+
+    def indices(self, codes: list[str]) -> set[int]:
+        assert self.mapped is not None
+        return {i for i in map(self.mapped.location, codes) if i is not None}
+
+    def mapped_legs(self, direction: str, aliases: list[str]) -> memoryview:
+        assert self.mapped is not None
+        group = self.mapped.group(aliases[0])
+        return self.mapped.window(direction, group, self.target_date, self.end_date)
+
+    def mapped_search(self) -> tuple[list[int], list[int], list[tuple[int, int, float]]]:
+        """Direct flights, direct sailings and (leg 1, leg 2, gap) pairs as leg indices."""
+        m = self.mapped
+        assert m is not None
+        origins, dests = self.indices(self.origin_aliases), self.indices(self.dest_aliases)
+        route_origin, route_dest = m.route_origin, m.route_dest
+        kind, day, leg_route = m.leg_kind, m.leg_day, m.leg_route
+        departs, arrives = m.leg_departs, m.leg_arrives
+
+        with self.stage("direct"):
+            out, inbound = self.mapped_legs("out", self.origin_aliases), self.mapped_legs("in", self.dest_aliases)
+            direct_flights = [i for i in out if route_dest[leg_route[i]] in dests]
+            direct_ferries = [i for i in inbound if kind[i] == SAILING and route_origin[leg_route[i]] in origins]
+
+        with self.stage("connections"):
+            with self.stage("leg1"):
+                leg1 = [i for i in out if route_dest[leg_route[i]] not in dests]
+                hub_aliases = {hub: set(m.aliases(hub)) for hub in {route_dest[leg_route[i]] for i in leg1}}
+                expanded_hubs = set().union(*hub_aliases.values())
+            with self.stage("leg2"):
+                leg2 = [i for i in inbound if route_origin[leg_route[i]] in expanded_hubs]
+                leg2_flights = [i for i in leg2 if kind[i] == FLIGHT]
+                leg2_ferries = [i for i in leg2 if kind[i] == SAILING]
+            SEARCH_CANDIDATES.labels("leg1").inc(len(leg1))
+            SEARCH_CANDIDATES.labels("leg2").inc(len(leg2))
+
+            # Same rules and order as PythonSearchEngine.pair, on integers.
+            pairs: list[tuple[int, int, float]] = []
+            evaluated = 0
+            with self.stage("pairing"):
+                for l1 in leg1:
+                    if arrives[l1] == SNAPFILE_NULL:
+                        continue
+                    evaluated += len(leg2)
+                    l1_day, l1_arr = day[l1], day[l1] * 86400 + arrives[l1]
+                    l1_dest_aliases = hub_aliases[route_dest[leg_route[l1]]]
+                    for candidates, min_connect in ((leg2_flights, MIN_CONNECT_FLIGHT), (leg2_ferries, MIN_CONNECT_FERRY)):
+                        for l2 in candidates:
+                            if day[l2] - l1_day not in (0, 1) or departs[l2] == SNAPFILE_NULL:
+                                continue
+                            if route_origin[leg_route[l2]] not in l1_dest_aliases:
+                                continue
+                            gap = day[l2] * 86400 + departs[l2] - l1_arr
+                            if min_connect <= gap <= MAX_CONNECT:
+                                pairs.append((l1, l2, float(gap)))
+                SEARCH_PAIRS.labels("evaluated").inc(evaluated)
+        return direct_flights, direct_ferries, pairs
+
+    def direct_legs(self) -> tuple[list[FlightInstance], list[Sailing]]:
+        if self.mapped is None:
+            return super().direct_legs()
+        flights, ferries, _ = self.mapped_search()
+        legs = self.mapped.materialize([*flights, *ferries])
+        return [legs[i] for i in flights], [legs[i] for i in ferries]  # type: ignore[misc]
+
+    def connections(self) -> list[tuple[FlightInstance, Leg, float]]:
+        if self.mapped is None:
+            return super().connections()
+        _, _, pairs = self.mapped_search()
+        legs = self.mapped.materialize(i for l1, l2, _ in pairs for i in (l1, l2))
+        return [(legs[l1], legs[l2], gap) for l1, l2, gap in pairs]  # type: ignore[misc]
+
+    def search(self) -> SearchResult:
+        if self.mapped is None:
+            return super().search()
+        direct_flights, direct_ferries, pairs = self.mapped_search()
+        SEARCH_CANDIDATES.labels("direct").inc(len(direct_flights) + len(direct_ferries))
+        SEARCH_PAIRS.labels("accepted").inc(len(pairs))
+
+        day = self.mapped.leg_day
+        with self.stage("serialize"):
+            for i in range(WINDOW_DAYS):
+                check_date = self.target_date + timedelta(days=i)
+                offset = (check_date - self.mapped.first).days
+                flights = [f for f in direct_flights if day[f] == offset]
+                ferries = [s for s in direct_ferries if day[s] == offset]
+                connecting = [p for p in pairs if day[p[0]] == offset]
+                if not (flights or ferries or connecting):
+                    continue
+                legs = self.mapped.materialize([*flights, *ferries, *(i for p in connecting for i in p[:2])])
+                day_itineraries = [direct_itinerary(legs[f]) for f in flights]
+                day_itineraries += [direct_itinerary(legs[s]) for s in ferries]
+                day_itineraries += [
+                    connection_itinerary(legs[l1], legs[l2], gap) for l1, l2, gap in connecting  # type: ignore[arg-type]
+                ]
+                return SearchResult(day_itineraries, check_date, i > 0)
+        return SearchResult([], self.target_date, False)
+
+
+ENGINES: dict[str, type[PythonSearchEngine]] = {
+    PythonSearchEngine.name: PythonSearchEngine,
+    SqlSearchEngine.name: SqlSearchEngine,
+    MaterializedSearchEngine.name: MaterializedSearchEngine,
+    MappedSearchEngine.name: MappedSearchEngine,
+}
+
+
+def get_engine(name: Optional[str] = None) -> type[PythonSearchEngine]:
+    """The engine class for `name` (default: the SEARCH_ENGINE setting); KeyError if unknown."""
+    return ENGINES[name or getattr(settings, "SEARCH_ENGINE", PythonSearchEngine.name)]
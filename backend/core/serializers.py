@@ -91,6 +91,7 @@ class ItineraryLegSerializer(serializers.Serializer):
     price_text = serializers.SerializerMethodField()
     available_seats = serializers.SerializerMethodField()
     last_seen_at = serializers.SerializerMethodField()
+    is_projected = serializers.SerializerMethodField()
 
     def get_is_ferry(self, obj: Union[FlightInstance, Sailing]) -> bool:
         return isinstance(obj, Sailing)
@@ -161,10 +162,16 @@ class ItineraryLegSerializer(serializers.Serializer):
         return getattr(obj, "available_seats", None)
 
     def get_last_seen_at(self, obj: Union[FlightInstance, Sailing]) -> Optional[str]:
+        # A projection was never seen at a provider.
+        if getattr(obj, "is_projected", False):
+            return None
         if hasattr(obj, "last_seen_at") and obj.last_seen_at:
             return obj.last_seen_at.strftime("%b %d, %H:%M")
         return None
 
+    def get_is_projected(self, obj: Union[FlightInstance, Sailing]) -> bool:
+        return getattr(obj, "is_projected", False)
+
 
 
 
@@ -0,0 +1,487 @@
+"""
+Memory-mapped binary network snapshot.
+
+The in-process snapshot (core/snapshot.py) is built from the database by
+every process that uses it: the gunicorn master at startup and each worker
+after an ingest change. `write()` instead lets ingest serialize the bookable
+network once into a flat, versioned file at `NETWORK_SNAPSHOT_FILE`, and
+workers `mmap` it read-only: the pages are shared by every process through
+the OS page cache, and opening it costs no database scan at all.
+
+The file is a header, a section directory and little-endian columnar arrays,
+each section 8-byte aligned so it can be cast in place to a `memoryview`:
+
+- a string table (`strings.offsets` into the UTF-8 `strings.blob`),
+- locations, with their alias groups as spans into `alias.members`,
+- carriers and routes, referring to locations and carriers by index,
+- the legs: flights, then sailings, each by date and pk, with their
+  effective departure/arrival times in seconds of the day,
+- `index.offsets` / `index.legs`: the leg sets of core/legs.py, `out` by
+  origin group and `in` by destination group, for every day of the window.
+
+Nullable integers hold `NULL`; nullable strings hold -1. `MappedSearchEngine`
+(core/search.py) pairs legs on the mapped arrays and only turns the legs of
+the returned itineraries into (unsaved) model instances.
+
+Swaps are atomic: the writer fills a temporary file next to the target and
+`os.replace`s it, and `current()` stats the path on every call, mapping the
+new file on the next request. A previous map stays valid for requests still
+using it and is released with its last reference.
+"""
+
+import array
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Iterable, Optional, Union
+
+from django.conf import settings
+
+from .models import Carrier, FlightInstance, Location, Route, Sailing
+from .snapshot import NetworkSnapshot
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PFSNAP\0\0"
+FORMAT_VERSION = 1
+# magic, format version, section count, generation, built at (unix s), first day ordinal, days
+HEADER = struct.Struct("<8sHHqqiI")
+# name, offset, length in bytes
+SECTION = struct.Struct("<24sQQ")
+ALIGN = 8
+NULL = -(2**31)
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+FLIGHT, SAILING = 0, 1
+DIRECTIONS = ("out", "in")
+
+# Every section and its array typecode, in file order.
+SECTIONS = {
+    "strings.offsets": "I",
+    "strings.blob": "B",
+    "loc.id": "q",
+    "loc.code": "i",
+    "loc.name": "i",
+    "loc.city": "i",
+    "loc.group": "i",
+    "alias.offsets": "I",
+    "alias.members": "I",
+    "carrier.id": "q",
+    "carrier.code": "i",
+    "carrier.name": "i",
+    "carrier.website": "i",
+    "route.id": "q",
+    "route.origin": "I",
+    "route.dest": "I",
+    "route.carrier": "I",
+    "route.flight_number": "i",
+    "route.aircraft_type": "i",
+    "route.days": "i",
+    "route.duration": "i",
+    "route.departs": "i",
+    "route.arrives": "i",
+    "leg.id": "q",
+    "leg.kind": "B",
+    "leg.day": "H",
+    "leg.route": "I",
+    "leg.departs": "i",
+    "leg.arrives": "i",
+    "leg.duration": "i",
+    "leg.seats": "i",
+    "leg.price": "i",
+    "leg.currency": "i",
+    "leg.seen": "q",
+    "leg.projected": "B",
+    "index.offsets": "I",
+    "index.legs": "I",
+}
+
+Leg = Union[FlightInstance, Sailing]
+
+
+class SnapshotFileError(ValueError):
+    pass
+
+
+def _seconds(value: Optional[dt_time]) -> int:
+    return NULL if value is None else value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _clock(seconds: int) -> Optional[dt_time]:
+    return None if seconds == NULL else dt_time(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def _nullable(value: Optional[int]) -> int:
+    return NULL if value is None else value
+
+
+class _Strings:
+    def __init__(self) -> None:
+        self.index: dict[str, int] = {}
+        self.blob = bytearray()
+        self.offsets = array.array("I", [0])
+
+    def __call__(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        if value not in self.index:
+            self.index[value] = len(self.offsets) - 1
+            self.blob += value.encode()
+            self.offsets.append(len(self.blob))
+        return self.index[value]
+
+
+def encode(snapshot: NetworkSnapshot, generation: int) -> bytes:
+    """Serializes `snapshot` into the file format above."""
+    days = (snapshot.last - snapshot.first).days + 1
+    strings = _Strings()
+    columns = {name: array.array(typecode) for name, typecode in SECTIONS.items()}
+
+    def put(prefix: str, **values: Any) -> None:
+        for name, value in values.items():
+            columns[f"{prefix}.{name}"].append(value)
+
+    locations = list(snapshot.locations.values())
+    loc_index = {loc.code: i for i, loc in enumerate(locations)}
+    columns["alias.offsets"].append(0)
+    for loc in locations:
+        put(
+            "loc",
+            id=loc.pk,
+            code=strings(loc.code),
+            name=strings(loc.name),
+            city=strings(loc.city),
+            group=loc_index.get(snapshot.group_of(loc.code), -1),
+        )
+        columns["alias.members"].extend(
+            sorted(loc_index[code] for code in snapshot.aliases[loc.code] if code in loc_index)
+        )
+        columns["alias.offsets"].append(len(columns["alias.members"]))
+
+    carrier_index = {}
+    for i, carrier in enumerate(snapshot.carriers.values()):
+        carrier_index[carrier.pk] = i
+        put("carrier", id=carrier.pk, code=strings(carrier.code), name=strings(carrier.name), website=strings(carrier.website))
+
+    route_index = {}
+    for i, route in enumerate(snapshot.routes.values()):
+        route_index[route.pk] = i
+        put(
+            "route",
+            id=route.pk,
+            origin=loc_index[route.origin.code],
+            dest=loc_index[route.destination.code],
+            carrier=carrier_index[route.carrier_id],
+            flight_number=strings(route.flight_number),
+            aircraft_type=strings(route.aircraft_type),
+            days=strings(route.days_of_operation),
+            duration=_nullable(route.duration_minutes),
+            departs=_seconds(route.departure_time),
+            arrives=_seconds(route.arrival_time),
+        )
+
+    # Flights appear in both an `out` and an `in` set: store each leg once.
+    unique = {(isinstance(leg, Sailing), leg.pk): leg for legs in snapshot.legs.values() for leg in legs}
+    leg_index = {}
+    for i, (key, leg) in enumerate(sorted(unique.items(), key=lambda item: (item[0][0], item[1].date, item[0][1]))):
+        leg_index[key] = i
+        route = leg.route
+        if isinstance(leg, Sailing):
+            put(
+                "leg",
+                kind=SAILING,
+                departs=_seconds(leg.departure_time),
+                arrives=_seconds(leg.arrival_time),
+                duration=_nullable(leg.duration_minutes),
+                seats=NULL,
+                price=strings(leg.price_text),
+                currency=-1,
+                seen=NULL,
+                projected=0,
+            )
+        else:
+            put(
+                "leg",
+                kind=FLIGHT,
+                departs=_seconds(route.departure_time),
+                arrives=_seconds(route.arrival_time),
+                duration=_nullable(route.duration_minutes),
+                seats=_nullable(leg.available_seats),
+                price=strings(None if leg.price_amount is None else str(leg.price_amount)),
+                currency=strings(leg.currency),
+                seen=NULL if leg.last_seen_at is None else (leg.last_seen_at - EPOCH) // timedelta(microseconds=1),
+                projected=int(leg.is_projected),
+            )
+        put("leg", id=leg.pk, day=(leg.date - snapshot.first).days, route=route_index[route.pk])
+
+    # Dense (direction, location, day) spans; only group locations have legs.
+    index_offsets, index_legs = columns["index.offsets"], columns["index.legs"]
+    index_offsets.append(0)
+    for direction in DIRECTIONS:
+        for loc in locations:
+            for day in range(days):
+                legs = snapshot.legs.get((direction, loc.code, snapshot.first + timedelta(days=day)), ())
+                index_legs.extend(leg_index[isinstance(leg, Sailing), leg.pk] for leg in legs)
+                index_offsets.append(len(index_legs))
+
+    columns["strings.offsets"] = strings.offsets
+    columns["strings.blob"] = array.array("B", strings.blob)
+
+    payloads = []
+    for name, column in columns.items():
+        if sys.byteorder != "little":
+            column.byteswap()
+        payloads.append((name, column.tobytes()))
+
+    offset = _aligned(HEADER.size + SECTION.size * len(payloads))
+    directory, body = [], bytearray()
+    for name, payload in payloads:
+        directory.append(SECTION.pack(name.encode(), offset + len(body), len(payload)))
+        body += payload + bytes(_aligned(len(payload)) - len(payload))
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(payloads), generation, int(time.time()), snapshot.first.toordinal(), days
+    )
+    head = header + b"".join(directory)
+    return head + bytes(offset - len(head)) + body
+
+
+def _aligned(size: int) -> int:
+    return -(-size // ALIGN) * ALIGN
+
+
+def file_path() -> Optional[Path]:
+    path = getattr(settings, "NETWORK_SNAPSHOT_FILE", "")
+    return Path(path) if path else None
+
+
+def write(path: Optional[Path] = None, days: Optional[int] = None) -> Optional["MappedNetwork"]:
+    """
+    Builds the network from the database and atomically replaces the file at
+    `path` (default: `NETWORK_SNAPSHOT_FILE`); None when no file is configured.
+    """
+    path = path or file_path()
+    if path is None:
+        return None
+    try:
+        generation = MappedNetwork(path).generation + 1
+    except (OSError, SnapshotFileError):
+        generation = 1
+    data = encode(NetworkSnapshot.build(generation, days), generation)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    mapped = MappedNetwork(path)
+    logger.info(f"Wrote {mapped.stats()} to {path} ({len(data)} bytes)")
+    return mapped
+
+
+class MappedNetwork:
+    """A read-only view of one snapshot file; the arrays are `memoryview`s over the map."""
+
+    def __init__(self, path: Path) -> None:
+        with open(path, "rb") as fh:
+            stat = os.fstat(fh.fileno())
+            if stat.st_size < HEADER.size:
+                raise SnapshotFileError(f"{path} is not a network snapshot")
+            self.map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.path = path
+
+        magic, version, count, self.generation, self.built_at, first, days = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise SnapshotFileError(f"{path} is not a version {FORMAT_VERSION} network snapshot")
+        if sys.byteorder != "little":
+            raise SnapshotFileError("Network snapshot files can only be mapped on little-endian hosts")
+        self.first = date.fromordinal(first)
+        self.days = days
+        self.last = self.first + timedelta(days=days - 1)
+
+        view = memoryview(self.map)
+        self.sections: dict[str, memoryview] = {}
+        for i in range(count):
+            raw, offset, length = SECTION.unpack_from(self.map, HEADER.size + i * SECTION.size)
+            name = raw.rstrip(b"\0").decode()
+            if name not in SECTIONS or offset + length > len(self.map):
+                raise SnapshotFileError(f"{path} has a corrupt section directory")
+            self.sections[name] = view[offset : offset + length].cast(SECTIONS[name])
+        missing = SECTIONS.keys() - self.sections.keys()
+        if missing:
+            raise SnapshotFileError(f"{path} lacks sections {sorted(missing)}")
+        for name, section in self.sections.items():
+            setattr(self, name.replace(".", "_"), section)
+
+        # The only per-process state: code -> location index.
+        self.codes = {self.string(code): i for i, code in enumerate(self.loc_code)}
+
+    def string(self, index: int) -> Optional[str]:
+        if index < 0:
+            return None
+        offsets = self.strings_offsets
+        return bytes(self.strings_blob[offsets[index] : offsets[index + 1]]).decode()
+
+    def covers(self, first: date, last: date) -> bool:
+        return self.first <= first and last <= self.last
+
+    def location(self, code: str) -> Optional[int]:
+        return self.codes.get(code)
+
+    def group(self, code: str) -> Optional[int]:
+        index = self.codes.get(code)
+        if index is None:
+            return None
+        group = self.loc_group[index]
+        return index if group < 0 else group
+
+    def aliases(self, location: int) -> memoryview:
+        return self.alias_members[self.alias_offsets[location] : self.alias_offsets[location + 1]]
+
+    def window(self, direction: str, group: Optional[int], first: date, last: date) -> memoryview:
+        """The leg indices of the `out` or `in` set of `group` from `first` to `last`, in date order."""
+        if group is None:
+            return self.index_legs[0:0]
+        base = (DIRECTIONS.index(direction) * len(self.loc_code) + group) * self.days
+        start = base + (first - self.first).days
+        end = base + (last - self.first).days + 1
+        return self.index_legs[self.index_offsets[start] : self.index_offsets[end]]
+
+    def day(self, leg: int) -> date:
+        return self.first + timedelta(days=self.leg_day[leg])
+
+    def materialize(self, legs: Iterable[int]) -> dict[int, Leg]:
+        """Unsaved FlightInstance/Sailing instances for the leg indices `legs`."""
+        locations: dict[int, Location] = {}
+        carriers: dict[int, Carrier] = {}
+        routes: dict[int, Route] = {}
+
+        def location(i: int) -> Location:
+            if i not in locations:
+                locations[i] = Location(
+                    id=self.loc_id[i],
+                    code=self.string(self.loc_code[i]),
+                    name=self.string(self.loc_name[i]),
+                    city=self.string(self.loc_city[i]),
+                )
+            return locations[i]
+
+        def carrier(i: int) -> Carrier:
+            if i not in carriers:
+                carriers[i] = Carrier(
+                    id=self.carrier_id[i],
+                    code=self.string(self.carrier_code[i]),
+                    name=self.string(self.carrier_name[i]),
+                    website=self.string(self.carrier_website[i]),
+                )
+            return carriers[i]
+
+        def route(i: int) -> Route:
+            if i not in routes:
+                duration = self.route_duration[i]
+                routes[i] = Route(
+                    id=self.route_id[i],
+                    origin=location(self.route_origin[i]),
+                    destination=location(self.route_dest[i]),
+                    carrier=carrier(self.route_carrier[i]),
+                    flight_number=self.string(self.route_flight_number[i]),
+                    aircraft_type=self.string(self.route_aircraft_type[i]),
+                    days_of_operation=self.string(self.route_days[i]),
+                    duration_minutes=None if duration == NULL else duration,
+                    departure_time=_clock(self.route_departs[i]),
+                    arrival_time=_clock(self.route_arrives[i]),
+                )
+            return routes[i]
+
+        materialized: dict[int, Leg] = {}
+        for i in legs:
+            if i in materialized:
+                continue
+            if self.leg_kind[i] == SAILING:
+                materialized[i] = Sailing(
+                    id=self.leg_id[i],
+                    route=route(self.leg_route[i]),
+                    date=self.day(i),
+                    departure_time=_clock(self.leg_departs[i]),
+                    arrival_time=_clock(self.leg_arrives[i]),
+                    duration_minutes=self.leg_duration[i],
+                    price_text=self.string(self.leg_price[i]),
+                )
+                continue
+            price, seats, seen = self.string(self.leg_price[i]), self.leg_seats[i], self.leg_seen[i]
+            materialized[i] = FlightInstance(
+                id=self.leg_id[i],
+                route=route(self.leg_route[i]),
+                date=self.day(i),
+                price_amount=None if price is None else Decimal(price),
+                currency=self.string(self.leg_currency[i]),
+                available_seats=None if seats == NULL else seats,
+                is_projected=bool(self.leg_projected[i]),
+                last_seen_at=None if seen == NULL else EPOCH + timedelta(microseconds=seen),
+            )
+        return materialized
+
+    def stats(self) -> str:
+        return (
+            f"snapshot file g{self.generation} {self.first}..{self.last}: {len(self.loc_code)} locations, "
+            f"{len(self.route_id)} routes, {len(self.leg_id)} legs"
+        )
+
+
+_mapped: Optional[MappedNetwork] = None
+_swap = threading.Lock()
+
+
+def current() -> Optional[MappedNetwork]:
+    """The mapped `NETWORK_SNAPSHOT_FILE`, remapped when it was replaced; None if absent or invalid."""
+    global _mapped
+    path = file_path()
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        _mapped = None
+        return None
+    mapped = _mapped
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if mapped is not None and mapped.path == path and mapped.key == key:
+        return mapped
+    with _swap:
+        if _mapped is not mapped:
+            # Another thread remapped it meanwhile.
+            return _mapped
+        try:
+            mapped = MappedNetwork(path)
+        except (OSError, SnapshotFileError) as e:
+            logger.error(f"Could not map the network snapshot file: {e}")
+            mapped = None
+        else:
+            logger.info(f"Mapped {mapped.stats()}")
+        _mapped = mapped
+    return mapped
+
+
+def publish() -> None:
+    """Rewrites the file once at the end of an ingest run; a no-op without `NETWORK_SNAPSHOT_FILE`."""
+    if file_path() is None:
+        return
+    try:
+        write()
+    except Exception as e:
+        # Workers keep serving the previous file; the next ingest run retries.
+        logger.error(f"Could not write the network snapshot file: {e}")
@@ -0,0 +1,247 @@
+"""
+In-memory network snapshot shared by the gunicorn workers.
+
+Gunicorn runs with `--preload` and recycles workers every ~1000 requests,
+so whatever a worker caches in-process is rebuilt per worker and lost on
+every recycle, and the first searches of a fresh worker go to Redis and the
+database. `NetworkSnapshot` holds the hot, read-only part of the network:
+
+- every location with its resolved aliases and alias group,
+- the carriers and routes (shared by the legs below),
+- the bookable flights and the sailings of the next `NETWORK_SNAPSHOT_DAYS`
+  days, indexed like the leg cache: `out` by origin group and day, `in` by
+  destination group and day (core/legs.py).
+
+`preload()` builds it in the gunicorn master (config/wsgi.py) and calls
+`gc.freeze()`, so the objects are moved out of the collector's reach and
+the forked workers keep sharing their pages instead of copying them on the
+first collection. The `pre_fork` hook (config/gunicorn.py) refreshes a stale
+master copy, so recycled workers start with current data.
+
+Hot swap: ingest runs bump a version in the shared cache through
+`publish()` (called by `reconcile.invalidate_caches`). `current()` compares
+it at most every `NETWORK_SNAPSHOT_CHECK_SECONDS`; on a change (or a new
+day) it starts a background thread that rebuilds the snapshot and swaps the
+reference, while requests fall back to the leg cache meanwhile, so stale
+legs are never served and no request pays for a build. Age alone
+(`NETWORK_SNAPSHOT_MAX_AGE`, e.g. for admin edits) only refreshes the
+master copy in `pre_fork`: a worker's inherited copy is as old as the
+master's, and re-basing on it would make every worker rebuild privately.
+Objects in a snapshot are shared: callers must treat them as read-only.
+
+Memory: a rebuilt snapshot is private to the worker that built it, so after
+the first ingest change every worker holds its own copy until it is
+recycled and forks off the (refreshed) master again. With many workers or a
+large network, prefer `SEARCH_ENGINE = "mapped"` (core/snapfile.py): its
+file is shared through the page cache however often it is replaced.
+"""
+
+import gc
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Optional
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.db import connections
+from django.utils import timezone
+
+from .legs import BOOKABLE_FLIGHTS
+from .models import Carrier, FlightInstance, Location, Route, Sailing
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "prop_snapshot_version"
+
+
+class NetworkSnapshot:
+    def __init__(self, version: int, first: date, last: date) -> None:
+        self.version = version
+        self.first = first
+        self.last = last
+        self.built_at = time.monotonic()
+        self.locations: dict[str, Location] = {}
+        self.groups: dict[str, str] = {}
+        self.aliases: dict[str, frozenset[str]] = {}
+        self.carriers: dict[str, Carrier] = {}
+        self.routes: dict[int, Route] = {}
+        self.legs: dict[tuple[str, str, date], list[Any]] = {}
+
+    @classmethod
+    def build(cls, version: int, days: Optional[int] = None) -> "NetworkSnapshot":
+        first = timezone.localdate()
+        last = first + timedelta(days=days if days is not None else settings.NETWORK_SNAPSHOT_DAYS)
+        snapshot = cls(version, first, last)
+
+        locations = list(
+            Location.objects.select_related("parent").prefetch_related("sub_locations", "parent__sub_locations")
+        )
+        for loc in locations:
+            snapshot.locations[loc.code] = loc
+            snapshot.groups[loc.code] = loc.group_code
+            snapshot.aliases[loc.code] = frozenset(loc.resolve_aliases())
+        # One instance per location and carrier, shared by every route.
+        by_id = {loc.pk: loc for loc in locations}
+        snapshot.carriers = {carrier.code: carrier for carrier in Carrier.objects.all()}
+        carriers_by_id = {carrier.pk: carrier for carrier in snapshot.carriers.values()}
+        for route in Route.objects.filter(is_active=True):
+            route.origin = by_id[route.origin_id]
+            route.destination = by_id[route.destination_id]
+            route.carrier = carriers_by_id[route.carrier_id]
+            snapshot.routes[route.pk] = route
+
+        # Same leg sets and order as core/legs.py: flights, then sailings.
+        legs: defaultdict[tuple[str, str, date], list[Any]] = defaultdict(list)
+        flights = FlightInstance.objects.filter(
+            BOOKABLE_FLIGHTS, date__range=(first, last), route_id__in=snapshot.routes
+        ).order_by("date", "pk")
+        for flight in flights:
+            flight.route = snapshot.routes[flight.route_id]
+            legs["out", snapshot.group_of(flight.route.origin.code), flight.date].append(flight)
+            legs["in", snapshot.group_of(flight.route.destination.code), flight.date].append(flight)
+        sailings = Sailing.objects.filter(
+            date__range=(first, last), route_id__in=snapshot.routes
+        ).order_by("date", "pk")
+        for sailing in sailings:
+            sailing.route = snapshot.routes[sailing.route_id]
+            legs["in", snapshot.group_of(sailing.route.destination.code), sailing.date].append(sailing)
+        snapshot.legs = dict(legs)
+        return snapshot
+
+    def group_of(self, code: str) -> str:
+        return self.groups.get(code, code)
+
+    def covers(self, first: date, last: date) -> bool:
+        return self.first <= first and last <= self.last
+
+    def window(self, direction: str, group: str, first: date, last: date) -> list[Any]:
+        """The `out` or `in` legs of `group` from `first` to `last`, in date order."""
+        days = (first + timedelta(days=i) for i in range((last - first).days + 1))
+        return [leg for day in days for leg in self.legs.get((direction, group, day), ())]
+
+    def stats(self) -> str:
+        return (
+            f"snapshot v{self.version} {self.first}..{self.last}: {len(self.groups)} locations, "
+            f"{len(self.routes)} routes, {sum(map(len, self.legs.values()))} leg entries"
+        )
+
+
+_snapshot: Optional[NetworkSnapshot] = None
+_checked_at = float("-inf")
+_stale = False
+_rebuild = threading.Lock()
+_builder: Optional[threading.Thread] = None
+_build_started_at = float("-inf")
+
+
+def published_version() -> Optional[int]:
+    """The version ingest last published; None while the shared cache is unreachable."""
+    try:
+        return shared_cache.get(VERSION_KEY, 0)
+    except Exception as e:
+        logger.error(f"Could not read the network snapshot version: {e}")
+        return None
+
+
+def publish() -> None:
+    """Tells every process that the network changed; their snapshots rebuild on next use."""
+    if not getattr(settings, "NETWORK_SNAPSHOT", False):
+        return
+    shared_cache.add(VERSION_KEY, 0, timeout=None)
+    try:
+        shared_cache.incr(VERSION_KEY)
+    except ValueError:
+        shared_cache.set(VERSION_KEY, 1, timeout=None)
+
+
+def install(snapshot: Optional[NetworkSnapshot]) -> None:
+    global _snapshot, _checked_at, _stale
+    _snapshot, _checked_at, _stale = snapshot, time.monotonic(), False
+
+
+def _is_stale(snapshot: NetworkSnapshot, version: Optional[int], max_age: Optional[float] = None) -> bool:
+    # An unknown version (shared cache down) does not retire a working copy.
+    if max_age is not None and time.monotonic() - snapshot.built_at > max_age:
+        return True
+    return version not in (None, snapshot.version) or timezone.localdate() != snapshot.first
+
+
+def current() -> Optional[NetworkSnapshot]:
+    """This process's snapshot; None when disabled, or stale while a rebuild runs."""
+    global _checked_at, _stale
+    if not getattr(settings, "NETWORK_SNAPSHOT", False):
+        return None
+    snapshot = _snapshot
+    now = time.monotonic()
+    if snapshot is not None and now - _checked_at >= settings.NETWORK_SNAPSHOT_CHECK_SECONDS:
+        _checked_at = now
+        _stale = _is_stale(snapshot, published_version())
+    if snapshot is not None and not _stale:
+        return snapshot
+    _start_rebuild()
+    return None
+
+
+def refresh() -> Optional[NetworkSnapshot]:
+    """Builds and installs a new snapshot now; what the background rebuild runs."""
+    started = time.monotonic()
+    try:
+        install(NetworkSnapshot.build(published_version() or 0))
+    except Exception as e:
+        logger.error(f"Could not build the network snapshot: {e}")
+        return None
+    logger.info(f"Built {_snapshot.stats()} in {time.monotonic() - started:.2f}s")  # type: ignore[union-attr]
+    return _snapshot
+
+
+def _rebuild_in_background() -> None:
+    try:
+        refresh()
+    finally:
+        # The thread's own database connections.
+        connections.close_all()
+
+
+def _start_rebuild() -> None:
+    """Starts one rebuild thread per process, and after a failure waits a check interval."""
+    global _builder, _build_started_at
+    with _rebuild:
+        if _builder is not None and _builder.is_alive():
+            return
+        if time.monotonic() - _build_started_at < settings.NETWORK_SNAPSHOT_CHECK_SECONDS:
+            return
+        _build_started_at = time.monotonic()
+        _builder = threading.Thread(
+            target=_rebuild_in_background, name="network-snapshot", daemon=True
+        )
+        _builder.start()
+
+
+def preload() -> None:
+    """Builds (or refreshes) the snapshot in the gunicorn master and freezes it for the forked workers."""
+    if not getattr(settings, "NETWORK_SNAPSHOT", False):
+        return
+    # Without the shared cache the master still builds (as version 0), so it
+    # boots and forks workers with data.
+    version = published_version()
+    if _snapshot is not None and version is not None and not _is_stale(
+        _snapshot, version, settings.NETWORK_SNAPSHOT_MAX_AGE
+    ):
+        return
+    # A previous master copy becomes collectable again once replaced.
+    gc.unfreeze()
+    try:
+        install(NetworkSnapshot.build(version or 0))
+    except Exception as e:
+        # Workers build their own on first use; the master must still start.
+        logger.error(f"Could not preload the network snapshot: {e}")
+        return
+    finally:
+        # Workers must not inherit the master's database sockets.
+        connections.close_all()
+    logger.info(f"Preloaded {_snapshot.stats()}")  # type: ignore[union-attr]
+    gc.collect()
+    gc.freeze()
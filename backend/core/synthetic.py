@@ -0,0 +1,265 @@
+"""
+Synthetic networks for benchmarks.
+
+`seed_data` builds the real, tiny Caribbean network; the search code has to
+hold up on far larger ones. `generate_network` builds a reproducible random
+network of a given `NetworkSpec` with bulk inserts:
+
+- `groups` alias groups, each an airport with `aliases` sub-locations
+  (the first a ferry port, the others secondary airports),
+- `links` outbound links per group, biased towards a few hubs so that
+  two-leg connections exist, each operated `departures` times a day with
+  distinct departure times,
+- a `ferry_share` of the links sailed between the ports of neighbouring
+  groups instead of flown,
+- one flight instance or sailing per route and day for `days` days.
+
+Every synthetic row hangs off the `ZZA`/`ZZF` carriers or off locations
+tagged twice, with the `PREFIX` code prefix and the `NAME_PREFIX` name
+prefix, since real IATA codes start with Z too. `clear_network` removes a
+previous network (cascading to its routes, departures, fares and
+connections) without touching real data. The shared cache is never flushed:
+`forget_cached` deletes only the keys that can hold synthetic data, so
+sessions and real searches survive.
+"""
+
+import random
+from dataclasses import asdict, dataclass
+from datetime import date, time, timedelta
+from decimal import Decimal
+from typing import Any, Iterable, Optional
+
+from django.db import models, transaction
+from django.db.models import Max, Min
+
+from .cache import cache
+from .legs import LOCATION_GROUPS_KEY, leg_key
+from .models import Carrier, FetchJob, FlightInstance, Location, Route, Sailing, SearchDemand
+
+PREFIX = "Z"
+NAME_PREFIX = "Synthetic "
+AIR_CARRIER = "ZZA"
+FERRY_CARRIER = "ZZF"
+BATCH_SIZE = 2000
+
+
+@dataclass(frozen=True)
+class NetworkSpec:
+    groups: int = 20
+    aliases: int = 1
+    links: int = 3
+    departures: int = 2
+    days: int = 7
+    ferry_share: float = 0.2
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+SCALES = {
+    "small": NetworkSpec(groups=20, aliases=1, links=3, departures=2, days=7),
+    "medium": NetworkSpec(groups=100, aliases=2, links=5, departures=3, days=14),
+    "large": NetworkSpec(groups=400, aliases=2, links=8, departures=4, days=30),
+}
+
+
+def group_codes(spec: NetworkSpec) -> list[str]:
+    return [f"{PREFIX}{i:03d}" for i in range(spec.groups)]
+
+
+def synthetic_locations() -> "models.QuerySet[Location]":
+    return Location.objects.filter(code__startswith=PREFIX, name__startswith=NAME_PREFIX)
+
+
+def clear_network() -> int:
+    """Deletes every synthetic location and carrier with what hangs off them."""
+    forget_cached()
+    codes = list(synthetic_locations().values_list("code", flat=True))
+    SearchDemand.objects.filter(origin__in=codes).delete()
+    FetchJob.objects.filter(origin__in=codes).delete()
+    deleted, _ = synthetic_locations().delete()
+    Carrier.objects.filter(code__in=(AIR_CARRIER, FERRY_CARRIER)).delete()
+    return deleted
+
+
+def cache_keys() -> list[str]:
+    """
+    The shared-cache keys that can hold synthetic data: the leg sets of every
+    synthetic group around its departure days, and the cached location lists
+    and groups. Search and calendar responses are keyed per query
+    (`query_cache_keys`) and otherwise expire on their short TTLs.
+    """
+    keys = ["prop_locations_list", "prop_carriers_list", LOCATION_GROUPS_KEY]
+    span = [
+        FlightInstance.objects.filter(route__carrier__code=AIR_CARRIER).aggregate(
+            first=Min("date"), last=Max("date")
+        ),
+        Sailing.objects.filter(route__carrier__code=FERRY_CARRIER).aggregate(
+            first=Min("date"), last=Max("date")
+        ),
+    ]
+    firsts = [s["first"] for s in span if s["first"]]
+    if not firsts:
+        return keys
+    first, last = min(firsts), max(s["last"] for s in span if s["last"])
+    # Search windows reach a few days past the last departure.
+    days = [first + timedelta(days=i) for i in range((last - first).days + 4)]
+    groups = synthetic_locations().filter(parent__isnull=True).values_list("code", flat=True)
+    for group in groups:
+        for day in days:
+            keys += [leg_key("out", group, day), leg_key("in", group, day)]
+    return keys
+
+
+def query_cache_keys(origin: str, dest: str, date_str: Optional[str] = None) -> list[str]:
+    """The cached responses of a calendar (and, with a date, a search) between two groups."""
+    keys = [f"prop_dates_{origin}_{dest}"]
+    if date_str:
+        keys += [
+            f"prop_search_{origin}_{dest}_{date_str}_{transport_filter}"
+            for transport_filter in ("all", "flight", "ferry")
+        ]
+    return keys
+
+
+def forget_cached(keys: Optional[Iterable[str]] = None) -> None:
+    """Deletes `keys` (default: `cache_keys()`) from the shared cache, and nothing else."""
+    cache.delete_many(list(cache_keys() if keys is None else keys))
+
+
+def _clock(minutes: int) -> time:
+    minutes = min(minutes, 23 * 60 + 55)
+    return time(minutes // 60, minutes % 60)
+
+
+@transaction.atomic
+def generate_network(spec: NetworkSpec, start: date, seed: int = 0) -> dict[str, int]:
+    """Replaces the synthetic network with a new one; returns the row counts."""
+    if not 1 < spec.groups <= 1000:
+        raise ValueError("groups must be between 2 and 1000 (location codes are 5 characters)")
+    if not 0 <= spec.aliases <= 26:
+        raise ValueError("aliases must be between 0 and 26")
+    rng = random.Random(seed)
+    clear_network()
+
+    air = Carrier.objects.create(code=AIR_CARRIER, name="Synthetic Air", carrier_type="AIR")
+    ferry = Carrier.objects.create(code=FERRY_CARRIER, name="Synthetic Ferry", carrier_type="SEA")
+
+    codes = group_codes(spec)
+    airports = {
+        loc.code: loc
+        for loc in Location.objects.bulk_create(
+            Location(code=code, name=f"{NAME_PREFIX}{code}") for code in codes
+        )
+    }
+    children = Location.objects.bulk_create(
+        Location(
+            code=f"{code}{chr(ord('A') + i)}",
+            name=f"{NAME_PREFIX}{code} {'port' if i == 0 else 'airport'} {i}",
+            location_type="PRT" if i == 0 else "APT",
+            parent=airports[code],
+        )
+        for code in codes
+        for i in range(spec.aliases)
+    )
+    ports = {loc.parent.code: loc for loc in children if loc.location_type == "PRT"}
+    flyable: dict[str, list[Location]] = {code: [loc] for code, loc in airports.items()}
+    for loc in children:
+        if loc.location_type == "APT":
+            flyable[loc.parent.code].append(loc)
+
+    # A tenth of the groups act as hubs and attract most of the flown links.
+    weights = [10 if i < max(spec.groups // 10, 1) else 1 for i in range(spec.groups)]
+    routes: list[Route] = []
+    for index, code in enumerate(codes):
+        targets: set[str] = set()
+        neighbours = {codes[(index + offset) % spec.groups] for offset in (-2, -1, 1, 2)} - {code}
+        while len(targets) < min(spec.links, spec.groups - 1):
+            free_neighbours = sorted(neighbours - targets)
+            by_sea = bool(ports and free_neighbours) and rng.random() < spec.ferry_share
+            if by_sea:
+                target = rng.choice(free_neighbours)
+            else:
+                target = rng.choices(codes, weights)[0]
+            if target == code or target in targets:
+                continue
+            targets.add(target)
+            origin = ports[code] if by_sea else rng.choice(flyable[code])
+            dest = ports[target] if by_sea else rng.choice(flyable[target])
+            spacing = 14 * 60 // spec.departures
+            for n in range(spec.departures):
+                departure = 6 * 60 + n * spacing + rng.randrange(max(spacing - 5, 1))
+                duration = rng.randint(60, 240) if by_sea else rng.randint(35, 180)
+                routes.append(
+                    Route(
+                        origin=origin,
+                        destination=dest,
+                        carrier=ferry if by_sea else air,
+                        flight_number=None if by_sea else f"ZZ{len(routes) + 1}",
+                        duration_minutes=duration,
+                        departure_time=_clock(departure),
+                        arrival_time=_clock(departure + duration),
+                    )
+                )
+    Route.objects.bulk_create(routes, batch_size=BATCH_SIZE)
+
+    days = [start + timedelta(days=i) for i in range(spec.days)]
+    flights = [
+        FlightInstance(
+            route=route,
+            date=day,
+            price_amount=Decimal(rng.randint(8000, 40000)) / 100,
+            available_seats=rng.randint(0, 9),
+        )
+        for route in routes
+        if route.carrier_id == air.pk
+        for day in days
+    ]
+    FlightInstance.objects.bulk_create(flights, batch_size=BATCH_SIZE)
+    sailings = [
+        Sailing(
+            route=route,
+            date=day,
+            departure_time=route.departure_time,
+            arrival_time=route.arrival_time,
+            duration_minutes=route.duration_minutes,
+            price_text=f"{rng.randint(40, 120)} €",
+        )
+        for route in routes
+        if route.carrier_id == ferry.pk
+        for day in days
+    ]
+    Sailing.objects.bulk_create(sailings, batch_size=BATCH_SIZE)
+    forget_cached()
+
+    return {
+        "locations": len(airports) + len(children),
+        "routes": len(routes),
+        "flights": len(flights),
+        "sailings": len(sailings),
+    }
+
+
+def sample_queries(spec: NetworkSpec, start: date, count: int, seed: int = 0) -> list[tuple[str, str, date]]:
+    """Random (origin, destination, date) searches between distinct synthetic groups."""
+    rng = random.Random(seed)
+    codes = group_codes(spec)
+    queries = []
+    for _ in range(count):
+        origin, dest = rng.sample(codes, 2)
+        queries.append((origin, dest, start + timedelta(days=rng.randrange(spec.days))))
+    return queries
+
+
+def parse_spec(text: str) -> NetworkSpec:
+    """A preset name from `SCALES`, or `key=value,...` overrides of the defaults."""
+    if text in SCALES:
+        return SCALES[text]
+    fields = NetworkSpec.__dataclass_fields__
+    values: dict[str, Any] = {}
+    for pair in text.split(","):
+        key, _, value = pair.partition("=")
+        if key not in fields:
+            raise ValueError(f"Unknown scale '{text}' (presets: {', '.join(SCALES)})")
+        values[key] = float(value) if key == "ferry_share" else int(value)
+    return NetworkSpec(**values)
@@ -1,5 +1,68 @@
+import heapq
+import io
+import json
+import os
+import tempfile
+from datetime import date, time, timedelta
+from decimal import Decimal
+from importlib.util import find_spec
+from pathlib import Path
+from unittest import mock, skipUnless
+from urllib.request import Request as UrllibRequest
+
+from prometheus_client import REGISTRY
 from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+
+from . import demand, snapfile, snapshot
+from .cache import (
+    GENERATION_KEY,
+    INVALIDATION_KEY,
+    RAW_JSON,
+    ZLIB_JSON,
+    CacheCodec,
+    LocalLRU,
+    TieredCache,
+    cache,
+)
+from .connections import refresh_connections
+from .fares import cheapest_per_day, downsample, record_observations
+from .ferry_parser import parse_french_date, parse_page
+from .jobs import MAX_ATTEMPTS, RUNNING_TIMEOUT, claim_next, enqueue, finish
+from .legs import group_of, leg_key, location_groups
+from .middleware import QueryBudgetExceeded, QueryRecorder
+from .models import (
+    Carrier, FareObservation, FetchJob, FlightInstance, IngestRun, IngestTask, Location, Route,
+    Sailing, SearchDemand,
+)
+from .partitions import daily_partitions, ensure_partitions, is_partitioned, partition_name, prune
+from .pipeline import ingest_segments
+from .planning import allocate_budget, build_refresh_queue, call_allowance, window_allowance
+from .projection import project_schedules
+from .profiling import enforce_caps, issue_token
+from .provider_http import ProviderHttp, ReplayMiss
+from .providers import DuffelAdapter
+from .reconcile import (
+    ChangeSet,
+    SnapshotFileBatch,
+    flight_scope,
+    invalidate_caches,
+    reconcile_flights,
+    reconcile_sailings,
+    task_changes,
+)
+from .replay import Replayer, parse_log
+from .runstats import LATENCY_WINDOW, RunStats
+from .search import get_engine
+from .synthetic import NetworkSpec, generate_network, sample_queries
+from .topology import TopologyRegistry
+from .views import RouteViewSet
 
 class SearchRoutesTests(APITestCase):
     def test_search_routes_missing_params(self) -> None:
@@ -11,3 +74,1126 @@ class SearchRoutesTests(APITestCase):
         # It should return 404 Location not found if the locations don't exist
         response = self.client.get('/api/routes/search/?origin=JFK&destination=DOM&date=2026-07-01&filter=ferry')
         self.assertIn(response.status_code, [200, 404, 400])
+
+
+class SearchEngineTests(TestCase):
+    def test_sql_engine_returns_the_python_engines_connections(self) -> None:
+        air = Carrier.objects.create(code="WM", name="Winair")
+        boat = Carrier.objects.create(code="FRS", name="FRS", carrier_type="SEA")
+        jfk = Location.objects.create(code="JFK", name="JFK")
+        anu = Location.objects.create(code="ANU", name="ANU")
+        port = Location.objects.create(code="ANP", name="ANP", location_type="PRT", parent=anu)
+        dom = Location.objects.create(code="DOM", name="DOM")
+        day = timezone.localdate() + timedelta(days=10)
+
+        def flight(origin: Location, dep: str, arr: str, on: date = day) -> FlightInstance:
+            route = Route.objects.create(
+                origin=origin, destination=anu if origin == jfk else dom, carrier=air,
+                departure_time=time.fromisoformat(dep), arrival_time=time.fromisoformat(arr),
+            )
+            return FlightInstance.objects.create(route=route, date=on, available_seats=4)
+
+        def sailing(dep: str, on: date = day) -> Sailing:
+            route, _ = Route.objects.get_or_create(origin=port, destination=dom, carrier=boat)
+            return Sailing.objects.create(
+                route=route, date=on, departure_time=time.fromisoformat(dep), arrival_time=time(23, 0)
+            )
+
+        l1 = flight(jfk, "08:00", "14:00")
+        ok_flight = flight(anu, "16:00", "17:00")
+        flight(anu, "14:30", "15:30")  # 30 min: too short
+        sailing("15:00")  # 1 h: too short for a ferry
+        ok_ferry = sailing("17:00")
+        overnight = sailing("06:00", on=day + timedelta(days=1))
+
+        expected = {f"c_ff_{l1.id}_{ok_flight.id}", f"c_fs_{l1.id}_{ok_ferry.id}", f"c_fs_{l1.id}_{overnight.id}"}
+        self.assertEqual(refresh_connections([day, day + timedelta(days=1)]), 3)
+        for name in ("python", "sql", "materialized"):
+            result = get_engine(name)(["JFK"], ["DOM"], day).search()
+            self.assertEqual({it["id"] for it in result.results}, expected, name)
+            self.assertEqual(result.found_date, day)
+            overnight_leg = next(it for it in result.results if it["id"].endswith(f"_{overnight.id}"))
+            self.assertIn("Overnight Layover: 16h 0m", overnight_leg["legs"][0]["layover_text"])
+
+        # Incremental refresh: only the changed day's connections are rebuilt.
+        ok_ferry.delete()
+        self.assertEqual(refresh_connections([day]), 2)
+        result = get_engine("materialized")(["JFK"], ["DOM"], day).search()
+        self.assertNotIn(f"c_fs_{l1.id}_{ok_ferry.id}", {it["id"] for it in result.results})
+
+
+class NetworkSnapshotTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        snapshot.install(None)
+        self.addCleanup(snapshot.install, None)
+        self.start = timezone.localdate()
+        generate_network(NetworkSpec(groups=12, aliases=2, links=4, departures=3, days=6), self.start)
+
+    def test_snapshot_serves_the_same_searches_without_queries(self) -> None:
+        day = self.start + timedelta(days=1)
+        searches = [
+            (Location.objects.get(code=o).resolve_aliases(), Location.objects.get(code=d).resolve_aliases())
+            for o, d in (("Z000", "Z005"), ("Z003A", "Z001"), ("Z007B", "Z010"))
+        ]
+        expected = [get_engine("python")(o, d, day).search() for o, d in searches]
+        self.assertTrue(any(result.results for result in expected))
+
+        with self.settings(NETWORK_SNAPSHOT=True):
+            # Built off the request: the first search falls back to the leg cache.
+            with mock.patch.object(snapshot, "_start_rebuild") as start:
+                self.assertIsNone(snapshot.current())
+            start.assert_called_once()
+            self.assertIsNotNone(snapshot.refresh())
+            for (o, d), want in zip(searches, expected):
+                with self.assertNumQueries(0):
+                    result = get_engine("python")(o, d, day).search()
+                self.assertEqual(result, want)
+            # Past the snapshot's window the leg cache takes over.
+            late = get_engine("python")(["Z000"], ["Z005"], self.start + timedelta(days=40))
+            self.assertIsNone(late.snapshot)
+
+    def test_published_changes_swap_in_a_new_snapshot(self) -> None:
+        with self.settings(
+            NETWORK_SNAPSHOT=True, NETWORK_SNAPSHOT_CHECK_SECONDS=0, NETWORK_SNAPSHOT_MAX_AGE=0
+        ):
+            first = snapshot.refresh()
+            # Age alone does not make a worker rebuild its (inherited) copy.
+            self.assertIs(snapshot.current(), first)
+            flight = FlightInstance.objects.filter(available_seats__gt=0).select_related("route").first()
+            changes = ChangeSet(
+                deleted=[(flight.route_id, flight.date)],
+                routes={flight.route_id: (flight.route.origin.code, flight.route.destination.code)},
+            )
+            flight_id = flight.pk
+            flight.delete()
+            invalidate_caches(changes)
+
+            # The stale copy is never served; the rebuild runs off the request.
+            with mock.patch.object(snapshot, "_start_rebuild") as start:
+                self.assertIsNone(snapshot.current())
+            start.assert_called_once()
+            snapshot.refresh()
+            second = snapshot.current()
+            self.assertIsNot(second, first)
+            self.assertEqual(second.version, first.version + 1)
+            group = second.group_of(changes.routes[flight.route_id][0])
+            self.assertNotIn(flight_id, [leg.pk for leg in second.window("out", group, flight.date, flight.date)])
+
+    def test_master_preloads_while_the_shared_cache_is_down(self) -> None:
+        with self.settings(NETWORK_SNAPSHOT=True), mock.patch.object(
+            snapshot.shared_cache, "get", side_effect=ConnectionError("redis is down")
+        ), mock.patch.object(snapshot.gc, "freeze"):
+            snapshot.preload()
+            self.assertEqual(snapshot._snapshot.version, 0)
+
+
+class SnapshotFileTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        snapshot.install(None)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "network.pfsnap"
+        self.start = timezone.localdate()
+        self.spec = NetworkSpec(groups=12, aliases=2, links=4, departures=3, days=6, ferry_share=0.4)
+        generate_network(self.spec, self.start)
+
+    def test_mapped_engine_matches_the_python_engine_without_queries(self) -> None:
+        searches = [
+            (Location.objects.get(code=o).resolve_aliases(), Location.objects.get(code=d).resolve_aliases(), day)
+            for o, d, day in sample_queries(self.spec, self.start, 20)
+        ]
+        expected = [get_engine("python")(o, d, day).search() for o, d, day in searches]
+        self.assertTrue(any(result.results for result in expected))
+
+        with self.settings(NETWORK_SNAPSHOT_FILE=str(self.path)):
+            snapfile.write()
+            for (o, d, day), want in zip(searches, expected):
+                with self.assertNumQueries(0):
+                    engine = get_engine("mapped")(o, d, day)
+                    result = engine.search()
+                self.assertIsNotNone(engine.mapped)
+                self.assertEqual(result, want)
+            # Past the file's window the Python engine takes over.
+            self.assertIsNone(get_engine("mapped")(["Z000"], ["Z005"], self.start + timedelta(days=40)).mapped)
+
+    def test_ingest_run_swaps_the_file_on_the_next_request(self) -> None:
+        with self.settings(NETWORK_SNAPSHOT_FILE=str(self.path)):
+            snapfile.write()
+            first = snapfile.current()
+            self.assertIs(snapfile.current(), first)
+            flight = FlightInstance.objects.filter(available_seats__gt=0).select_related("route").first()
+            changes = ChangeSet(
+                deleted=[(flight.route_id, flight.date)],
+                routes={flight.route_id: (flight.route.origin.code, flight.route.destination.code)},
+            )
+            flight_id = flight.pk
+            flight.delete()
+            invalidate_caches(changes)
+            batch = SnapshotFileBatch(every=2, max_delay=3600)
+            batch.add(changes)
+            # Until the batch is written, responses are rebuilt off the old file.
+            self.assertIs(snapfile.current(), first)
+            origin = changes.routes[flight.route_id][0]
+            stale_key = leg_key("out", group_of(origin, location_groups()), flight.date)
+            cache.set(stale_key, ["off the old file"])
+            batch.flush()
+            self.assertIsNone(cache.get(stale_key))
+
+            second = snapfile.current()
+            self.assertIsNot(second, first)
+            self.assertEqual(second.generation, first.generation + 1)
+            out = second.window("out", second.group(changes.routes[flight.route_id][0]), flight.date, flight.date)
+            self.assertNotIn(flight_id, [second.leg_id[i] for i in out])
+            # Requests still holding the previous map keep reading it.
+            self.assertIn(flight_id, list(first.leg_id))
+            self.assertEqual([p.name for p in self.path.parent.iterdir()], [self.path.name])
+            # A busy worker whose queue never drains still writes every `every` change sets.
+            batch.add(changes)
+            batch.add(changes)
+            self.assertFalse(batch.pending)
+
+
+class LegCacheTests(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_searches_share_leg_sets_and_group_keyed_responses(self) -> None:
+        air = Carrier.objects.create(code="WM", name="Winair")
+        jfk = Location.objects.create(code="JFK", name="JFK")
+        anu = Location.objects.create(code="ANU", name="ANU")
+        dom = Location.objects.create(code="DOM", name="DOM")
+        Location.objects.create(code="DMROS", name="Roseau", location_type="PRT", parent=dom)
+        day = date(2026, 7, 1)
+        for dest in (anu, dom):
+            route = Route.objects.create(
+                origin=jfk, destination=dest, carrier=air, departure_time=time(8), arrival_time=time(14)
+            )
+            FlightInstance.objects.create(route=route, date=day, available_seats=4)
+
+        response = self.client.get("/api/routes/search/?origin=JFK&destination=DMROS&date=2026-07-01")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(len(cache.get(leg_key("out", "JFK", day))), 2)
+        self.assertIsNotNone(cache.get("prop_search_JFK_DOM_2026-07-01_all"))
+
+        # Another destination reuses JFK's cached departures: only the arrivals
+        # into ANU (flights, sailings) and the hub aliases (2) are queried.
+        with self.assertNumQueries(4):
+            result = get_engine("python")(["JFK"], ["ANU"], day).search()
+        self.assertEqual(len(result.results), 1)
+
+        changes = reconcile_flights(
+            FlightInstance.objects.filter(route__destination=anu),
+            [FlightInstance(route=Route.objects.get(destination=anu), date=day, available_seats=2)],
+        )
+        invalidate_caches(changes)
+        self.assertIsNone(cache.get(leg_key("out", "JFK", day)))
+        self.assertIsNone(cache.get(leg_key("in", "ANU", day)))
+
+
+@override_settings(QUERY_BUDGET_MODE="raise")
+class QueryBudgetTests(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        air = Carrier.objects.create(code="WM", name="Winair")
+        boat = Carrier.objects.create(code="FRS", name="FRS", carrier_type="SEA")
+        sxm = Location.objects.create(code="SXM", name="Princess Juliana")
+        dom = Location.objects.create(code="DOM", name="Douglas-Charles")
+        port = Location.objects.create(code="DMROS", name="Roseau", location_type="PRT", parent=dom)
+        day = date(2026, 7, 1)
+        # Enough rows per endpoint for a per-row lookup to show up as N+1.
+        for hub_code in ("ANU", "SKB", "EIS", "AXA", "SBH", "NEV"):
+            hub = Location.objects.create(code=hub_code, name=hub_code)
+            Location.objects.create(code=f"{hub_code}P", name=hub_code, location_type="PRT", parent=hub)
+            first = Route.objects.create(
+                origin=sxm, destination=hub, carrier=air, departure_time=time(8), arrival_time=time(9)
+            )
+            second = Route.objects.create(
+                origin=hub, destination=dom, carrier=air, departure_time=time(12), arrival_time=time(13)
+            )
+            FlightInstance.objects.create(route=first, date=day, available_seats=4)
+            FlightInstance.objects.create(route=second, date=day, available_seats=4)
+            ferry = Route.objects.create(origin=hub, destination=port, carrier=boat)
+            Sailing.objects.create(route=ferry, date=day, departure_time=time(14), arrival_time=time(16))
+
+    def test_endpoints_stay_within_their_query_budgets(self) -> None:
+        for url in (
+            "/api/locations/",
+            "/api/carriers/",
+            "/api/routes/",
+            "/api/sailings/",
+            "/api/reports/",
+            "/api/routes/available-dates/?origin=SXM&destination=DMROS",
+            "/api/routes/search/?origin=SXM&destination=DMROS&date=2026-07-01",
+            "/api/routes/search/?origin=SXM&destination=DOM&date=2026-07-01&engine=sql",
+        ):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_repeated_query_shapes_are_reported(self) -> None:
+        recorder = QueryRecorder()
+        recorder.statements = [
+            'SELECT * FROM "core_location" WHERE "parent_id" IN (%s, %s)',
+            'SELECT * FROM "core_location" WHERE "parent_id" IN (%s)',
+            'SELECT * FROM "core_route"',
+        ]
+        self.assertEqual(
+            recorder.repeated(2), [('SELECT * FROM "core_location" WHERE "parent_id" IN (...)', 2)]
+        )
+        with self.settings(QUERY_REPEAT_THRESHOLD=2), self.assertRaises(QueryBudgetExceeded):
+            # One location lookup per route: the pattern the middleware is there to catch.
+            with mock.patch.object(RouteViewSet, "queryset", Route.objects.all()):
+                self.client.get("/api/routes/")
+
+
+class RequestProfilingTests(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        Location.objects.create(code="SXM", name="Princess Juliana")
+        Location.objects.create(code="ANU", name="V.C. Bird")
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+
+    def test_signed_requests_store_a_profile_with_their_sql_timeline(self) -> None:
+        url = "/api/routes/search/?origin=SXM&destination=ANU&date=2026-07-01"
+        with self.settings(PROFILE_DIR=self.profile_dir.name):
+            # First, so that the search misses the cache and its SQL is on the timeline.
+            signed = self.client.get(url, HTTP_X_PROFILE_TOKEN=issue_token("/api/routes/"))
+            plain = self.client.get(url)
+            forged = self.client.get(url, HTTP_X_PROFILE_TOKEN=issue_token("/api/") + "x")
+            elsewhere = self.client.get(url, HTTP_X_PROFILE_TOKEN=issue_token("/api/locations/"))
+            anonymous = self.client.get(url + "&_profile=1")
+
+        for response in (plain, forged, elsewhere, anonymous):
+            self.assertNotIn("X-Profile-Id", response)
+        profile_id = signed["X-Profile-Id"]
+        with open(f"{self.profile_dir.name}/{profile_id}.json") as fh:
+            report = json.load(fh)
+        self.assertEqual((report["trigger"], report["status"], report["path"]), ("token", 200, "/api/routes/search/"))
+        self.assertTrue(any("core_location" in entry["sql"] for entry in report["sql"]))
+        self.assertTrue(report["top"])
+        self.assertTrue(os.path.exists(f"{self.profile_dir.name}/{profile_id}.pstats"))
+
+    def test_staff_param_and_storage_caps(self) -> None:
+        staff = User.objects.create_user("ops", password="x", is_staff=True)
+        self.client.force_login(staff)
+        with self.settings(PROFILE_DIR=self.profile_dir.name, PROFILE_MAX_FILES=2):
+            for _ in range(3):
+                self.assertIn("X-Profile-Id", self.client.get("/api/locations/?_profile=1"))
+            with self.settings(PROFILE_SAMPLE_RATE=0):
+                self.assertNotIn("X-Profile-Id", self.client.get("/api/locations/?_profile=1"))
+            self.assertEqual(len(os.listdir(self.profile_dir.name)), 4)
+            with self.settings(PROFILE_MAX_FILES=1):
+                self.assertEqual(enforce_caps(Path(self.profile_dir.name)), 1)
+
+
+class SyntheticNetworkTests(TestCase):
+    def test_generated_network_is_searchable_and_benchmarked(self) -> None:
+        spec = NetworkSpec(groups=8, aliases=2, links=3, departures=2, days=2, ferry_share=0.5)
+        start = timezone.localdate() + timedelta(days=1)
+        # Real codes start with Z too, and real cache entries must survive.
+        real = [
+            Location.objects.create(code="SXM", name="Princess Juliana"),
+            Location.objects.create(code="ZRH", name="Zurich"),
+        ]
+        cache.set("prop_search_SXM_ZRH_2026-07-01_all", {"results": []}, 300)
+        rows = generate_network(spec, start)
+
+        self.assertEqual(rows["routes"], 8 * 3 * 2)
+        self.assertEqual(FlightInstance.objects.count(), rows["flights"])
+        self.assertEqual(Sailing.objects.count(), rows["sailings"])
+        self.assertTrue(rows["flights"] and rows["sailings"])
+        self.assertEqual(Location.objects.get(code="Z003B").group_code, "Z003")
+        self.assertEqual(generate_network(spec, start), rows)
+
+        with tempfile.NamedTemporaryFile(suffix=".json") as report_file:
+            call_command(
+                "bench_network", "--scales", "groups=6,days=2", "--queries", "2",
+                "--warm-iterations", "1", "--output", report_file.name, stdout=io.StringIO(),
+            )
+            report = json.load(report_file)
+        (scale,) = report["scales"]
+        self.assertEqual(scale["spec"]["groups"], 6)
+        for endpoint in ("search", "available_dates"):
+            self.assertEqual(scale["endpoints"][endpoint]["cold"]["requests"], 2)
+            self.assertLessEqual(
+                scale["endpoints"][endpoint]["warm"]["mean_queries"],
+                scale["endpoints"][endpoint]["cold"]["mean_queries"],
+            )
+        self.assertEqual(list(Location.objects.order_by("code")), real)
+        self.assertEqual(cache.get("prop_search_SXM_ZRH_2026-07-01_all"), {"results": []})
+
+
+class AccessLogReplayTests(APITestCase):
+    LOG = [
+        '10.0.0.1 - - [19/Oct/2026:14:02:03 +0000] "GET /api/locations/ HTTP/1.1" 200 512 "-" "curl"\n',
+        '10.0.0.1 - - [19/Oct/2026:14:02:04 +0000] "POST /api/reports/ HTTP/1.1" 201 12 "-" "curl"\n',
+        '10.0.0.2 - - [19/Oct/2026:14:02:04 +0000] "GET /static/app.js HTTP/1.1" 200 12 "-" "curl"\n',
+        "not an access log line\n",
+        '10.0.0.2 - - [19/Oct/2026:14:02:04 +0000] "GET /api/locations/ HTTP/1.1" 200 512 "-" "curl"\n',
+        '10.0.0.3 - - [19/Oct/2026:14:02:05 +0000] "GET /api/routes/12/ HTTP/1.1" 404 23 "-" "curl"\n',
+    ]
+
+    def test_logged_api_reads_are_replayed_and_reported(self) -> None:
+        cache.clear()
+        Location.objects.create(code="SXM", name="Princess Juliana")
+        # What the replayer reads off a live instance.
+        self.assertEqual(self.client.get("/api/locations/")["X-Cache"], "MISS")
+        self.assertEqual(self.client.get("/api/locations/")["X-Cache"], "HIT")
+        self.assertNotIn("X-Cache", self.client.get("/api/routes/"))
+
+        logged = list(parse_log(self.LOG))
+        self.assertEqual([r.target for r in logged], ["/api/locations/", "/api/locations/", "/api/routes/12/"])
+        responses = {
+            "http://candidate/api/locations/": [
+                mock.Mock(status_code=200, headers={"X-Cache": "MISS"}),
+                mock.Mock(status_code=200, headers={"X-Cache": "HIT"}),
+            ],
+            "http://candidate/api/routes/12/": [mock.Mock(status_code=404, headers={})],
+        }
+        replayer = Replayer(
+            "http://candidate/", speed=0, concurrency=1, send=lambda method, url: responses[url].pop(0)
+        )
+        report = replayer.run(logged).as_dict()
+
+        self.assertEqual(report["requests"], 3)
+        self.assertEqual(report["statuses"], {"200": 2, "404": 1})
+        self.assertEqual((report["error_rate"], report["client_error_rate"]), (0.0, 0.3333))
+        self.assertEqual(report["endpoints"]["/api/locations/"]["cache_hit_ratio"], 0.5)
+        self.assertIsNone(report["endpoints"]["/api/routes/{id}/"]["cache_hit_ratio"])
+
+
+class SearchMetricsTests(APITestCase):
+    def test_search_exports_stage_timings_and_cache_results(self) -> None:
+        cache.clear()
+        Location.objects.create(code="SXM", name="Princess Juliana")
+        Location.objects.create(code="ANU", name="V.C. Bird")
+
+        def sample(name: str, **labels: str) -> float:
+            return REGISTRY.get_sample_value(name, labels) or 0
+
+        before = {
+            "miss": sample("prop_cache_requests_total", endpoint="search", result="miss"),
+            "hit": sample("prop_cache_requests_total", endpoint="search", result="hit"),
+            "direct": sample("prop_search_stage_seconds_count", stage="direct", engine="python"),
+        }
+        url = "/api/routes/search/?origin=SXM&destination=ANU&date=2026-07-01&engine=python"
+        self.client.get(url)
+        self.client.get(url)
+
+        self.assertEqual(sample("prop_cache_requests_total", endpoint="search", result="miss"), before["miss"] + 1)
+        self.assertEqual(sample("prop_cache_requests_total", endpoint="search", result="hit"), before["hit"] + 1)
+        self.assertEqual(
+            sample("prop_search_stage_seconds_count", stage="direct", engine="python"), before["direct"] + 1
+        )
+
+
+class TieredCacheTests(SimpleTestCase):
+    def test_local_layer_is_size_bounded_and_coherent_across_processes(self) -> None:
+        lru = LocalLRU(max_bytes=400, ttl=30)
+        for i in range(10):
+            lru.set(f"k{i}", "x" * 100)
+        self.assertLessEqual(lru.bytes, 400)
+        self.assertGreater(lru.evictions, 0)
+        self.assertIsNotNone(lru.get("k9"))
+
+        shared = LocMemCache("tiered-test", {})
+        worker_a, worker_b = TieredCache(shared), TieredCache(shared)
+        worker_a.check_interval = worker_b.check_interval = 0
+        worker_a.set("prop_search_x", {"results": [1]}, 300)
+        self.assertEqual(worker_b.get("prop_search_x"), {"results": [1]})
+
+        # Served locally: the shared copy is no longer consulted.
+        shared.set("prop_search_x", {"results": [2]}, 300)
+        self.assertEqual(worker_b.get("prop_search_x"), {"results": [1]})
+
+        worker_a.set("prop_locations_list", ["ANU"], 300)
+        self.assertEqual(worker_b.get("prop_locations_list"), ["ANU"])
+        shared.set("prop_locations_list", ["ANU", "DOM"], 300)
+
+        worker_a.delete_many(["prop_search_x"])
+        self.assertIsNone(worker_b.get("prop_search_x"))
+        # Only the invalidated keys leave the other workers' local layers.
+        self.assertEqual(worker_b.get("prop_locations_list"), ["ANU"])
+
+        # Without the log entry a worker cannot tell what went stale.
+        worker_a.delete_many(["prop_search_y"])
+        shared.delete(INVALIDATION_KEY.format(shared.get(GENERATION_KEY)))
+        self.assertEqual(worker_b.get("prop_locations_list"), ["ANU", "DOM"])
+
+    def test_codec_compresses_large_values_only(self) -> None:
+        codec = CacheCodec("orjson", compress_min_bytes=256)
+        small = {"results": [{"id": "WM1"}]}
+        large = {"results": [{"id": f"WM{i}", "carrier": "Winair", "origin": "SXM"} for i in range(50)]}
+        self.assertEqual(codec.encode(small)[:2], RAW_JSON)
+        stored = codec.encode(large)
+        self.assertEqual(stored[:2], ZLIB_JSON)
+        self.assertLess(len(stored) * 4, len(codec.dumps(large)))
+        self.assertEqual(codec.decode(stored), large)
+        # Not JSON-representable: stored untouched, as before the codec.
+        self.assertEqual(codec.decode(codec.encode({date(2026, 7, 1)})), {date(2026, 7, 1)})
+
+        shared = LocMemCache("codec-test", {})
+        writer, reader = TieredCache(shared, codec), TieredCache(shared, codec)
+        writer.set("prop_search_y", large, 300)
+        self.assertIsInstance(shared.get("prop_search_y"), bytes)
+        self.assertEqual(reader.get("prop_search_y"), large)
+        # The local layer is charged what the decoded value weighs, not the zlib stream.
+        raw_size = len(codec.dumps(large))
+        self.assertEqual(writer.local.bytes, raw_size)
+        self.assertEqual(reader.local.bytes, raw_size)
+
+
+class ReconcileTests(TestCase):
+    def setUp(self) -> None:
+        carrier = Carrier.objects.create(code="WM", name="Winair")
+        sxm = Location.objects.create(code="SXM", name="Princess Juliana")
+        dom = Location.objects.create(code="DOM", name="Douglas-Charles")
+        self.route = Route.objects.create(
+            origin=sxm, destination=dom, carrier=carrier, departure_time="16:30"
+        )
+        self.day = date(2026, 7, 1)
+
+    def flight(self, day: date, price: str) -> FlightInstance:
+        return FlightInstance(
+            route=self.route, date=day, price_amount=price, currency="USD",
+            available_seats=9, cabin_class="economy",
+        )
+
+    def test_reconcile_flights_applies_only_the_diff(self) -> None:
+        kept = FlightInstance.objects.create(
+            route=self.route, date=self.day, price_amount="120.00",
+            currency="USD", available_seats=9, cabin_class="economy",
+        )
+        FlightInstance.objects.create(
+            route=self.route, date=self.day + timedelta(days=1), price_amount="99.00",
+            available_seats=9,
+        )
+
+        changes = reconcile_flights(
+            FlightInstance.objects.all(),
+            [self.flight(self.day, "120.00"), self.flight(self.day + timedelta(days=2), "80.00")],
+        )
+
+        self.assertEqual(changes.unchanged, 1)
+        self.assertEqual(changes.inserted, [(self.route.pk, self.day + timedelta(days=2))])
+        self.assertEqual(changes.deleted, [(self.route.pk, self.day + timedelta(days=1))])
+        self.assertEqual(changes.affected_pairs, {("SXM", "DOM")})
+        self.assertTrue(FlightInstance.objects.filter(pk=kept.pk).exists())
+
+        changes = reconcile_flights(
+            FlightInstance.objects.filter(date=self.day), [self.flight(self.day, "150")]
+        )
+        self.assertEqual(changes.updated, [(self.route.pk, self.day)])
+        self.assertEqual(FlightInstance.objects.get(pk=kept.pk).price_amount, Decimal("150"))
+
+    def test_reconcile_sailings_is_a_no_op_when_nothing_changed(self) -> None:
+        Sailing.objects.create(
+            route=self.route, date=self.day, departure_time="08:00",
+            arrival_time="10:15", duration_minutes=135, price_text="à partir de 89€",
+        )
+        fresh = Sailing(
+            route=self.route, date=self.day, departure_time="08:00",
+            arrival_time="10:15", duration_minutes=135, price_text="à partir de 89€",
+        )
+
+        changes = reconcile_sailings(Sailing.objects.all(), [fresh])
+
+        self.assertFalse(changes)
+        self.assertEqual(changes.unchanged, 1)
+
+    def test_ferry_scrape_only_reconciles_the_routes_and_days_it_read(self) -> None:
+        from .management.commands.scrape_ferries import Command as FerryCommand, ScrapedSailing
+
+        ferries = FerryCommand(stdout=io.StringIO())
+        ferries.bootstrap_locations()
+        day = timezone.localdate() + timedelta(days=2)
+        unreached = ferries.ferry_route("MQFDF", "DMROS")
+        kept = Sailing.objects.create(
+            route=unreached, date=day, departure_time="08:00",
+            arrival_time="10:15", duration_minutes=135, price_text="89€",
+        )
+        read = ferries.ferry_route("GPPTP", "DMROS")
+        unread_day = Sailing.objects.create(
+            route=read, date=day + timedelta(days=30), departure_time="08:00",
+            arrival_time="10:15", duration_minutes=135, price_text="89€",
+        )
+
+        def scrape(origin: str, dest: str, start: date, http: ProviderHttp) -> tuple[list[ScrapedSailing], set[date]]:
+            if (origin, dest) == ("MQFDF", "DMROS"):
+                raise ConnectionError("FRS is down")
+            if (origin, dest) == ("GPPTP", "DMROS"):
+                return [ScrapedSailing(day, "09:00", "11:00", 120, "79€")], {day}
+            return [], set()
+
+        with mock.patch.object(FerryCommand, "scrape_route", side_effect=scrape):
+            call_command("scrape_ferries", "--workers", "1", stdout=io.StringIO())
+
+        self.assertEqual(Sailing.objects.filter(pk__in=[kept.pk, unread_day.pk]).count(), 2)
+        self.assertTrue(Sailing.objects.filter(route=read, date=day, departure_time="09:00").exists())
+
+
+class ProviderHttpTests(SimpleTestCase):
+    def test_record_then_replay_without_network(self) -> None:
+        live = mock.Mock(status_code=200, headers={"Content-Type": "application/json"}, content=b'{"data": {"offers": []}}')
+        payload = {"data": {"slices": [{"origin": "ANU", "destination": "DOM"}]}}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            session = mock.Mock(request=mock.Mock(return_value=live))
+            recorder = ProviderHttp("duffel", mode="record", cache_dir=cache_dir, session=session)
+            recorder.post("https://api.duffel.com/air/offer_requests", json=payload)
+
+            offline = mock.Mock(request=mock.Mock(side_effect=AssertionError("network used")))
+            replayer = ProviderHttp("duffel", mode="replay", cache_dir=cache_dir, session=offline)
+            res = replayer.post("https://api.duffel.com/air/offer_requests", json=payload)
+
+            self.assertEqual(res.json(), {"data": {"offers": []}})
+            with self.assertRaises(ReplayMiss):
+                replayer.post("https://api.duffel.com/air/offer_requests", json={"other": 1})
+
+    def test_amadeus_replay_is_network_free_and_never_stores_tokens(self) -> None:
+        token = UrllibRequest(
+            "https://test.api.amadeus.com/v1/security/oauth2/token",
+            data=b"grant_type=client_credentials&client_id=id&client_secret=secret",
+        )
+        search = UrllibRequest("https://test.api.amadeus.com/v2/shopping/flight-offers?originLocationCode=SXM")
+        live_token = mock.Mock(status=200, getheaders=mock.Mock(return_value=[]))
+        live_token.read.return_value = b'{"access_token": "real", "expires_in": 1799}'
+        offers = mock.Mock(status=200, getheaders=mock.Mock(return_value=[("Content-Type", "application/json")]))
+        offers.read.return_value = b'{"data": []}'
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # A cache miss trades the synthetic token for a real one first.
+            transport = ProviderHttp("amadeus", mode="cache", cache_dir=cache_dir).amadeus_transport()
+            with mock.patch("core.provider_http.urlopen", side_effect=[live_token, offers]) as urlopen:
+                issued = json.loads(transport(token).read())
+                search.add_header("Authorization", f"Bearer {issued['access_token']}")
+                self.assertEqual(transport(search).read(), b'{"data": []}')
+            self.assertEqual(urlopen.call_args_list[0].args, (token,))
+            self.assertEqual(search.get_header("Authorization"), "Bearer real")
+
+            transport = ProviderHttp("amadeus", mode="replay", cache_dir=cache_dir).amadeus_transport()
+            with mock.patch("core.provider_http.urlopen", side_effect=AssertionError("network used")):
+                self.assertEqual(json.loads(transport(token).read())["token_type"], "Bearer")
+                self.assertEqual(transport(search).read(), b'{"data": []}')
+            self.assertEqual(len(list(Path(cache_dir).rglob("*.json"))), 1)
+
+
+class IngestRunMetricsTests(TestCase):
+    def test_run_metrics_are_stored_and_exported(self) -> None:
+        limited = mock.Mock(status_code=429)
+        answered = mock.Mock(status_code=200)
+        answered.json.return_value = {"data": {"offers": [SegmentPipelineTests.offer("120.00")]}}
+        session = mock.Mock(request=mock.Mock(side_effect=[limited, answered]))
+        http = ProviderHttp("duffel", mode="live", session=session)
+        adapter = DuffelAdapter(http)
+        stats = RunStats()
+        http.run_stats = stats
+        day = date(2026, 7, 1)
+
+        with self.settings(INGEST_TRACE_MEMORY=True):
+            stats.start()
+        with mock.patch("core.providers.duffel.time.sleep"):
+            ingest_segments("SXM", "DOM", day, adapter.segments("SXM", "DOM", day), stats=stats)
+        run = IngestRun.objects.create(command="fetch_duffel_routes")
+        with tempfile.TemporaryDirectory() as textfile_dir:
+            with self.settings(INGEST_METRICS_TEXTFILE_DIR=textfile_dir):
+                # A daemon's checkpoint saves the metrics but leaves the run open.
+                stats.checkpoint(run, 1)
+                run.refresh_from_db()
+                self.assertEqual((run.api_calls, run.metrics["requests"]), (1, 2))
+                self.assertIsNone(run.finished_at)
+                metrics = stats.close(run, adapter.api_calls, retries=adapter.retries)
+            with open(f"{textfile_dir}/prop_ingest_fetch_duffel_routes.prom") as fh:
+                textfile = fh.read()
+
+        self.assertEqual((metrics["requests"], metrics["rate_limited"], metrics["retries"]), (2, 1, 1))
+        self.assertEqual(metrics["rows"]["inserted"], 1)
+        self.assertIsNotNone(metrics["latency_ms"]["p99"])
+        self.assertIsNotNone(metrics["peak_memory_kb"])
+        run.refresh_from_db()
+        self.assertEqual((run.api_calls, run.metrics), (2, metrics))
+        self.assertIsNotNone(run.finished_at)
+        self.assertIn('prop_ingest_rows{change="inserted",command="fetch_duffel_routes"} 1.0', textfile)
+
+    @skipUnless(find_spec("amadeus"), "the Amadeus SDK is an optional dependency")
+    def test_amadeus_rate_limits_are_retried_and_counted(self) -> None:
+        from amadeus import ResponseError
+
+        from .providers.amadeus import AmadeusAdapter
+
+        limited = ResponseError(mock.Mock(status_code=429, result=None, body="", parsed=False, request=None))
+        adapter = AmadeusAdapter(ProviderHttp("amadeus", mode="live"))
+        search = mock.Mock(side_effect=[limited, limited, mock.Mock(data=[])])
+        adapter._client = mock.Mock()
+        adapter._client.shopping.flight_offers_search.get = search
+
+        with mock.patch("core.providers.amadeus.time.sleep"):
+            self.assertEqual(list(adapter.segments("SXM", "DOM", date(2026, 7, 1))), [])
+        self.assertEqual((adapter.api_calls, adapter.retries), (3, 2))
+
+    def test_latencies_are_bounded_and_memory_is_not_traced_by_default(self) -> None:
+        stats = RunStats()
+        stats.start()
+        self.assertFalse(stats.tracing)
+        for _ in range(LATENCY_WINDOW + 10):
+            stats.observe_request(0.1, 200)
+        self.assertEqual(len(stats.latencies), LATENCY_WINDOW)
+        metrics = stats.summary()
+        self.assertEqual((metrics["requests"], metrics["peak_memory_kb"]), (LATENCY_WINDOW + 10, None))
+
+
+class FerryParserTests(SimpleTestCase):
+    PAGE = """
+    <html><body>
+      <div>DATE DEPART : 12 Juil.</div>
+      <button><p>12 juil.</p><p>Mer</p><p>à partir de 79 €</p></button>
+      <button><p>13 juil.</p><p>Jeu</p><p>Complet</p></button>
+      <div><div><time>08:00</time><time>10:15</time></div><span>Durée du voyage 2h15</span></div>
+    </body></html>
+    """
+
+    def test_parse_page_extracts_header_week_and_sailings(self) -> None:
+        for parser in ("html.parser", "lxml"):
+            page = parse_page(self.PAGE, parser)
+            self.assertEqual(page.header_date, parse_french_date("12 juil"))
+            self.assertEqual(len(page.week_prices), 1)
+            self.assertEqual(page.week_prices[0][1], "à partir de 79 €")
+            self.assertEqual([tuple(s) for s in page.sailings], [("08:00", "10:15", 135)])
+
+    def test_parse_french_date_prefers_longest_month_prefix(self) -> None:
+        self.assertEqual(parse_french_date("DATE DEPART : 3 juil.").month, 7)
+        self.assertEqual(parse_french_date("3 déc").month, 12)
+        self.assertIsNone(parse_french_date("pas de date"))
+
+
+class RefreshPlanningTests(TestCase):
+    def setUp(self) -> None:
+        # The planner reads the cached alias group map (core/legs.py).
+        cache.clear()
+
+    def test_queue_prefers_unseen_near_and_searched_pairs(self) -> None:
+        carrier = Carrier.objects.create(code="WM", name="Winair")
+        codes = {c: Location.objects.create(code=c, name=c) for c in ("ANU", "DOM", "SXM", "BGI")}
+        for origin in ("ANU", "SXM", "BGI"):
+            Route.objects.create(origin=codes[origin], destination=codes["DOM"], carrier=carrier)
+        today = timezone.localdate()
+        tomorrow, later = today + timedelta(days=1), today + timedelta(days=3)
+        # ANU->DOM tomorrow was fetched just now, so it is not worth a call.
+        FlightInstance.objects.create(
+            route=Route.objects.get(origin__code="ANU"), date=tomorrow, available_seats=9
+        )
+        SearchDemand.record("SXM", "JFK")
+
+        queue = build_refresh_queue(
+            [("ANU", "DOM"), ("SXM", "DOM"), ("BGI", "DOM")], [tomorrow, later]
+        )
+        ordered = [heapq.heappop(queue) for _ in range(len(queue))]
+
+        self.assertNotIn(("ANU", tomorrow), [(t.origin, t.date) for t in ordered])
+        self.assertEqual((ordered[0].origin, ordered[0].date), ("SXM", tomorrow))
+        self.assertEqual(ordered[-1].date, later)
+
+    def test_metro_pairs_see_the_rows_of_their_airports(self) -> None:
+        carrier = Carrier.objects.create(code="B6", name="JetBlue")
+        nyc = Location.objects.create(code="NYC", name="New York")
+        jfk = Location.objects.create(code="JFK", name="John F. Kennedy", parent=nyc)
+        dom = Location.objects.create(code="DOM", name="Douglas-Charles")
+        route = Route.objects.create(origin=jfk, destination=dom, carrier=carrier)
+        tomorrow, later = timezone.localdate() + timedelta(days=1), timezone.localdate() + timedelta(days=2)
+        FlightInstance.objects.create(route=route, date=tomorrow, available_seats=9)
+
+        queue = build_refresh_queue([("NYC", "DOM")], [tomorrow, later])
+
+        self.assertEqual([t.date for t in queue], [later])
+
+
+class CallBudgetTests(TestCase):
+    def test_budget_goes_to_volatile_pairs_and_respects_the_daily_cap(self) -> None:
+        carrier = Carrier.objects.create(code="WM", name="Winair")
+        codes = {c: Location.objects.create(code=c, name=c) for c in ("ANU", "DOM", "SXM")}
+        for origin in ("ANU", "SXM"):
+            Route.objects.create(origin=codes[origin], destination=codes["DOM"], carrier=carrier)
+        tomorrow = timezone.localdate() + timedelta(days=1)
+
+        run = IngestRun.objects.create(command="fetch_duffel_routes", provider="duffel")
+        # Another provider's calls do not touch Duffel's budget.
+        IngestRun.objects.create(command="fetch_routes", provider="amadeus", api_calls=100)
+        for changed in (0, 0, 0, 0):
+            run.record("ANU", "DOM", tomorrow, 1, changed)
+        for changed in (3, 1, 2, 5):
+            run.record("SXM", "DOM", tomorrow, 1, changed)
+
+        queue = build_refresh_queue([("ANU", "DOM"), ("SXM", "DOM")], [tomorrow])
+        [task] = allocate_budget(queue, 1)
+        self.assertEqual(task.origin, "SXM")
+        self.assertGreater(task.volatility, 0.5)
+
+        self.assertEqual(call_allowance("duffel", None, None), None)
+        self.assertEqual(call_allowance("duffel", 10, 20), 10)
+        self.assertEqual(call_allowance("duffel", 10, 12), 4)
+        self.assertEqual(call_allowance("duffel", None, 5), 0)
+        self.assertEqual(call_allowance("amadeus", None, 120), 20)
+
+        # A daemon started yesterday is charged for what it spent today.
+        daemon = IngestRun.objects.create(command="run_fetch_worker", provider="duffel")
+        IngestRun.objects.filter(pk=daemon.pk).update(started_at=timezone.now() - timedelta(days=1))
+        daemon.record("BGI", "DOM", tomorrow, 3, 0)
+        self.assertEqual(call_allowance("duffel", None, 12), 1)
+        # The scheduler's rolling window is charged from the same records.
+        self.assertEqual(window_allowance("duffel", 70, timedelta(hours=24)), 59)
+        self.assertEqual(window_allowance("duffel", 70, timedelta(hours=48)), 59)
+
+
+class IngestCheckpointTests(TestCase):
+    def test_interrupted_run_resumes_with_unfinished_tasks(self) -> None:
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        run = IngestRun.objects.create(command="fetch_duffel_routes", budget=10)
+        run.plan([("ANU", "DOM", tomorrow), ("BGI", "DOM", tomorrow), ("PTP", "DOM", tomorrow)])
+        run.record("ANU", "DOM", tomorrow, 1, 2, duration_ms=120)
+        run.record("BGI", "DOM", tomorrow, 2, 0, status="failed")
+
+        # The process dies here: the run never reaches finish().
+        self.assertEqual(IngestRun.resumable("fetch_duffel_routes"), run)
+        self.assertIsNone(IngestRun.resumable("fetch_routes"))
+        self.assertEqual(
+            [(t.origin, t.status) for t in run.unfinished_tasks()],
+            [("BGI", "failed"), ("PTP", "pending")],
+        )
+        self.assertEqual(IngestRun.objects.get(pk=run.pk).api_calls, 3)
+
+        run.record("BGI", "DOM", tomorrow, 1, 1)
+        run.record("PTP", "DOM", tomorrow, 1, 0)
+        run.finish()
+        self.assertFalse(run.unfinished_tasks().exists())
+        self.assertEqual(run.tasks.count(), 3)
+        self.assertIsNone(IngestRun.resumable("fetch_duffel_routes"))
+        self.assertIsNotNone(run.duration)
+
+    def test_resumed_run_covers_rows_written_before_the_interruption(self) -> None:
+        carrier = Carrier.objects.create(code="WM", name="Winair")
+        nyc = Location.objects.create(code="NYC", name="New York")
+        jfk = Location.objects.create(code="JFK", name="JFK", parent=nyc)
+        dom = Location.objects.create(code="DOM", name="DOM")
+        route = Route.objects.create(origin=jfk, destination=dom, carrier=carrier)
+        Route.objects.create(origin=dom, destination=jfk, carrier=carrier)
+        tomorrow = timezone.localdate() + timedelta(days=1)
+
+        changes = task_changes([("NYC", "DOM", tomorrow)])
+        self.assertEqual(changes.updated, [(route.pk, tomorrow)])
+        self.assertEqual(changes.affected_pairs, {("JFK", "DOM")})
+        self.assertFalse(task_changes([]))
+
+
+class PartitionTests(TestCase):
+    def test_prune_falls_back_to_delete_on_unpartitioned_tables(self) -> None:
+        carrier = Carrier.objects.create(code="WM", name="Winair")
+        anu = Location.objects.create(code="ANU", name="ANU")
+        dom = Location.objects.create(code="DOM", name="DOM")
+        route = Route.objects.create(origin=anu, destination=dom, carrier=carrier)
+        today = timezone.localdate()
+        for offset in (-2, -1, 0, 1):
+            FlightInstance.objects.create(route=route, date=today + timedelta(days=offset))
+
+        self.assertFalse(is_partitioned(FlightInstance))
+        self.assertEqual(ensure_partitions(FlightInstance, today, today + timedelta(days=7)), 0)
+        self.assertEqual(prune(FlightInstance, today), 2)
+        self.assertEqual(
+            sorted(FlightInstance.objects.values_list("date", flat=True)),
+            [today, today + timedelta(days=1)],
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "departure tables are only partitioned on PostgreSQL")
+class PostgresPartitionTests(TransactionTestCase):
+    # Outside a test transaction, like the ingesters calling prune().
+    def test_partitions_are_created_ahead_and_past_ones_dropped(self) -> None:
+        carrier = Carrier.objects.create(code="WM", name="Winair")
+        anu = Location.objects.create(code="ANU", name="ANU")
+        dom = Location.objects.create(code="DOM", name="DOM")
+        route = Route.objects.create(origin=anu, destination=dom, carrier=carrier)
+        today = timezone.localdate()
+        table = FlightInstance._meta.db_table
+        self.assertTrue(is_partitioned(FlightInstance))
+
+        # Rows of days without a partition wait in the default one until
+        # ensure_partitions moves them into their own.
+        for offset in (-2, -1, 0, 1, 3):
+            FlightInstance.objects.create(route=route, date=today + timedelta(days=offset))
+        ensure_partitions(FlightInstance, today - timedelta(days=2), today + timedelta(days=3))
+        self.assertEqual(ensure_partitions(FlightInstance, today, today + timedelta(days=3)), 0)
+        later = today + timedelta(days=3)
+        self.assertEqual(daily_partitions(FlightInstance)[later], partition_name(table, later))
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table}_default")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+        self.assertEqual(prune(FlightInstance, today), 2)
+        self.assertFalse(any(day < today for day in daily_partitions(FlightInstance)))
+        self.assertEqual(
+            sorted(FlightInstance.objects.values_list("date", flat=True)),
+            [today, today + timedelta(days=1), today + timedelta(days=3)],
+        )
+        with connection.cursor() as cursor:
+            dropped = partition_name(table, today - timedelta(days=1))
+            cursor.execute("SELECT 1 FROM pg_class WHERE relname = %s", [dropped])
+            self.assertIsNone(cursor.fetchone())
+
+
+class TopologyRegistryTests(TestCase):
+    def test_edges_are_reused_until_ttl_or_empty_streak(self) -> None:
+        probes: list[tuple[str, str]] = []
+
+        def probe(origin: str, dest: str, found: bool) -> bool:
+            probes.append((origin, dest))
+            return found
+
+        registry = TopologyRegistry("duffel", empty_limit=2)
+        self.assertTrue(registry.check("NYC", "DOM", lambda: probe("NYC", "DOM", True)))
+        self.assertFalse(registry.check("LON", "DOM", lambda: probe("LON", "DOM", False)))
+
+        # A later run serves both answers from the registry.
+        registry = TopologyRegistry("duffel", empty_limit=2)
+        self.assertTrue(registry.check("NYC", "DOM", lambda: probe("NYC", "DOM", True)))
+        self.assertFalse(registry.check("LON", "DOM", lambda: probe("LON", "DOM", True)))
+        self.assertEqual(probes, [("NYC", "DOM"), ("LON", "DOM")])
+
+        # Two empty sweep days in a row make NYC->DOM due again.
+        registry.record("NYC", "DOM", False)
+        registry.record("NYC", "DOM", False)
+        self.assertTrue(registry.is_due("NYC", "DOM"))
+        self.assertFalse(registry.check("NYC", "DOM", lambda: probe("NYC", "DOM", False)))
+
+        # Past the TTL every edge is probed again, and a failed probe changes nothing.
+        later = timezone.now() + timedelta(days=8)
+        self.assertTrue(registry.is_due("LON", "DOM", now=later))
+        registry = TopologyRegistry("duffel", ttl=timedelta(seconds=0))
+        self.assertFalse(registry.check("LON", "DOM", lambda: None))
+        self.assertEqual(len(probes), 3)
+
+    def test_return_legs_mirror_their_probed_edge(self) -> None:
+        registry = TopologyRegistry("duffel", empty_limit=2)
+        registry.check("NYC", "DOM", lambda: True)
+        registry.mirror("NYC", "DOM")
+        registry.check("LON", "DOM", lambda: False)
+        registry.mirror("LON", "DOM")
+        self.assertTrue(registry.is_active("DOM", "NYC"))
+        self.assertNotIn(("DOM", "LON"), registry.edges)
+
+        # Empty sweeps of the return leg make the probed direction due again.
+        registry = TopologyRegistry("duffel", empty_limit=2)
+        self.assertFalse(registry.is_due("NYC", "DOM"))
+        registry.record("DOM", "NYC", False)
+        registry.record("DOM", "NYC", False)
+        self.assertTrue(registry.is_due("NYC", "DOM"))
+        registry.check("NYC", "DOM", lambda: False)
+        registry.mirror("NYC", "DOM")
+        self.assertFalse(registry.is_active("DOM", "NYC"))
+
+
+class SegmentPipelineTests(TestCase):
+    @staticmethod
+    def offer(price: str, departing_at: str = "2026-07-01T16:30:00") -> dict:
+        segment = {
+            "operating_carrier": {"iata_code": "WM", "name": "Winair"},
+            "operating_carrier_flight_number": "601",
+            "origin": {"iata_code": "SXM"},
+            "destination": {"iata_code": "DOM"},
+            "departing_at": departing_at,
+            "arriving_at": "2026-07-01T17:35:00",
+            "duration": "PT1H5M",
+            "passengers": [{"cabin_class": "economy"}],
+        }
+        return {"total_amount": price, "total_currency": "USD", "slices": [{"segments": [segment]}]}
+
+    def test_offers_collapse_to_the_cheapest_flight_with_one_write_path(self) -> None:
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {
+            "data": {
+                "offers": [
+                    self.offer("180.00"),
+                    self.offer("120.00"),
+                    self.offer("-5"),
+                    self.offer("99.00", departing_at="2026-07-01Tbroken"),
+                ]
+            }
+        }
+        http = mock.Mock(mode="replay")
+        http.post.return_value = response
+        adapter = DuffelAdapter(http)
+        day = date(2026, 7, 1)
+
+        changes, found = ingest_segments("SXM", "DOM", day, adapter.segments("SXM", "DOM", day))
+
+        self.assertEqual((found, len(changes.inserted), adapter.api_calls), (1, 1, 1))
+        flight = FlightInstance.objects.select_related("route").get()
+        self.assertEqual(flight.price_amount, Decimal("120.00"))
+        self.assertEqual(flight.route.days_of_operation, "3")
+        self.assertEqual(flight.route.duration_minutes, 65)
+        self.assertIsNotNone(flight.route.last_confirmed_at)
+
+    def test_retimed_route_marks_its_upcoming_flights_changed(self) -> None:
+        def ingest(day: date, arriving: str) -> ChangeSet:
+            offer = self.offer("120.00", departing_at=f"{day}T16:30:00")
+            offer["slices"][0]["segments"][0]["arriving_at"] = f"{day}T{arriving}"
+            response = mock.Mock(status_code=200)
+            response.json.return_value = {"data": {"offers": [offer]}}
+            http = mock.Mock(mode="replay")
+            http.post.return_value = response
+            adapter = DuffelAdapter(http)
+            changes, _ = ingest_segments("SXM", "DOM", day, adapter.segments("SXM", "DOM", day))
+            return changes
+
+        soon = timezone.localdate() + timedelta(days=7)
+        later = soon + timedelta(days=7)
+        ingest(later, "17:35:00")
+        self.assertEqual(ingest(soon, "17:35:00").affected_dates, {soon})
+
+        # Same fares, new arrival time: the later flight's connections are stale too.
+        changes = ingest(soon, "17:50:00")
+        route = Route.objects.get()
+        self.assertEqual(route.arrival_time, time(17, 50))
+        self.assertEqual(changes.updated, [(route.pk, soon), (route.pk, later)])
+        self.assertEqual(changes.affected_pairs, {("SXM", "DOM")})
+
+
+class FareHistoryTests(APITestCase):
+    def test_only_fare_changes_are_appended_and_old_history_is_downsampled(self) -> None:
+        day = date(2026, 7, 1)
+        for price in ("120.00", "120.00", "150.00"):
+            response = mock.Mock(status_code=200)
+            response.json.return_value = {
+                "data": {"offers": [SegmentPipelineTests.offer(price)]}
+            }
+            http = mock.Mock(mode="replay")
+            http.post.return_value = response
+            adapter = DuffelAdapter(http)
+            ingest_segments("SXM", "DOM", day, adapter.segments("SXM", "DOM", day))
+
+        self.assertEqual(
+            list(FareObservation.objects.order_by("observed_at").values_list("price_amount", flat=True)),
+            [Decimal("120.00"), Decimal("150.00")],
+        )
+        self.assertEqual(cheapest_per_day(["SXM"], ["DOM"], day, day), {day: Decimal("120.00")})
+
+        response = self.client.get(
+            "/api/routes/price-history/",
+            {"origin": "SXM", "destination": "DOM", "start": "2026-07-01", "date": "2026-07-01"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["cheapest_by_day"], [{"date": "2026-07-01", "price_amount": "120.00"}])
+        self.assertEqual([obs["price_amount"] for obs in response.data["trend"]], ["120.00", "150.00"])
+
+        self.assertEqual(downsample(timezone.now() + timedelta(minutes=1)), 1)
+        self.assertEqual(FareObservation.objects.get().price_amount, Decimal("150.00"))
+        # The surviving row is still the one the next fetch is compared with.
+        flight = FlightInstance.objects.get(date=day)
+        self.assertEqual(record_observations([flight]), 0)
+        flight.price_amount = Decimal("130.00")
+        self.assertEqual(record_observations([flight]), 1)
+
+
+class ScheduleProjectionTests(TestCase):
+    def test_projection_follows_weekly_pattern_and_yields_to_real_rows(self) -> None:
+        carrier = Carrier.objects.create(code="WM", name="Winair")
+        sxm = Location.objects.create(code="SXM", name="Princess Juliana")
+        dom = Location.objects.create(code="DOM", name="Douglas-Charles")
+        today = date(2026, 7, 6)  # a Monday
+        route = Route.objects.create(
+            origin=sxm, destination=dom, carrier=carrier, departure_time="16:30",
+            days_of_operation="15", last_confirmed_at=timezone.now(),
+            valid_until=today + timedelta(days=20),
+        )
+        FlightInstance.objects.create(route=route, date=today, available_seats=9)
+        # The sweep asked about next Monday and got no flight: it was cancelled.
+        run = IngestRun.objects.create(command="fetch_duffel_routes")
+        IngestTask.objects.create(run=run, origin="SXM", destination="DOM", date=today + timedelta(days=7), status="done")
+        # Never learned from offers: the model default says nothing.
+        Route.objects.create(origin=dom, destination=sxm, carrier=carrier, last_confirmed_at=timezone.now())
+
+        changes = project_schedules(today=today, horizon_days=42, validity_days=400)
+
+        projected = list(
+            FlightInstance.objects.filter(is_projected=True).values_list("date", flat=True)
+        )
+        # Mondays and Fridays up to valid_until, minus the days already scraped.
+        self.assertEqual(projected, [today + timedelta(days=d) for d in (4, 11, 14, 18)])
+        self.assertEqual(len(changes.inserted), 4)
+
+        # A provider returning the flight overwrites the projection in place.
+        real = FlightInstance(
+            route=route, date=today + timedelta(days=4), price_amount="99.00",
+            currency="USD", available_seats=9, cabin_class="economy",
+        )
+        changes = reconcile_flights(flight_scope("SXM", "DOM", real.date, [real]), [real])
+        self.assertEqual(len(changes.updated), 1)
+        self.assertFalse(FlightInstance.objects.get(date=real.date).is_projected)
+
+        self.assertFalse(project_schedules(today=today, horizon_days=42, validity_days=400))
+
+
+class SearchMissRefreshTests(APITestCase):
+    def test_empty_search_queues_one_deduplicated_fetch(self) -> None:
+        dom = Location.objects.create(code="DOM", name="Douglas-Charles")
+        Location.objects.create(code="DMROS", name="Roseau Ferry Terminal", location_type="PRT", parent=dom)
+        Location.objects.create(code="ANU", name="V.C. Bird")
+        day = timezone.localdate() + timedelta(days=3)
+        url = f"/api/routes/search/?origin=ANU&destination=DMROS&date={day}"
+
+        response = self.client.get(url)
+        self.assertTrue(response.data["refreshing"])
+        self.client.get(url + "&filter=flight")
+
+        job = FetchJob.objects.get()
+        self.assertEqual((job.kind, job.origin, job.destination), ("flight", "ANU", "DOM"))
+        self.assertFalse(enqueue("flight", "ANU", "DOM", timezone.localdate() - timedelta(days=1)))
+        with self.settings(SCHEDULE_PROJECTION_HORIZON_DAYS=42):
+            self.assertFalse(enqueue("flight", "ANU", "DOM", timezone.localdate() + timedelta(days=43)))
+        self.assertEqual(FetchJob.objects.count(), 1)
+
+    def test_worker_leaves_flight_jobs_queued_once_the_daily_budget_is_spent(self) -> None:
+        day = timezone.localdate() + timedelta(days=3)
+        enqueue("flight", "ANU", "DOM", day)
+        IngestRun.objects.create(command="fetch_duffel_routes", provider="duffel", api_calls=5)
+
+        with self.settings(DUFFEL_DAILY_BUDGET=5), mock.patch("core.providers.duffel.DuffelAdapter.segments") as segments:
+            call_command("run_fetch_worker", "--once", stdout=io.StringIO())
+        segments.assert_not_called()
+        self.assertEqual(FetchJob.objects.get().status, "pending")
+
+    def test_stalled_jobs_are_requeued_and_failed_jobs_cool_down(self) -> None:
+        day = timezone.localdate() + timedelta(days=3)
+        enqueue("flight", "ANU", "DOM", day)
+        job = claim_next()
+        # The worker dies without finishing the job.
+        FetchJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - RUNNING_TIMEOUT * 2)
+        self.assertEqual(claim_next().pk, job.pk)
+
+        job.refresh_from_db()
+        job.attempts = MAX_ATTEMPTS
+        finish(job, error="Duffel is down")
+        self.assertEqual(job.status, "failed")
+        self.assertFalse(enqueue("flight", "ANU", "DOM", day))
+        self.assertEqual(FetchJob.objects.count(), 1)
+
+
+class SearchDemandTests(APITestCase):
+    @override_settings(DEMAND_FLUSH_SECONDS=3600)
+    def test_only_resolved_searches_are_counted_in_batches(self) -> None:
+        # Searches buffered by earlier tests.
+        demand.flush()
+        SearchDemand.objects.all().delete()
+        cache.clear()
+        Location.objects.create(code="ANU", name="V.C. Bird")
+        Location.objects.create(code="DOM", name="Douglas-Charles")
+        day = timezone.localdate() + timedelta(days=5)
+
+        self.assertEqual(self.client.get(f"/api/routes/search/?origin=XXX&destination=DOM&date={day}").status_code, 400)
+        url = f"/api/routes/search/?origin=ANU&destination=DOM&date={day}"
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)["X-Cache"], "HIT")
+        self.assertFalse(SearchDemand.objects.exists())
+
+        self.assertEqual(demand.flush(), 1)
+        row = SearchDemand.objects.get()
+        self.assertEqual((row.origin, row.destination, row.searches), ("ANU", "DOM", 2))
@@ -0,0 +1,169 @@
+"""
+Persistent registry of the flight network discovered by the ingesters.
+
+`fetch_duffel_routes` (phase 1) and `fetch_routes` (phase 0) used to rebuild
+their list of valid O/D pairs from scratch on every run, paying for probes
+against a network that rarely changes. `TopologyRegistry` keeps those pairs
+as `NetworkEdge` rows and answers, per pair, whether a fresh probe is due:
+
+- the pair was never probed, or its last probe is older than the TTL, or
+- the rolling sweep has found nothing for it `EMPTY_STREAK_LIMIT` times in a
+  row, which suggests the service has been cut.
+
+Where a command sweeps the return leg of a pair it only probed one way, the
+return leg is kept as a mirrored edge (`mirror()`): it follows the probe of
+its forward edge, and its own empty streak makes that forward edge due.
+
+Everything else is served from the registry, so a warm run goes straight to
+the sweep.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import NetworkEdge
+
+logger = logging.getLogger(__name__)
+
+
+class TopologyRegistry:
+    def __init__(
+        self,
+        provider: str,
+        ttl: Optional[timedelta] = None,
+        empty_limit: Optional[int] = None,
+        force: bool = False,
+    ) -> None:
+        self.provider = provider
+        self.ttl = ttl or timedelta(days=getattr(settings, "NETWORK_TOPOLOGY_TTL_DAYS", 7))
+        self.empty_limit = empty_limit or getattr(settings, "NETWORK_EMPTY_STREAK_LIMIT", 6)
+        # Treat every edge as due, e.g. after adding hubs to the configuration.
+        self.force = force
+        self.edges = {
+            (edge.origin, edge.destination): edge
+            for edge in NetworkEdge.objects.filter(provider=provider)
+        }
+        self.probes = 0
+        self.reused = 0
+
+    def is_due(self, origin: str, dest: str, now: Optional[datetime] = None) -> bool:
+        edge = self.edges.get((origin, dest))
+        if self.force or edge is None or edge.last_probed_at is None:
+            return True
+        if edge.is_active and edge.empty_streak >= self.empty_limit:
+            return True
+        reverse = self._mirrored(origin, dest)
+        if reverse and reverse.is_active and reverse.empty_streak >= self.empty_limit:
+            return True
+        return (now or timezone.now()) - edge.last_probed_at >= self.ttl
+
+    def is_active(self, origin: str, dest: str) -> bool:
+        edge = self.edges.get((origin, dest))
+        return bool(edge and edge.is_active)
+
+    def check(self, origin: str, dest: str, probe: Callable[[], Optional[bool]]) -> bool:
+        """
+        Returns whether the pair is served, calling `probe` first if the edge
+        is due. A probe returning None (no answer, e.g. out of budget or a
+        failed request) leaves the stored edge untouched.
+        """
+        if self.is_due(origin, dest):
+            found = probe()
+            if found is not None:
+                self.record(origin, dest, found, probe=True)
+        else:
+            self.reused += 1
+        return self.is_active(origin, dest)
+
+    def active_destinations(self, origin: str) -> set[str]:
+        return {d for (o, d), edge in self.edges.items() if o == origin and edge.is_active}
+
+    def origin_is_due(self, origin: str) -> bool:
+        """Whether a per-origin probe (e.g. Amadeus direct destinations) is due."""
+        known = [d for o, d in self.edges if o == origin]
+        return not known or any(self.is_due(origin, d) for d in known)
+
+    def record(self, origin: str, dest: str, found: bool, probe: bool = False) -> None:
+        """
+        Stores the outcome of a call for a pair.
+
+        A probe creates the edge if needed and sets its active state from the
+        result. A sweep result only updates edges the registry already holds:
+        hits refresh `last_confirmed_at`, misses extend the empty streak.
+        """
+        if probe:
+            self.probes += 1
+        self._update(origin, dest, found, probe)
+
+    def record_destinations(self, origin: str, destinations: Iterable[str]) -> None:
+        """Applies a per-origin probe: listed destinations are confirmed, the rest lapse."""
+        self.probes += 1
+        destinations = set(destinations)
+        for dest in destinations | {d for o, d in self.edges if o == origin}:
+            self._update(origin, dest, dest in destinations, probe=True)
+
+    def mirror(self, origin: str, dest: str) -> None:
+        """
+        Tracks dest->origin, swept on the strength of the origin->dest probe,
+        as a mirror of that edge so its sweep results are recorded as well.
+        """
+        forward = self.edges.get((origin, dest))
+        if forward is None or forward.last_probed_at is None:
+            return
+        edge = self.edges.get((dest, origin))
+        if edge is None:
+            if not forward.is_active:
+                return
+            edge = NetworkEdge(provider=self.provider, origin=dest, destination=origin)
+            self.edges[(dest, origin)] = edge
+        elif edge.last_probed_at == forward.last_probed_at:
+            return
+        edge.is_active = forward.is_active
+        edge.last_probed_at = forward.last_probed_at
+        if forward.is_active:
+            edge.first_seen_at = edge.first_seen_at or forward.last_confirmed_at
+            edge.last_confirmed_at = forward.last_confirmed_at
+            edge.empty_streak = 0
+        edge.save()
+
+    def _mirrored(self, origin: str, dest: str) -> Optional[NetworkEdge]:
+        # A mirror carries the probe time of its forward edge.
+        forward, reverse = self.edges.get((origin, dest)), self.edges.get((dest, origin))
+        if forward and reverse and reverse.last_probed_at == forward.last_probed_at:
+            return reverse
+        return None
+
+    def _update(self, origin: str, dest: str, found: bool, probe: bool) -> None:
+        edge = self.edges.get((origin, dest))
+        if edge is None:
+            if not probe:
+                return
+            edge = NetworkEdge(provider=self.provider, origin=origin, destination=dest)
+            self.edges[(origin, dest)] = edge
+
+        now = timezone.now()
+        if found:
+            edge.first_seen_at = edge.first_seen_at or now
+            edge.last_confirmed_at = now
+            edge.empty_streak = 0
+            edge.is_active = True
+        else:
+            edge.empty_streak += 1
+            if probe and edge.is_active:
+                edge.is_active = False
+                if edge.pk:
+                    logger.info(f"Topology edge lapsed: {edge}")
+        if probe:
+            edge.last_probed_at = now
+        edge.save()
+
+    def stats(self) -> str:
+        active = sum(edge.is_active for edge in self.edges.values())
+        return (
+            f"{self.provider} topology: {active} active edges, "
+            f"{self.probes} probed, {self.reused} reused"
+        )
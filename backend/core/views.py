@@ -2,20 +2,32 @@ from rest_framework import viewsets, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from datetime import timedelta, datetime
-from django.core.cache import cache
 from django.http import HttpRequest
 from django_filters.rest_framework import DjangoFilterBackend
-from typing import Any
+from typing import Any, Optional
 from rest_framework.request import Request
 
-from .models import Location, Route, Sailing, FlightInstance, Carrier, ReportedIssue
+from .cache import cache
+from .demand import count as count_demand
+from .fares import cheapest_per_day, price_trend
+from .jobs import enqueue_search_miss
+from .legs import group_of, location_groups
+from .metrics import SEARCH_STAGE_SECONDS, record_cache
+from .models import (
+    Location,
+    Route,
+    Sailing,
+    FlightInstance,
+    Carrier,
+    ReportedIssue,
+)
+from .search import BOOKABLE_FLIGHTS, get_engine
 from .serializers import (
     LocationSerializer,
     RouteSerializer,
     SailingSerializer,
     CarrierSerializer,
     ReportedIssueSerializer,
-    ItineraryLegSerializer,
 )
 
 class ItineraryFilterBackend(DjangoFilterBackend):
@@ -50,7 +62,28 @@ class ItineraryOrderingFilter(filters.OrderingFilter):
         return sorted(queryset, key=lambda x: 1 if any(leg.get("is_ferry", False) for leg in x["legs"]) else 0, reverse=True)
 
 
-class LocationViewSet(viewsets.ReadOnlyModelViewSet):
+class CachedResponseMixin:
+    """
+    Response-cache lookups that report their result: counted in
+    `prop_cache_requests_total` and returned in an `X-Cache: HIT|MISS`
+    header, which `replay_access_log` aggregates into hit ratios.
+    """
+    cache_hit: Optional[bool] = None
+
+    def cached_response(self, endpoint: str, key: str) -> Any:
+        cached = cache.get(key)
+        self.cache_hit = bool(cached)
+        record_cache(endpoint, self.cache_hit)
+        return cached
+
+    def finalize_response(self, request: Request, response: Response, *args: Any, **kwargs: Any) -> Response:
+        response = super().finalize_response(request, response, *args, **kwargs)  # type: ignore[misc]
+        if self.cache_hit is not None:
+            response["X-Cache"] = "HIT" if self.cache_hit else "MISS"
+        return response
+
+
+class LocationViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for listing available Locations (Airports and Ferry Ports).
     
@@ -66,10 +99,12 @@ class LocationViewSet(viewsets.ReadOnlyModelViewSet):
         .all()
     )
     serializer_class = LocationSerializer
+    # Declared query budgets per action, enforced by core.middleware.QueryBudgetMiddleware.
+    query_budgets = {"list": 2, "retrieve": 2}
 
     def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
 
-        cached = cache.get("prop_locations_list")
+        cached = self.cached_response("locations", "prop_locations_list")
         if cached:
             return Response(cached)
         response = super().list(request, *args, **kwargs)
@@ -77,13 +112,14 @@ class LocationViewSet(viewsets.ReadOnlyModelViewSet):
         return response
 
 
-class CarrierViewSet(viewsets.ReadOnlyModelViewSet):
+class CarrierViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Carrier.objects.all()
     serializer_class = CarrierSerializer
+    query_budgets = {"list": 1, "retrieve": 1}
 
     def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
 
-        cached = cache.get("prop_carriers_list")
+        cached = self.cached_response("carriers", "prop_carriers_list")
         if cached:
             return Response(cached)
         response = super().list(request, *args, **kwargs)
@@ -92,23 +128,39 @@ class CarrierViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class SailingViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Sailing.objects.all()
+    # The nested RouteSerializer reads both endpoints' parent and children.
+    queryset = Sailing.objects.select_related(
+        "route__carrier", "route__origin__parent", "route__destination__parent"
+    ).prefetch_related("route__origin__sub_locations", "route__destination__sub_locations")
     serializer_class = SailingSerializer
+    query_budgets = {"list": 3, "retrieve": 3}
 
 
 class ReportedIssueViewSet(viewsets.ModelViewSet):
     http_method_names = ["get", "post", "head", "options"]
     queryset = ReportedIssue.objects.all()
     serializer_class = ReportedIssueSerializer
+    query_budgets = {"list": 1, "retrieve": 1}
 
     def perform_create(self, serializer: Any) -> None:
         issue = serializer.save()
         issue.send_notifications()
 
 
-class RouteViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Route.objects.all()
+class RouteViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Route.objects.select_related(
+        "carrier", "origin__parent", "destination__parent"
+    ).prefetch_related("origin__sub_locations", "destination__sub_locations")
     serializer_class = RouteSerializer
+    # search: group map, both locations with their aliases,
+    # the uncached leg sets, hub aliases and, on a miss, the fetch-job enqueue.
+    query_budgets = {
+        "list": 3,
+        "retrieve": 3,
+        "available_dates": 8,
+        "price_history": 10,
+        "search": 18,
+    }
 
     @action(detail=False, methods=["get"], url_path="available-dates")
     def available_dates(self, request: Request) -> Response:
@@ -119,8 +171,10 @@ class RouteViewSet(viewsets.ReadOnlyModelViewSet):
         if not origin_query or not dest_query:
             return Response({"error": "Missing parameters"}, status=400)
 
-        cache_key = f"prop_dates_{origin_query}_{dest_query}"
-        cached = cache.get(cache_key)
+        # Keyed by alias group: DOM and DMROS share one calendar.
+        groups = location_groups()
+        cache_key = f"prop_dates_{group_of(origin_query, groups)}_{group_of(dest_query, groups)}"
+        cached = self.cached_response("available_dates", cache_key)
         if cached:
             return Response(cached)
 
@@ -144,10 +198,10 @@ class RouteViewSet(viewsets.ReadOnlyModelViewSet):
 
         flight_dates = (
             FlightInstance.objects.filter(
+                BOOKABLE_FLIGHTS,
                 route__origin__code__in=origin_aliases,
                 route__destination__code__in=dest_aliases,
                 route__is_active=True,
-                available_seats__gt=0,
             )
             .values_list("date", flat=True)
             .distinct()
@@ -168,6 +222,79 @@ class RouteViewSet(viewsets.ReadOnlyModelViewSet):
         cache.set(cache_key, resp_data, 60 * 15)
         return Response(resp_data)
 
+    @action(detail=False, methods=["get"], url_path="price-history")
+    def price_history(self, request: Request) -> Response:
+        """
+        Fare history between two locations (aliases included).
+
+        Returns the cheapest fare observed for each travel day in
+        [`start`, `end`] (default: the next 30 days) and, when `date` is
+        given, every observed fare change for that day's flights.
+        """
+        origin_query = request.GET.get("origin")
+        dest_query = request.GET.get("destination")
+
+        if not origin_query or not dest_query:
+            return Response({"error": "Missing parameters"}, status=400)
+
+        try:
+            start = (
+                datetime.strptime(request.GET["start"], "%Y-%m-%d").date()
+                if "start" in request.GET
+                else datetime.now().date()
+            )
+            end = (
+                datetime.strptime(request.GET["end"], "%Y-%m-%d").date()
+                if "end" in request.GET
+                else start + timedelta(days=30)
+            )
+            day = (
+                datetime.strptime(request.GET["date"], "%Y-%m-%d").date()
+                if "date" in request.GET
+                else None
+            )
+        except ValueError:
+            return Response({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
+
+        try:
+            origin_loc = (
+                Location.objects.select_related("parent")
+                .prefetch_related("sub_locations", "parent__sub_locations")
+                .get(code=origin_query)
+            )
+            dest_loc = (
+                Location.objects.select_related("parent")
+                .prefetch_related("sub_locations", "parent__sub_locations")
+                .get(code=dest_query)
+            )
+        except Location.DoesNotExist:
+            return Response({"error": "Location not found"}, status=404)
+
+        origin_aliases = origin_loc.resolve_aliases()
+        dest_aliases = dest_loc.resolve_aliases()
+
+        cheapest = cheapest_per_day(origin_aliases, dest_aliases, start, end)
+        resp_data: dict[str, Any] = {
+            "cheapest_by_day": [
+                {"date": d.strftime("%Y-%m-%d"), "price_amount": str(price)}
+                for d, price in cheapest.items()
+            ]
+        }
+        if day is not None:
+            resp_data["trend"] = [
+                {
+                    "observed_at": obs["observed_at"],
+                    "flight_number": obs["flight_number"],
+                    "price_amount": (
+                        str(obs["price_amount"]) if obs["price_amount"] is not None else None
+                    ),
+                    "currency": obs["currency"],
+                    "available_seats": obs["available_seats"],
+                }
+                for obs in price_trend(origin_aliases, dest_aliases, day)
+            ]
+        return Response(resp_data)
+
     @action(detail=False, methods=["get"])
     def search(self, request: Request) -> Response:
         """
@@ -181,15 +308,32 @@ class RouteViewSet(viewsets.ReadOnlyModelViewSet):
         1. Direct routes (single leg, flight or ferry)
         2. Connected routes (two legs: Flight -> Flight, or Flight -> Ferry)
         
+        Search Engines:
+        The legs are paired by an engine from core/search.py: `python`
+        (in-process assembly), `sql` (one CTE that returns only valid pairs)
+        or `materialized` (a lookup in the ValidConnection table refreshed at
+        ingest). Pick one with `?engine=`; the default is SEARCH_ENGINE.
+
         Sliding Window Mechanism:
         It uses a 4-day sliding window. This is essential to catch overnight connections 
         where a late flight on Day 1 connects to an early ferry on Day 2. If no valid 
         itineraries are found on the requested date, it automatically scans subsequent 
         days and returns the first date with availability.
-        
+
+        Projected Flights:
+        Flights projected from a route's weekly pattern (`is_projected`) are
+        offered alongside scraped ones; they have no price or seat count.
+
+        On-Demand Refresh:
+        If the whole window is empty, a deduplicated FetchJob is queued for the
+        pair and the response carries `refreshing: true` until the worker runs.
+
         Performance Optimization:
         Responses are cached in Redis for 5 minutes based on the query parameters to 
-        minimize heavy database computation for popular routes.
+        minimize heavy database computation for popular routes. Origin and
+        destination are keyed by alias group, so DOM and DMROS share an entry,
+        and the candidate legs underneath are cached per group and day
+        (core/legs.py) for every search that touches the same groups.
         """
         origin_query = request.GET.get("origin")
         dest_query = request.GET.get("destination")
@@ -199,216 +343,62 @@ class RouteViewSet(viewsets.ReadOnlyModelViewSet):
         if not origin_query or not dest_query or not target_date_str:
             return Response({"error": "Missing parameters"}, status=400)
 
-        cache_key = f"prop_search_{origin_query}_{dest_query}_{target_date_str}_{transport_filter}"
-        cached = cache.get(cache_key)
-        if cached:
-            return Response(cached)
-
         try:
-            origin_loc = (
-                Location.objects.select_related("parent")
-                .prefetch_related("sub_locations", "parent__sub_locations")
-                .get(code=origin_query)
-            )
-            dest_loc = (
-                Location.objects.select_related("parent")
-                .prefetch_related("sub_locations", "parent__sub_locations")
-                .get(code=dest_query)
-            )
-            target_date = datetime.strptime(target_date_str, "%Y-%m-%d").date()
-        except (Location.DoesNotExist, ValueError):
-            return Response({"error": "Invalid parameters"}, status=400)
-
-        origin_aliases = origin_loc.resolve_aliases()
-        dest_aliases = dest_loc.resolve_aliases()
-
-        # We fetch 4 days of data to allow for overnight bleed into the 4th day
-        # e.g., a late flight on day 1 may connect to an early ferry on day 2.
-        end_date = target_date + timedelta(days=4)
-
-        # --- 1. FETCH DIRECT ROUTES ---
-        # Find direct flights or ferries between the origin and destination directly.
-        direct_flights = FlightInstance.objects.filter(
-            route__origin__code__in=origin_aliases,
-            route__destination__code__in=dest_aliases,
-            date__range=[target_date, end_date],
-            route__is_active=True,
-            available_seats__gt=0,
-        ).select_related(
-            "route", "route__carrier", "route__origin", "route__destination"
-        )
-
-        direct_ferries = Sailing.objects.filter(
-            route__origin__code__in=origin_aliases,
-            route__destination__code__in=dest_aliases,
-            date__range=[target_date, end_date],
-            route__is_active=True,
-        ).select_related(
-            "route", "route__carrier", "route__origin", "route__destination"
-        )
-
-        # --- 2. FETCH CONNECTING ROUTES (LEG 1) ---
-        # Get all flights departing from the origin that do NOT go straight to the destination.
-        # These are potential "Leg 1" flights landing at a hub.
-        leg1_flights = (
-            FlightInstance.objects.filter(
-                route__origin__code__in=origin_aliases,
-                date__range=[target_date, end_date],
-                route__is_active=True,
-                available_seats__gt=0,
-            )
-            .exclude(route__destination__code__in=dest_aliases)
-            .select_related(
-                "route", "route__carrier", "route__origin", "route__destination"
-            )
-        )
-
-        # Determine all unique locations these leg 1 flights land at
-        hub_codes = {f.route.destination.code for f in leg1_flights}
-
-        # Expand these hubs to include their aliases (e.g. an airport and a nearby ferry port)
-        hub_locations = Location.objects.filter(code__in=hub_codes).prefetch_related(
-            "sub_locations", "parent__sub_locations"
-        )
-        expanded_hubs = set()
-        for loc in hub_locations:
-            expanded_hubs.update(loc.resolve_aliases())
-
-        # --- 3. FETCH CONNECTING ROUTES (LEG 2) ---
-        # Get all flights and ferries that depart from these expanded hubs and go to the final destination.
-        leg2_flights = FlightInstance.objects.filter(
-            route__origin__code__in=expanded_hubs,
-            route__destination__code__in=dest_aliases,
-            date__range=[target_date, end_date],
-            route__is_active=True,
-            available_seats__gt=0,
-        ).select_related(
-            "route", "route__carrier", "route__origin", "route__destination"
-        )
-
-        leg2_ferries = Sailing.objects.filter(
-            route__origin__code__in=expanded_hubs,
-            route__destination__code__in=dest_aliases,
-            date__range=[target_date, end_date],
-            route__is_active=True,
-        ).select_related(
-            "route", "route__carrier", "route__origin", "route__destination"
+            engine = get_engine(request.GET.get("engine"))
+        except KeyError:
+            return Response({"error": "Unknown search engine"}, status=400)
+
+        groups = location_groups()
+        cache_key = (
+            f"prop_search_{group_of(origin_query, groups)}_{group_of(dest_query, groups)}"
+            f"_{target_date_str}_{transport_filter}"
         )
+        cached = self.cached_response("search", cache_key)
+        if cached:
+            # Only valid searches are ever cached: cached hits are demand too.
+            count_demand(origin_query, dest_query)
+            return Response(cached)
 
-        # --- 4. ASSEMBLE ITINERARIES ---
-        # We define acceptable connection times based on the mode of transport
-        MIN_CONNECT_FLIGHT = 3600  # 1 Hour: Minimum time to connect plane-to-plane
-        MIN_CONNECT_FERRY = 7200  # 2 Hours: Minimum time to connect plane-to-ferry (accounts for port transit)
-        MAX_CONNECT = 64800 # 18 Hours: Max layover time before we consider it two separate trips
-
-        results = []
-        found_date = target_date
-        date_was_changed = False
-
-        # Loop through the 4-day window looking for a day with valid itineraries
-        for i in range(4):
-            check_date = target_date + timedelta(days=i)
-            next_date = check_date + timedelta(days=1)
-            day_itineraries = []
-
-            for f in [x for x in direct_flights if x.date == check_date]:
-                day_itineraries.append(
-                    {"id": f"f_{f.id}", "legs": [ItineraryLegSerializer(f).data]}
+        with SEARCH_STAGE_SECONDS.labels("aliases", engine.name).time():
+            try:
+                origin_loc = (
+                    Location.objects.select_related("parent")
+                    .prefetch_related("sub_locations", "parent__sub_locations")
+                    .get(code=origin_query)
                 )
-            for s in [x for x in direct_ferries if x.date == check_date]:
-                day_itineraries.append(
-                    {"id": f"s_{s.id}", "legs": [ItineraryLegSerializer(s).data]}
+                dest_loc = (
+                    Location.objects.select_related("parent")
+                    .prefetch_related("sub_locations", "parent__sub_locations")
+                    .get(code=dest_query)
                 )
+                target_date = datetime.strptime(target_date_str, "%Y-%m-%d").date()
+            except (Location.DoesNotExist, ValueError):
+                return Response({"error": "Invalid parameters"}, status=400)
+            count_demand(origin_query, dest_query)
 
-            day_l1 = [f for f in leg1_flights if f.date == check_date]
+            origin_aliases = origin_loc.resolve_aliases()
+            dest_aliases = dest_loc.resolve_aliases()
 
-            l2_candidates_f = [
-                f for f in leg2_flights if f.date in (check_date, next_date)
-            ]
-            l2_candidates_s = [
-                s for s in leg2_ferries if s.date in (check_date, next_date)
-            ]
+        result = engine(origin_aliases, dest_aliases, target_date).search()
+        results = result.results
+
+        # Nothing in the whole window: queue an on-demand fetch for this pair so
+        # the next search can find it, and tell the client a refresh is running.
+        refreshing = False
+        if not results:
+            refreshing = enqueue_search_miss(origin_loc, dest_loc, target_date)
 
-            # Check combinations of Leg 1 and Leg 2 for valid connections
-            for l1 in day_l1:
-                if not l1.route.arrival_time:
-                    continue
-                l1_arr_dt = datetime.combine(l1.date, l1.route.arrival_time)
-                l1_dest_aliases = l1.route.destination.resolve_aliases()
-
-                for l2 in l2_candidates_f:
-                    if l2.route.origin.code not in l1_dest_aliases:
-                        continue
-                    if not l2.route.departure_time:
-                        continue
-
-                    l2_dep_dt = datetime.combine(l2.date, l2.route.departure_time)
-                    gap = (l2_dep_dt - l1_arr_dt).total_seconds()
-
-                    if MIN_CONNECT_FLIGHT <= gap <= MAX_CONNECT:
-                        l1_data = ItineraryLegSerializer(l1).data
-                        l2_data = ItineraryLegSerializer(l2).data
-
-                        hours, mins = int(gap // 3600), int((gap % 3600) // 60)
-
-                        # Dynamically flag if the layover spills into the next day
-                        if l1.date != l2.date:
-                            l1_data["layover_text"] = (
-                                f"🌙 Overnight Layover: {hours}h {mins}m in {l1.route.destination.city} • Connect via Flight"
-                            )
-                        else:
-                            l1_data["layover_text"] = (
-                                f"✈️ {hours}h {mins}m Layover in {l1.route.destination.city} • Connect via Flight"
-                            )
-
-                        day_itineraries.append(
-                            {"id": f"c_ff_{l1.id}_{l2.id}", "legs": [l1_data, l2_data]}
-                        )
-
-                for l2_s in l2_candidates_s:
-                    if l2_s.route.origin.code not in l1_dest_aliases:
-                        continue
-                    if not l2_s.departure_time:
-                        continue
-
-                    l2_dep_dt = datetime.combine(l2_s.date, l2_s.departure_time)
-                    gap = (l2_dep_dt - l1_arr_dt).total_seconds()
-
-                    if MIN_CONNECT_FERRY <= gap <= MAX_CONNECT:
-                        l1_data = ItineraryLegSerializer(l1).data
-                        l2_data = ItineraryLegSerializer(l2_s).data
-
-                        hours, mins = int(gap // 3600), int((gap % 3600) // 60)
-
-                        # Dynamically flag if the layover spills into the next day
-                        if l1.date != l2_s.date:
-                            l1_data["layover_text"] = (
-                                f"🌙 Overnight Layover: {hours}h {mins}m in {l1.route.destination.city} • Connect via Ferry"
-                            )
-                        else:
-                            l1_data["layover_text"] = (
-                                f"⛴️ {hours}h {mins}m Layover in {l1.route.destination.city} • Connect via Ferry"
-                            )
-
-                        day_itineraries.append(
-                            {"id": f"c_fs_{l1.id}_{l2_s.id}", "legs": [l1_data, l2_data]}
-                        )
-
-            if day_itineraries:
-                results = day_itineraries
-                if i > 0:
-                    date_was_changed = True
-                    found_date = check_date
-                break
-
-        results = ItineraryFilterBackend().filter_queryset(request, results, self)
-        results = ItineraryOrderingFilter().filter_queryset(request, results, self)
+        with SEARCH_STAGE_SECONDS.labels("filter", engine.name).time():
+            results = ItineraryFilterBackend().filter_queryset(request, results, self)
+            results = ItineraryOrderingFilter().filter_queryset(request, results, self)
 
         response_data = {
-            "date_was_changed": date_was_changed,
-            "found_date": found_date.strftime("%Y-%m-%d"),
+            "date_was_changed": result.date_was_changed,
+            "found_date": result.found_date.strftime("%Y-%m-%d"),
             "results": results,
+            "refreshing": refreshing,
         }
 
-        cache.set(cache_key, response_data, 60 * 5)
+        # Keep "refreshing" misses short-lived so fetched data shows up quickly.
+        cache.set(cache_key, response_data, 60 if refreshing else 60 * 5)
         return Response(response_data)
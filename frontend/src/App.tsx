@@ -146,7 +146,9 @@ function App() {
       setItineraries(data.results);
       if (data.results.length === 0) {
         setError(
-          `No routes found from ${origin} to ${destination} within the next 3 days.`,
+          data.refreshing
+            ? `No routes found from ${origin} to ${destination} yet. We're fetching fresh schedules for this route, so try again in a few minutes.`
+            : `No routes found from ${origin} to ${destination} within the next 3 days.`,
         );
       }
     } catch (err: any) {
@@ -465,6 +467,8 @@ function App() {
                               <span>
                                 {leg.is_ferry
                                   ? "General Seating"
+                                  : leg.is_projected
+                                  ? "Projected Schedule"
                                   : `${leg.available_seats !== undefined && leg.available_seats !== null ? leg.available_seats : "--"} Seats Left`}
                               </span>
                             </div>
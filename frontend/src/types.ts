@@ -33,6 +33,8 @@ export interface ApiLeg {
   
   layover_text?: string;
   last_seen_at?: string;
+  // Provisional departure projected from the route's weekly pattern
+  is_projected?: boolean;
 }
 
 export interface Itinerary {
@@ -44,4 +46,6 @@ export interface ApiResponse {
   date_was_changed: boolean;
   found_date: string;
   results: Itinerary[];
+  // True when the backend queued an on-demand fetch for an empty search
+  refreshing?: boolean;
 }
\ No newline at end of file